@@ -0,0 +1,144 @@
+"""Read-only JSON API for users, posts and tags.
+
+Every response carries a strong ETag built from the rows' ids and
+updated_at stamps, plus Cache-Control. Clients and caches that send
+If-None-Match get a bodyless 304 when nothing changed. List endpoints work
+that out from a narrow (id, updated_at) query and only load full rows when
+the page really has to be sent. Detail responses also carry the row's
+updated_at as Last-Modified, for If-Modified-Since. Lists don't: a row
+dropping off a page doesn't make any remaining row newer, so a date can't
+tell that the page changed.
+"""
+from hashlib import sha1
+
+from flask import Blueprint, current_app, jsonify, request, url_for
+from sqlalchemy.orm import selectinload
+from werkzeug.http import is_resource_modified
+from models import db, User, Post, Tag, utc
+from queries import keyset_page, POST_ORDER, USER_ORDER, TAG_ORDER
+from tagindex import tag_index
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def user_json(user):
+    return {
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'image_url': user.image_url,
+        'updated_at': user.updated_at.isoformat(),
+    }
+
+
+def post_json(post):
+    return {
+        'id': post.id,
+        'title': post.title,
+        'content': post.content,
+        'created_at': post.created_at.isoformat(),
+        'updated_at': post.updated_at.isoformat(),
+        'user_id': post.user_id,
+        'tag_ids': sorted(tag.id for tag in post.tags),
+    }
+
+
+def tag_json(tag):
+    return {
+        'id': tag.id,
+        'name': tag.name,
+        'updated_at': tag.updated_at.isoformat(),
+    }
+
+
+def versions_etag(kind, versions):
+    """Strong ETag for a run of (id, updated_at) pairs."""
+    digest = sha1(kind.encode())
+    for id, updated_at in versions:
+        digest.update(f'{id}:{updated_at.isoformat()};'.encode())
+    return digest.hexdigest()
+
+
+def conditional(etag, last_modified, build):
+    """Answer 304 if the client's copy is current, otherwise the JSON returned by build()."""
+    if last_modified is not None:
+        last_modified = utc(last_modified)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = jsonify(build())
+    else:
+        response = current_app.response_class(status=304)
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('API_MAX_AGE', 30)
+    return response
+
+
+def single(model, id, to_json):
+    row = model.query.get_or_404(id)
+    etag = versions_etag(model.__tablename__, [(row.id, row.updated_at)])
+    return conditional(etag, row.updated_at, lambda: to_json(row))
+
+
+def listing(endpoint, model, order, to_json, descending=False, options=()):
+    """Serve one keyset page of `model`, loading the full rows only on a cache miss."""
+    columns = {col.key for col in order} | {'id', 'updated_at'}
+    versions_query = db.session.query(*[getattr(model, key) for key in columns])
+    versions = keyset_page(versions_query, order, descending=descending,
+                           after=request.args.get('after'), before=request.args.get('before'))
+
+    etag = versions_etag(f'{model.__tablename__}:{versions.prev_cursor}:{versions.next_cursor}',
+                         [(row.id, row.updated_at) for row in versions.items])
+
+    def build():
+        ids = [row.id for row in versions.items]
+        rows = {row.id: row for row in model.query.options(*options).filter(model.id.in_(ids))}
+        return {
+            'items': [to_json(rows[id]) for id in ids if id in rows],
+            'next': url_for(endpoint, after=versions.next_cursor) if versions.next_cursor else None,
+            'prev': url_for(endpoint, before=versions.prev_cursor) if versions.prev_cursor else None,
+        }
+
+    return conditional(etag, None, build)
+
+
+@bp.route('/users')
+def users():
+    return listing('api.users', User, USER_ORDER, user_json)
+
+
+@bp.route('/users/<int:user_id>')
+def user(user_id):
+    return single(User, user_id, user_json)
+
+
+@bp.route('/posts')
+def posts():
+    return listing('api.posts', Post, POST_ORDER, post_json, descending=True,
+                   options=[selectinload(Post.tags)])
+
+
+@bp.route('/posts/<int:post_id>')
+def post(post_id):
+    return single(Post, post_id, post_json)
+
+
+@bp.route('/tags')
+def tags():
+    return listing('api.tags', Tag, TAG_ORDER, tag_json)
+
+
+@bp.route('/tags/<int:tag_id>')
+def tag(tag_id):
+    return single(Tag, tag_id, tag_json)
+
+
+@bp.route('/tags/complete')
+def complete_tags():
+    """The most used tags whose names start with ?q=, for the tag pickers."""
+    limit = current_app.config['TAG_COMPLETE_LIMIT']
+    matches = tag_index.complete(request.args.get('q', '').strip(), limit)
+    return jsonify({'items': [{'id': id, 'name': name, 'post_count': post_count}
+                              for id, name, post_count in matches]})
@@ -1,34 +1,105 @@
 """Blogly application."""
 
-from flask import Flask, request, render_template, redirect
-from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, User, Post, Tag
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SECRET_KEY'] = "blog-blog-blog"
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-debug = DebugToolbarExtension(app)
-
-connect_db(app)
-
-@app.route('/')
+import os
+
+from flask import Flask, Blueprint, current_app, request, render_template, redirect, abort, jsonify, url_for
+from flask_migrate import Migrate
+from cli import blogly
+from config import configs
+from models import db, connect_db, User, Post, Tag, PostTag
+from cache import page_cache, post_labels
+from fragments import fragments
+from metrics import metrics
+from replicas import replicas
+from timeline import timeline
+from tagindex import tag_index
+from catalog import post_catalog
+from avatars import avatars, bp as avatars_bp
+from assets import assets, bp as assets_bp
+from compression import compressor
+from jobs import jobs, delete_user, delete_tag, bp as jobs_bp
+from queries import post_page, user_page, tag_page, posts_for_user, posts_for_tag
+import api
+import feeds
+import search
+
+bp = Blueprint('blogly', __name__)
+migrate = Migrate(compare_type=True)
+
+def create_app(config_name=None, **config):
+    """Build the app from a named profile in config.py, with any overrides applied on top."""
+    app = Flask(__name__)
+    app.config.from_object(configs[config_name or os.environ.get('BLOGLY_CONFIG', 'development')])
+    app.config.update(config)
+
+    if not app.config['SQLALCHEMY_DATABASE_URI']:
+        raise RuntimeError('Set DATABASE_URL to the database Blogly should use.')
+
+    # Registered before anything else that changes responses, so it runs after them.
+    compressor.init_app(app)
+
+    if app.config.get('DEBUG_TB_ENABLED', app.debug):
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    migrate.init_app(app, db)
+    replicas.init_app(app)
+    page_cache.init_app(app)
+    timeline.init_app(app)
+    jobs.init_app(app)
+    tag_index.init_app(app)
+    post_catalog.init_app(app)
+    avatars.init_app(app)
+    assets.init_app(app)
+    metrics.init_app(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(search.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(avatars_bp)
+    app.register_blueprint(assets_bp)
+    app.register_blueprint(feeds.bp)
+    app.register_blueprint(jobs_bp)
+    app.cli.add_command(blogly)
+    fragments.init_app(app)
+
+    return app
+
+def tag_choices():
+    """Every tag, for a checkbox each, or None if there are too many and the form should search instead."""
+    return tag_index.choices(current_app.config['TAG_CHECKBOX_LIMIT'])
+
+def ids_from_form(field, model=None):
+    """Read the ids for `field`, rejecting the request if any aren't ids of an existing `model`."""
+    try:
+        ids = {int(value) for value in request.form.getlist(field)}
+    except ValueError:
+        abort(400)
+
+    if ids and model is not None:
+        found = {id for (id,) in db.session.query(model.id).filter(model.id.in_(ids))}
+        if found != ids:
+            abort(400)
+
+    return ids
+
+@bp.route('/')
+@page_cache.cached
 def get_homepage():
-    posts = Post.query.order_by(Post.created_at.desc()).limit(5).all()
+    posts = timeline.recent('posts', 5)
+    page_cache.depends_on('posts', *post_labels(posts))
     return render_template('index.html', posts=posts)
 
-@app.route('/users')
+@bp.route('/users')
 def list_users():
-    users=User.query.order_by(User.last_name, User.first_name).all()
-    return render_template('users.html', users=users)
+    page = user_page(after=request.args.get('after'), before=request.args.get('before'))
+    return render_template('users.html', users=page.items, page=page)
 
-@app.route('/users/new')
+@bp.route('/users/new')
 def new_user():
     return render_template('new_user.html')
 
-@app.route('/users/new', methods=['POST'])
+@bp.route('/users/new', methods=['POST'])
 def add_user():
     first_name = request.form['first_name']
     last_name = request.form['last_name']
@@ -41,18 +112,20 @@ def add_user():
 
     return redirect(f'/users/{new_user.id}')
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@page_cache.cached
 def user_detail(user_id):
     user = User.query.get_or_404(user_id)
-    posts = user.posts
+    posts = posts_for_user(user_id)
+    page_cache.depends_on(f'user:{user_id}')
     return render_template('user_detail.html', user=user, posts=posts)
 
-@app.route('/users/<int:user_id>/edit')
+@bp.route('/users/<int:user_id>/edit')
 def user_edit(user_id):
     user = User.query.get_or_404(user_id)
     return render_template('user_edit.html', user=user)
 
-@app.route('/users/<int:user_id>/edit', methods=['POST'])
+@bp.route('/users/<int:user_id>/edit', methods=['POST'])
 def user_update(user_id):
     user = User.query.get_or_404(user_id)
 
@@ -64,68 +137,67 @@ def user_update(user_id):
 
     return redirect('/users')
 
-@app.route('/users/<int:user_id>/delete', methods=['POST'])
+@bp.route('/users/<int:user_id>/delete', methods=['POST'])
 def user_delete(user_id):
     user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
+    job = jobs.enqueue(delete_user, user.id, description=f'Deleting {user.full_name}', next_url='/users')
 
-    return redirect('/users')
+    return redirect(url_for('jobs.status', job_id=job.id))
 
-@app.route('/posts')
+@bp.route('/posts')
+@page_cache.cached
 def show_all_posts():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    return render_template('posts.html', posts=posts)
+    page = post_page(after=request.args.get('after'), before=request.args.get('before'))
+    page_cache.depends_on('posts', *post_labels(page.items))
+    return render_template('posts.html', posts=page.items, page=page)
 
-@app.route('/users/<int:user_id>/posts/new')
+@bp.route('/users/<int:user_id>/posts/new')
 def new_post(user_id):
     user = User.query.get_or_404(user_id)
-    tags = Tag.query.all()
+    tags = tag_choices()
 
     return render_template('new_post.html', user=user, tags=tags)
 
-@app.route('/users/<int:user_id>/posts/new', methods=['POST'])
+@bp.route('/users/<int:user_id>/posts/new', methods=['POST'])
 def add_post(user_id):
     title = request.form['title']
     content = request.form['content']
-    tags_id_list = request.form.getlist('tag')
-
-    tag_list = [Tag.query.get(tag_id) for tag_id in tags_id_list]
+    tag_ids = ids_from_form('tag', Tag)
 
     new_post = Post(title=title, content=content, user_id=user_id)
     db.session.add(new_post)
-    new_post.tags = tag_list
+    db.session.flush()
+    PostTag.set_tags(new_post.id, tag_ids)
     db.session.commit()
 
     return redirect(f'/users/{user_id}')
 
-@app.route('/posts/<int:post_id>')
+@bp.route('/posts/<int:post_id>')
 def post_detail(post_id):
     post = Post.query.get_or_404(post_id)
     user = post.user
     return render_template('post_detail.html', user=user, post=post)
 
-@app.route('/posts/<int:post_id>/edit')
+@bp.route('/posts/<int:post_id>/edit')
 def post_edit(post_id):
     post = Post.query.get_or_404(post_id)
     user = post.user
-    tags = Tag.query.all()
+    tags = tag_choices()
     return render_template('post_edit.html', user=user, post=post, tags=tags)
 
-@app.route('/posts/<int:post_id>/edit', methods=['POST'])
+@bp.route('/posts/<int:post_id>/edit', methods=['POST'])
 def post_update(post_id):
     post = Post.query.get_or_404(post_id)
-    tags_id_list = request.form.getlist('tag')
-    tag_list = [Tag.query.get(tag_id) for tag_id in tags_id_list]
+    tag_ids = ids_from_form('tag', Tag)
 
     post.title = request.form['title']
     post.content = request.form['content']
-    post.tags = tag_list
+    PostTag.set_tags(post.id, tag_ids)
     db.session.commit()
 
     return redirect(f'/users/{post.user_id}')
 
-@app.route('/posts/<int:post_id>/delete', methods=['POST'])
+@bp.route('/posts/<int:post_id>/delete', methods=['POST'])
 def post_delete(post_id):
     post = Post.query.get_or_404(post_id)
     user_id=post.user_id
@@ -134,57 +206,64 @@ def post_delete(post_id):
 
     return redirect(f'/users/{user_id}')
 
-@app.route('/tags')
+@bp.route('/tags')
 def all_tags():
-    tags = Tag.query.all()
-    return render_template('tags.html', tags=tags)
+    sort = request.args.get('sort', 'name')
+    page = tag_page(after=request.args.get('after'), before=request.args.get('before'), sort=sort)
+    return render_template('tags.html', tags=page.items, page=page, sort=sort)
 
-@app.route('/tags/new')
+@bp.route('/tags/new')
 def new_tag():
-    posts = Post.query.all()
+    posts = post_catalog.entries()
     return render_template('new_tag.html', posts=posts)
 
-@app.route('/tags/new', methods=["POST"])
+@bp.route('/tags/new', methods=["POST"])
 def add_tag():
     name = request.form['name']
-    posts_id_list = request.form.getlist('post')
-    post_list = [Post.query.get(post_id) for post_id in posts_id_list]
+    post_ids = ids_from_form('post', Post)
 
     new_tag = Tag(name=name)
-    new_tag.posts = post_list
     db.session.add(new_tag)
+    db.session.flush()
+    PostTag.set_posts(new_tag.id, post_ids)
     db.session.commit()
 
     return redirect('/tags')
 
-@app.route('/tags/<int:tag_id>')
+@bp.route('/tags/<int:tag_id>')
+@page_cache.cached
 def tag_detail(tag_id):
     tag = Tag.query.get_or_404(tag_id)
-    posts = tag.posts
+    posts = posts_for_tag(tag_id)
+    page_cache.depends_on(f'tag:{tag_id}', *post_labels(posts))
     return render_template('tag_detail.html', tag=tag, posts=posts)
 
-@app.route('/tags/<int:tag_id>/edit')
+@bp.route('/tags/<int:tag_id>/edit')
 def tag_edit(tag_id):
     tag = Tag.query.get_or_404(tag_id)
-    posts = Post.query.all()
+    posts = post_catalog.entries()
     return render_template('tag_edit.html', tag=tag, posts=posts)
 
-@app.route('/tags/<int:tag_id>/edit', methods=['POST'])
+@bp.route('/tags/<int:tag_id>/edit', methods=['POST'])
 def tag_update(tag_id):
     tag = Tag.query.get_or_404(tag_id)
-    posts_id_list = request.form.getlist('post')
-    post_list = [Post.query.get(post_id) for post_id in posts_id_list]
+    post_ids = ids_from_form('post', Post)
+    # The posts the form listed; others may have been added since its catalog was loaded.
+    shown_ids = ids_from_form('shown')
 
     tag.name = request.form['name']
-    tag.posts = post_list
+    PostTag.set_posts(tag.id, post_ids, among=shown_ids)
     db.session.commit()
 
     return redirect('/tags')
 
-@app.route('/tags/<int:tag_id>/delete', methods=['POST'])
+@bp.route('/tags/<int:tag_id>/delete', methods=['POST'])
 def tag_delete(tag_id):
     tag = Tag.query.get_or_404(tag_id)
-    db.session.delete(tag)
-    db.session.commit()
+    job = jobs.enqueue(delete_tag, tag.id, description=f'Deleting {tag.name}', next_url='/tags')
+
+    return redirect(url_for('jobs.status', job_id=job.id))
 
-    return redirect('/tags')
\ No newline at end of file
+@bp.route('/cache/stats')
+def cache_stats():
+    return jsonify(page_cache.stats())
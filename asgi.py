@@ -0,0 +1,425 @@
+"""ASGI entry point that serves the busiest read pages asynchronously.
+
+    uvicorn --factory asgi:create_asgi_app --workers 4
+
+The home page, the post listing and the post, user and tag pages are
+served by coroutines over an asyncpg connection pool (asyncpg is an optional
+dependency, only needed here), so a slow query holds a connection but not a
+thread. Their rows are turned into transient instances of the usual models
+and rendered from the usual templates by an async Jinja environment.
+Everything else, including every write, goes to the ordinary Flask app,
+which runs in a small thread pool and whose streamed responses, like the
+Atom feeds, are passed on chunk by chunk.
+
+The async pages share the page cache with the Flask views they stand in
+for, and are timed into the same /metrics histograms and Server-Timing
+header. They always read from the primary, as if every client had the
+replica cookie.
+
+SQLAlchemy 1.3 has no asyncio support, so the read queries are written out
+here in SQL. They follow the ones in queries.py and should be kept in step
+with them.
+"""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from time import perf_counter
+from types import SimpleNamespace
+
+from jinja2 import Environment
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.http import parse_accept_header
+from werkzeug.urls import url_decode
+from assets import asset_url, asset_integrity
+from avatars import avatar_url
+from cache import page_cache, post_labels
+from compression import compress_body, gzip_body
+from fragments import fragments
+from metrics import metrics, RequestStats
+from models import User, Post, Tag
+from queries import Page, PER_PAGE, POST_ORDER, LISTING_DEFERRED, encode_cursor, decode_cursor
+
+
+def column_list(model, prefix='', exclude=()):
+    return ', '.join(f'{prefix}{col.name}' for col in model.__table__.columns if col.name not in exclude)
+
+
+def listing_columns(prefix=''):
+    """The posts columns listings read, leaving out those post_listing() defers.
+
+    content is only read for posts with no excerpt yet, for Post.summary.
+    """
+    columns = column_list(Post, prefix, exclude={column.key for column in LISTING_DEFERRED})
+    return f'{columns}, CASE WHEN {prefix}excerpt IS NULL THEN {prefix}content END AS content'
+
+
+def build(model, record):
+    """A `model` holding `record` as if the ORM had loaded it, so no validators run."""
+    instance = model.__mapper__.class_manager.new_instance()
+    for key, value in dict(record).items():
+        set_committed_value(instance, key, value)
+    return instance
+
+
+class TimedConnection:
+    """An asyncpg connection that adds its queries to a request's RequestStats."""
+
+    def __init__(self, conn, stats):
+        self.conn = conn
+        self.stats = stats
+
+    async def fetch(self, sql, *args):
+        return await self._timed(self.conn.fetch(sql, *args))
+
+    async def fetchrow(self, sql, *args):
+        return await self._timed(self.conn.fetchrow(sql, *args))
+
+    async def _timed(self, query):
+        start = perf_counter()
+        try:
+            return await query
+        finally:
+            self.stats.sql_count += 1
+            self.stats.sql_time += perf_counter() - start
+
+
+async def attach(conn, posts):
+    """Give each post its user and tags, as post_listing() does for the sync views."""
+    if not posts:
+        return posts
+
+    user_ids = list({post.user_id for post in posts})
+    users = {record['id']: build(User, record) for record in await conn.fetch(
+        f'SELECT {column_list(User)} FROM users WHERE id = any($1::int[])', user_ids)}
+
+    tags = {post.id: [] for post in posts}
+    for record in await conn.fetch(
+            f'SELECT posts_tags.post_id AS tagged_post_id, {column_list(Tag, "tags.")} '
+            f'FROM posts_tags JOIN tags ON tags.id = posts_tags.tag_id '
+            f'WHERE posts_tags.post_id = any($1::int[]) ORDER BY tags.id', list(tags)):
+        record = dict(record)
+        tags[record.pop('tagged_post_id')].append(build(Tag, record))
+
+    for post in posts:
+        set_committed_value(post, 'user', users.get(post.user_id))
+        set_committed_value(post, 'tags', tags[post.id])
+    return posts
+
+
+async def fetch_posts(conn, sql, *args):
+    return await attach(conn, [build(Post, record) for record in await conn.fetch(sql, *args)])
+
+
+async def fetch_one(conn, model, id):
+    record = await conn.fetchrow(f'SELECT {column_list(model)} FROM {model.__tablename__} WHERE id = $1', id)
+    if record is None:
+        raise NotFound()
+    return build(model, record)
+
+
+async def home(conn, request):
+    posts = await fetch_posts(conn, f'SELECT {listing_columns()} FROM posts '
+                                    f'ORDER BY created_at DESC LIMIT 5')
+    return 'index.html', {'posts': posts}, {'posts', *post_labels(posts)}
+
+
+async def show_all_posts(conn, request):
+    """Newest posts first, keyset-paginated like queries.post_page()."""
+    after, before = request.args.get('after'), request.args.get('before')
+    backwards = before is not None
+    reverse_sort = not backwards
+    cursor = before if backwards else after
+
+    sql = f'SELECT {listing_columns()} FROM posts'
+    args = []
+    if cursor is not None:
+        args = decode_cursor(cursor, POST_ORDER)
+        # The bare created_at bound is what lets Postgres prune partitions, as in queries.keyset_page().
+        sql += (f' WHERE created_at {"<=" if reverse_sort else ">="} $1'
+                f' AND (created_at, id) {"<" if reverse_sort else ">"} ($1, $2)')
+    direction = 'DESC' if reverse_sort else 'ASC'
+    sql += f' ORDER BY created_at {direction}, id {direction} LIMIT {PER_PAGE + 1}'
+
+    items = await fetch_posts(conn, sql, *args)
+    has_more = len(items) > PER_PAGE
+    items = items[:PER_PAGE]
+    if backwards:
+        items.reverse()
+
+    def cursor_for(post):
+        return encode_cursor([post.created_at, post.id])
+
+    has_next = backwards or has_more
+    has_prev = has_more if backwards else after is not None
+    page = Page(items,
+                next_cursor=cursor_for(items[-1]) if items and has_next else None,
+                prev_cursor=cursor_for(items[0]) if items and has_prev else None)
+    return 'posts.html', {'posts': page.items, 'page': page}, {'posts', *post_labels(page.items)}
+
+
+async def post_detail(conn, request, post_id):
+    post = await fetch_one(conn, Post, post_id)
+    await attach(conn, [post])
+    return 'post_detail.html', {'user': post.user, 'post': post}, post_labels([post])
+
+
+async def user_detail(conn, request, user_id):
+    user = await fetch_one(conn, User, user_id)
+    posts = await fetch_posts(conn, f'SELECT {listing_columns()} FROM posts WHERE user_id = $1 '
+                                    f'ORDER BY created_at DESC', user_id)
+    return 'user_detail.html', {'user': user, 'posts': posts}, {f'user:{user_id}'}
+
+
+async def tag_detail(conn, request, tag_id):
+    tag = await fetch_one(conn, Tag, tag_id)
+    posts = await fetch_posts(conn, f'SELECT {listing_columns("posts.")} FROM posts '
+                                    f'JOIN posts_tags ON posts_tags.post_id = posts.id '
+                                    f'AND posts_tags.post_created_at = posts.created_at '
+                                    f'WHERE posts_tags.tag_id = $1 ORDER BY posts.created_at DESC', tag_id)
+    return 'tag_detail.html', {'tag': tag, 'posts': posts}, {f'tag:{tag_id}', *post_labels(posts)}
+
+
+# Flask endpoints that the ASGI app answers itself for GET and HEAD. Each
+# view returns its template, the template's context and the page's cache labels.
+ASYNC_VIEWS = {
+    'blogly.get_homepage': home,
+    'blogly.show_all_posts': show_all_posts,
+    'blogly.post_detail': post_detail,
+    'blogly.user_detail': user_detail,
+    'blogly.tag_detail': tag_detail,
+}
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ for an ASGI HTTP request scope."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+        elif name == 'CONTENT_LENGTH':
+            continue
+        elif f'HTTP_{name}' in environ:
+            environ[f'HTTP_{name}'] += f',{value}'
+        else:
+            environ[f'HTTP_{name}'] = value
+    return environ
+
+
+class BloglyASGI:
+    """Serves ASYNC_VIEWS from an asyncpg pool and hands every other request to `flask_app`."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.async_reads = config['ASGI_ASYNC_READS']
+        self.pool_size = config['ASGI_POOL_SIZE']
+        self.executor = ThreadPoolExecutor(config['ASGI_WSGI_THREADS'])
+        self.pool = None
+        self._pool_lock = asyncio.Lock()
+
+        url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+        if self.async_reads and url.get_backend_name() != 'postgresql':
+            raise RuntimeError('Async reads need a Postgres database; set ASGI_ASYNC_READS = False.')
+        url.drivername = 'postgresql'
+        self.dsn = str(url)
+
+        self.jinja_env = Environment(loader=flask_app.jinja_loader, enable_async=True,
+                                     autoescape=flask_app.select_jinja_autoescape)
+        self.jinja_env.globals['url_for'] = self.url_for
+        self.jinja_env.globals['avatar_url'] = lambda user, size: avatar_url(user, size, self.url_for)
+        self.jinja_env.globals['asset_url'] = lambda name: asset_url(name, self.url_for)
+        self.jinja_env.globals['asset_integrity'] = asset_integrity
+        fragments.install(self.jinja_env, config)
+        self.url_adapter = flask_app.url_map.bind('localhost')
+
+    def url_for(self, endpoint, **values):
+        return self.url_adapter.build(endpoint, values)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        view, args = self.match(scope)
+        if view is None:
+            await self.call_flask(scope, receive, send)
+            return
+
+        request = SimpleNamespace(endpoint=args.pop('endpoint'), args=url_decode(scope['query_string']))
+        stats = RequestStats()
+        try:
+            accept = parse_accept_header(dict(scope['headers']).get(b'accept-encoding', b'').decode('latin-1'))
+            body, compressed = await self.page(scope, request, view, args, stats, accept)
+            status, headers = 200, [(b'content-type', b'text/html; charset=utf-8')]
+            headers.append((b'vary', b'Accept-Encoding'))
+            if compressed is not None:
+                body = compressed
+                headers.append((b'content-encoding', b'gzip'))
+        except HTTPException as err:
+            response = err.get_response()
+            status, body = response.status_code, response.get_data()
+            headers = [(b'content-type', response.content_type.encode())]
+
+        if self.flask_app.config['METRICS_ENABLED']:
+            headers.append((b'server-timing', metrics.record(request.endpoint, stats).encode()))
+        headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def page(self, scope, request, view, args, stats, accept):
+        """The HTML for an async view and, if the client accepts it, its gzipped copy.
+
+        Pages come from the page cache, along with their gzipped copies, if
+        the Flask view the async one stands in for is cached.
+        """
+        config = self.flask_app.config
+        cached = (scope['method'] == 'GET' and config.get('PAGE_CACHE_ENABLED', not self.flask_app.testing)
+                  and getattr(self.flask_app.view_functions[request.endpoint], 'page_cached', False))
+        # The key Flask's request.full_path gives.
+        key = f'{scope["path"]}?{scope["query_string"].decode("latin-1")}'
+        if cached:
+            page = page_cache.get(key)
+            if page is not None:
+                body, _, gzipped = page
+                return body, gzipped if accept['gzip'] else None
+            started = page_cache.begin()
+
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                template, context, labels = await view(TimedConnection(conn, stats), request, **args)
+            rendering = perf_counter()
+            html = await self.jinja_env.get_template(template).render_async(request=request, **context)
+            stats.template_time += perf_counter() - rendering
+            body = html.encode()
+            if not cached:
+                return body, compress_body(body, 'text/html', accept, config)
+            gzipped = gzip_body(body, 'text/html', config)
+            page_cache.store(key, (body, 'text/html', gzipped), labels, started)
+            return body, gzipped if accept['gzip'] else None
+        finally:
+            if cached:
+                page_cache.finish(started)
+
+    def match(self, scope):
+        """The async view for this request and its URL arguments, or (None, None)."""
+        if not self.async_reads or scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return None, None
+        try:
+            endpoint, args = self.url_adapter.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return None, None
+        view = ASYNC_VIEWS.get(endpoint)
+        return view, dict(args, endpoint=endpoint)
+
+    async def get_pool(self):
+        async with self._pool_lock:
+            if self.pool is None:
+                import asyncpg
+                self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        return self.pool
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        self.executor.shutdown(wait=False)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.async_reads:
+                    await self.get_pool()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_flask(self, scope, receive, send):
+        """Run the request through the Flask app in the thread pool."""
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        # The Flask app runs in a worker thread and hands each chunk of its
+        # response over as it's produced, waiting while the queue is full.
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=8)
+        started = {}
+
+        def put(chunk):
+            asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+            return put
+
+        def run():
+            try:
+                result = self.flask_app(wsgi_environ(scope, body), start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            put(chunk)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            finally:
+                put(None)
+
+        finished = loop.run_in_executor(self.executor, run)
+        chunk = await queue.get()
+        try:
+            if 'status' not in started:
+                await finished
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while chunk is not None:
+                if scope['method'] != 'HEAD':
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await queue.get()
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Let the worker thread finish even if the client has gone.
+            while chunk is not None:
+                chunk = await queue.get()
+        await finished
+
+
+def create_asgi_app(config_name=None, **config):
+    """Build the Flask app with create_app() and wrap it for ASGI."""
+    from app import create_app
+    return BloglyASGI(create_app(config_name, **config))
@@ -0,0 +1,156 @@
+"""Self-hosted, fingerprinted and precompressed static assets.
+
+Templates ask for stylesheets and scripts by logical name through
+asset_url('bootstrap.css'), and take the integrity attribute to go with it
+from asset_integrity('bootstrap.css'). `flask blogly build-assets` fetches each file in
+VENDOR from its CDN (or from --source, a directory holding the same files,
+on networks that can't reach the CDNs), checks it against its Subresource
+Integrity hash and writes it to ASSETS_DIR under a name carrying a hash of
+its content, next to gzip and, if the brotli package is installed, brotli
+copies. manifest.json maps logical names to those files.
+
+/assets/<file> serves the precompressed copy the client's Accept-Encoding
+prefers. A changed file gets a new name, so responses are marked immutable.
+Until the assets are built, asset_url() points at the CDNs.
+"""
+import gzip
+import json
+import mimetypes
+import os
+from base64 import b64encode
+from hashlib import new as new_hash, sha256
+from urllib.request import urlopen
+
+from flask import Blueprint, current_app, abort, request, send_file, url_for
+from immutable import write_file, cache_forever
+
+bp = Blueprint('assets', __name__)
+
+# Logical name: (CDN URL, Subresource Integrity hash).
+VENDOR = {
+    'bootstrap.css': ('https://cdn.jsdelivr.net/npm/bootstrap@4.5.3/dist/css/bootstrap.min.css',
+                      'sha384-TX8t27EcRE3e/ihU7zmQxVncDAy5uIKz4rEkgIXeMed4M0jlfIDPvg6uqKI2xXr2'),
+    'jquery.js': ('https://code.jquery.com/jquery-3.5.1.slim.min.js',
+                  'sha384-DfXdz2htPH0lsSSs5nCTpuj/zy4C+OGpamoFVy38MVBnE+IbbVYUew+OrCXaRkfj'),
+    'bootstrap.js': ('https://cdn.jsdelivr.net/npm/bootstrap@4.5.3/dist/js/bootstrap.bundle.min.js',
+                     'sha384-ho+j7jyWK8fNQe+A12Hb8AhRq26LrZ/JpcUGGOn+Y7RsweNrtN/tE3MoK7ZeZDyx'),
+}
+
+# Content codings written beside each file, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+MANIFEST = 'manifest.json'
+
+
+class AssetError(Exception):
+    """A vendored file couldn't be fetched or doesn't match its integrity hash."""
+
+
+def fetch_asset(url):
+    try:
+        with urlopen(url, timeout=30) as response:
+            return response.read()
+    except OSError as error:
+        raise AssetError(f"Couldn't fetch {url!r}: {error}") from error
+
+
+def check_integrity(name, data, integrity):
+    algorithm, expected = integrity.split('-', 1)
+    if b64encode(new_hash(algorithm, data).digest()).decode() != expected:
+        raise AssetError(f'{name} does not match {integrity}')
+
+
+def fingerprinted(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{sha256(data).hexdigest()[:12]}{ext}'
+
+
+def compressed(data):
+    """(suffix, bytes) for each encoding available, at its highest compression level."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        yield '.br', brotli.compress(data, quality=11)
+    # mtime=0 so the same input always gives the same bytes.
+    yield '.gz', gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def build_assets(directory, source=None, vendor=VENDOR, fetch=fetch_asset):
+    """Write every vendored file, fingerprinted and precompressed, and the manifest. Returns the manifest."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    for name, (url, integrity) in vendor.items():
+        if source is None:
+            data = fetch(url)
+        else:
+            with open(os.path.join(source, name), 'rb') as file:
+                data = file.read()
+        check_integrity(name, data, integrity)
+
+        filename = fingerprinted(name, data)
+        write_file(os.path.join(directory, filename), data)
+        for suffix, packed in compressed(data):
+            write_file(os.path.join(directory, filename + suffix), packed)
+        manifest[name] = filename
+
+    # Files from earlier builds are left alone, for pages that still link them.
+    write_file(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class Assets:
+    """The manifest of the built assets, read once when the app starts."""
+
+    def __init__(self):
+        self.manifest = {}
+        self.files = frozenset()
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', os.path.join(app.root_path, 'static', 'assets'))
+        app.jinja_env.globals['asset_url'] = asset_url
+        app.jinja_env.globals['asset_integrity'] = asset_integrity
+        self.load(app.config['ASSETS_DIR'])
+
+    def load(self, directory):
+        try:
+            with open(os.path.join(directory, MANIFEST)) as file:
+                self.manifest = json.load(file)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.files = frozenset(self.manifest.values())
+
+
+assets = Assets()
+
+
+def asset_url(name, url_for=url_for):
+    filename = assets.manifest.get(name)
+    if filename is None:
+        return VENDOR[name][0]
+    return url_for('assets.asset', filename=filename)
+
+
+def asset_integrity(name):
+    """The Subresource Integrity hash of an asset, which the self-hosted copy was checked against."""
+    return VENDOR[name][1]
+
+
+@bp.route('/assets/<filename>')
+def asset(filename):
+    if filename not in assets.files:
+        abort(404)
+
+    directory = current_app.config['ASSETS_DIR']
+    path, encoding = os.path.join(directory, filename), None
+    for coding, suffix in ENCODINGS:
+        if request.accept_encodings[coding] and os.path.exists(path + suffix):
+            path, encoding = path + suffix, coding
+            break
+
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return cache_forever(response)
@@ -0,0 +1,238 @@
+"""Local thumbnails of users' images.
+
+Templates show a user's image through avatar_url(user, size), which points
+at /avatars/<user_id>/<size>?v=<hash of the image URL>. The first request
+for a size fetches the image, crops and scales it to a size x size JPEG and
+stores it under AVATAR_CACHE_DIR named by the hash of its bytes. A small
+ref file, named by the image URL and size, records which thumbnail belongs
+to it. Responses are marked immutable: a new image URL means a new v and so
+a new address, and the old URL's refs and thumbnails are deleted once the
+change is committed.
+
+Images are fetched by AVATAR_FETCHER, a function taking a URL and returning
+its bytes (fetch_image by default), so tests and other deployments can
+swap it. Anyone can save any URL as their image, so fetch_image only
+connects to public addresses: a host that resolves to a loopback, private,
+link-local or reserved address is refused, on every redirect as well as
+the first request, so the server can't be used to reach internal services.
+Only AVATAR_SIZES are served, to bound what can be generated. Thumbnails
+are kept in the app's instance folder unless AVATAR_CACHE_DIR says
+otherwise.
+"""
+import ipaddress
+import os
+import socket
+from hashlib import sha256
+from io import BytesIO
+from urllib.parse import urlparse
+from urllib.request import (OpenerDirector, HTTPHandler, HTTPSHandler, HTTPRedirectHandler,
+                            HTTPDefaultErrorHandler, HTTPErrorProcessor)
+
+from flask import Blueprint, current_app, abort, redirect, request, send_file, url_for
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from immutable import write_file, cache_forever
+from models import User
+from pending import PendingChanges
+
+bp = Blueprint('avatars', __name__)
+
+DEFAULT_AVATAR = 'https://www.tenforums.com/geek/gars/images/2/types/thumb_15951118880user.png'
+
+
+class AvatarError(Exception):
+    """The image couldn't be fetched or isn't one Pillow can read."""
+
+
+def is_public_address(address):
+    """Whether `address` is reachable across the internet, not a private, shared or reserved one."""
+    try:
+        # getaddrinfo gives link-local IPv6 addresses with their zone, as in fe80::1%eth0.
+        address = ipaddress.ip_address(address.split('%', 1)[0])
+    except ValueError:
+        return False
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection(), refusing hosts that resolve to anything but public addresses.
+
+    The connection is made to the address that was checked, so the host
+    can't be pointed somewhere else between the check and the connection.
+    """
+    host, port = address
+    try:
+        resolved = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as error:
+        raise AvatarError(f"Couldn't resolve {host!r}: {error}") from error
+    addresses = [sockaddr[0] for *_, sockaddr in resolved]
+    refused = [ip for ip in addresses if not is_public_address(ip)]
+    if refused:
+        raise AvatarError(f'Not fetching from {host!r}, which resolves to {refused[0]}')
+    return socket.create_connection((addresses[0], port), timeout, source_address)
+
+
+class _PublicOnly:
+    """Makes an HTTP(S) handler's connections with public_connection()."""
+
+    def do_open(self, http_class, request, **kwargs):
+        def connection(*args, **kw):
+            conn = http_class(*args, **kw)
+            conn._create_connection = public_connection
+            return conn
+        return super().do_open(connection, request, **kwargs)
+
+
+class _PublicHTTPHandler(_PublicOnly, HTTPHandler):
+    pass
+
+
+class _PublicHTTPSHandler(_PublicOnly, HTTPSHandler):
+    pass
+
+
+def _opener():
+    # Only http(s), with no proxies, and redirects go through the same handlers.
+    opener = OpenerDirector()
+    for handler in (_PublicHTTPHandler(), _PublicHTTPSHandler(), HTTPRedirectHandler(),
+                    HTTPDefaultErrorHandler(), HTTPErrorProcessor()):
+        opener.add_handler(handler)
+    return opener
+
+
+def fetch_image(url, timeout=5, max_bytes=5 * 1024 * 1024):
+    if urlparse(url).scheme not in ('http', 'https'):
+        raise AvatarError(f'Not fetching {url!r}')
+    try:
+        with _opener().open(url, timeout=timeout) as response:
+            data = response.read(max_bytes + 1)
+    except OSError as error:
+        raise AvatarError(f"Couldn't fetch {url!r}: {error}") from error
+    if len(data) > max_bytes:
+        raise AvatarError(f'{url!r} is larger than {max_bytes} bytes')
+    return data
+
+
+def make_thumbnail(data, size):
+    """JPEG bytes of the image in `data`, cropped to a square and scaled to `size` pixels."""
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(BytesIO(data))
+        image = ImageOps.fit(ImageOps.exif_transpose(image).convert('RGB'), (size, size), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise AvatarError(f'Unreadable image: {error}') from error
+    out = BytesIO()
+    image.save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue()
+
+
+def url_hash(url):
+    return sha256(url.encode()).hexdigest()
+
+
+class AvatarCache:
+    """Thumbnails on disk, named by their content, and refs from image URLs to them."""
+
+    def init_app(self, app):
+        app.config.setdefault('AVATAR_CACHE_DIR', os.path.join(app.instance_path, 'avatars'))
+        app.config.setdefault('AVATAR_SIZES', (48, 96, 192))
+        app.config.setdefault('AVATAR_FETCHER', fetch_image)
+        app.jinja_env.globals['avatar_url'] = avatar_url
+
+    def _directory(self):
+        directory = current_app.config['AVATAR_CACHE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _ref_path(self, url, size):
+        return os.path.join(self._directory(), f'{url_hash(url)}-{size}.ref')
+
+    def thumbnail(self, url, size):
+        """The path of the size x size thumbnail of the image at `url`, making it if needed."""
+        ref = self._ref_path(url, size)
+        try:
+            with open(ref) as lines:
+                path = os.path.join(self._directory(), lines.read().strip())
+            if os.path.exists(path):
+                return path
+        except FileNotFoundError:
+            pass
+
+        data = make_thumbnail(current_app.config['AVATAR_FETCHER'](url), size)
+        name = sha256(data).hexdigest() + '.jpg'
+        path = os.path.join(self._directory(), name)
+        write_file(path, data)
+        write_file(ref, name.encode())
+        return path
+
+    def forget(self, url, sizes):
+        """Delete the refs for `url`, and the thumbnails they point at."""
+        directory = current_app.config['AVATAR_CACHE_DIR']
+        for size in sizes:
+            ref = os.path.join(directory, f'{url_hash(url)}-{size}.ref')
+            try:
+                with open(ref) as lines:
+                    name = lines.read().strip()
+                os.remove(ref)
+                # Another URL with the same image may share the file; its ref will remake it.
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+avatars = AvatarCache()
+
+
+def version(url):
+    return url_hash(url)[:12]
+
+
+def avatar_url(user, size, url_for=url_for):
+    if not user.image_url:
+        return DEFAULT_AVATAR
+    return url_for('avatars.avatar', user_id=user.id, size=size, v=version(user.image_url))
+
+
+@bp.route('/avatars/<int:user_id>/<int:size>')
+def avatar(user_id, size):
+    if size not in current_app.config['AVATAR_SIZES']:
+        abort(404)
+    user = User.query.get_or_404(user_id)
+    if not user.image_url:
+        return redirect(DEFAULT_AVATAR)
+
+    if request.args.get('v') != version(user.image_url):
+        # An old or missing version; only the current address may be cached for good.
+        return redirect(avatar_url(user, size))
+
+    try:
+        path = avatars.thumbnail(user.image_url, size)
+    except AvatarError:
+        current_app.logger.warning('No avatar for user %s from %r', user_id, user.image_url, exc_info=True)
+        return redirect(DEFAULT_AVATAR)
+
+    return cache_forever(send_file(path, mimetype='image/jpeg', conditional=True))
+
+
+def _forget_urls(urls):
+    sizes = current_app.config['AVATAR_SIZES']
+    for url in urls:
+        avatars.forget(url, sizes)
+
+
+replaced_images = PendingChanges('avatar_urls', _forget_urls, collection=set)
+
+
+@event.listens_for(User, 'after_update')
+def _image_changed(mapper, connection, user):
+    old_urls = [url for url in inspect(user).attrs.image_url.history.deleted if url]
+    replaced_images.record(object_session(user), *old_urls)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    if user.image_url:
+        replaced_images.record(object_session(user), user.image_url)
@@ -0,0 +1,425 @@
+"""Benchmark Blogly's main pages against a synthetic data set.
+
+    python benchmark.py --posts 100000 --output results.json
+    python benchmark.py --posts 100000 --keep-data --server --compare results.json
+
+The database named by --database (default: BENCH_DATABASE_URL, then
+'blogly_bench') is dropped, recreated and filled from datagen.py, unless
+--keep-data is given. Each route is then requested through the Flask test
+client, or through a real WSGI server on a local port with --server, and
+the results are reported per route:
+
+- p50/p95/p99 latency, in milliseconds, measured by the client;
+- queries per request and template rendering time, read from the
+  Server-Timing header (see metrics.py);
+- peak memory allocated by Python while serving the route, from tracemalloc,
+  measured in a separate pass so tracing doesn't skew the latencies.
+
+With --asgi, the read pages are also served by asgi.py under uvicorn, once
+through Flask's threads and once through its coroutines, and kept busy by
+--concurrency connections to compare throughput.
+
+Results are written as JSON, and --compare prints how they moved against an
+earlier run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPErrorProcessor, Request, build_opener
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+import datagen
+import transfer
+from models import db, recount_posts, Post, Tag, User, PostTag
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+TEMPLATE_TIME = re.compile(r'tpl;dur=([\d.]+)')
+
+
+class Scenario:
+    """One request to benchmark. `form` may be a callable returning fresh form data for each call."""
+
+    def __init__(self, name, path, form=None):
+        self.name = name
+        self.path = path
+        self.form = form
+
+    @property
+    def method(self):
+        return 'GET' if self.form is None else 'POST'
+
+    def data(self):
+        return self.form() if callable(self.form) else self.form
+
+
+def load(users, posts, tags, seed=1, progress=None):
+    """Replace the current database's contents with a generated data set."""
+    db.drop_all()
+    db.create_all()
+    counts = transfer.import_rows(datagen.generate(users, posts, tags, seed), progress=progress)
+    recount_posts()
+    db.session.commit()
+    return counts
+
+
+def toggling(items, toggle):
+    """Form data that alternately includes and leaves out `toggle`, so every POST changes something."""
+    state = {'on': toggle in items}
+
+    def form():
+        state['on'] = not state['on']
+        return items + [toggle] if state['on'] else items
+    return form
+
+
+def scenarios():
+    """The routes to benchmark, picked from whatever data is in the database."""
+    popular = Tag.query.order_by(Tag.post_count.desc(), Tag.id).first()
+    typical = Tag.query.order_by(Tag.post_count, Tag.id).offset(Tag.query.count() // 2).first()
+    prolific = User.query.order_by(User.post_count.desc(), User.id).first()
+    newest = Post.query.order_by(Post.created_at.desc(), Post.id.desc()).first()
+    oldest = Post.query.order_by(Post.created_at, Post.id).first()
+
+    tagged = [str(id) for (id,) in db.session.query(PostTag.post_id)
+              .filter(PostTag.tag_id == typical.id).order_by(PostTag.post_id)]
+    post_tags = [str(tag.id) for tag in newest.tags]
+    spare_tag = str(Tag.query.filter(~Tag.posts.any(Post.id == newest.id)).first().id)
+    tag_form = {'name': typical.name}
+    post_form = {'title': newest.title, 'content': newest.content}
+
+    return [
+        Scenario('get_homepage', '/'),
+        Scenario('show_all_posts', '/posts'),
+        Scenario('all_users', '/users'),
+        Scenario('all_tags', '/tags'),
+        Scenario('post_detail', f'/posts/{newest.id}'),
+        Scenario('show_user', f'/users/{prolific.id}'),
+        Scenario('tag_detail (popular)', f'/tags/{popular.id}'),
+        Scenario('tag_detail (typical)', f'/tags/{typical.id}'),
+        Scenario('tag_update', f'/tags/{typical.id}/edit',
+                 lambda form=toggling(tagged, str(oldest.id)): {**tag_form, 'post': form()}),
+        Scenario('post_update', f'/posts/{newest.id}/edit',
+                 lambda form=toggling(post_tags, spare_tag): {**post_form, 'tag': form()}),
+        Scenario('search', '/search?q=coffee'),
+        Scenario('api_posts', '/api/v1/posts'),
+    ]
+
+
+class ClientDriver:
+    """Sends requests through the Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def __call__(self, scenario):
+        if scenario.method == 'GET':
+            resp = self.client.get(scenario.path)
+        else:
+            resp = self.client.post(scenario.path, data=scenario.data())
+        return resp.status_code, resp.headers.get('Server-Timing', '')
+
+    def close(self):
+        pass
+
+
+class _NoRedirects(HTTPErrorProcessor):
+    def http_response(self, request, response):
+        return response
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerDriver:
+    """Sends requests over HTTP to the app served by Werkzeug in a background thread."""
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.opener = build_opener(_NoRedirects)
+
+    def __call__(self, scenario):
+        data = None
+        if scenario.method == 'POST':
+            data = urlencode(scenario.data(), doseq=True).encode()
+        try:
+            with self.opener.open(Request(self.base + scenario.path, data=data)) as resp:
+                resp.read()
+                return resp.status, resp.headers.get('Server-Timing', '')
+        except HTTPError as err:
+            return err.code, err.headers.get('Server-Timing', '')
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def measure(driver, scenario, requests, warmup):
+    for _ in range(warmup):
+        driver(scenario)
+
+    timings = []
+    queries = []
+    template_times = []
+    errors = 0
+    for _ in range(requests):
+        start = perf_counter()
+        status, server_timing = driver(scenario)
+        timings.append((perf_counter() - start) * 1000)
+        if status >= 400:
+            errors += 1
+        match = QUERIES.search(server_timing)
+        if match:
+            queries.append(int(match.group(1)))
+        match = TEMPLATE_TIME.search(server_timing)
+        if match:
+            template_times.append(float(match.group(1)))
+
+    tracemalloc.start()
+    for _ in range(min(requests, 5)):
+        driver(scenario)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'method': scenario.method,
+        'path': scenario.path,
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'template_ms': round(sum(template_times) / len(template_times), 3) if template_times else None,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(app, requests=50, warmup=5, server=False, only=None):
+    """Benchmark every scenario against `app` and return the results by route name."""
+    with app.app_context():
+        todo = [s for s in scenarios() if not only or s.name in only]
+        db.session.remove()
+
+    driver = (ServerDriver if server else ClientDriver)(app)
+    try:
+        return {scenario.name: measure(driver, scenario, requests, warmup) for scenario in todo}
+    finally:
+        driver.close()
+
+
+# The pages asgi.py serves asynchronously, requested in turn by every connection of a throughput run.
+ASYNC_ROUTES = ('get_homepage', 'show_all_posts', 'post_detail', 'show_user', 'tag_detail (typical)')
+
+SERVE = '''
+import json, sys, uvicorn, asgi
+uvicorn.run(asgi.create_asgi_app('production', **json.loads(sys.argv[1])),
+            host='127.0.0.1', port=int(sys.argv[2]), log_level='warning')
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(config):
+    """Serve asgi.py with `config` from a uvicorn subprocess and return (process, port) once it's listening."""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-c', SERVE, json.dumps(config), str(port)],
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('uvicorn did not start')
+
+
+async def hammer(port, paths, concurrency, duration):
+    """Keep `concurrency` keep-alive connections busy with GETs for `duration` seconds."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    timings = []
+    errors = 0
+
+    async def connection(n):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        while loop.time() < deadline:
+            path = paths[n % len(paths)]
+            n += 1
+            start = perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+            length = next(int(line.split(':', 1)[1]) for line in head if line.lower().startswith('content-length:'))
+            await reader.readexactly(length)
+            timings.append((perf_counter() - start) * 1000)
+            if int(head[0].split()[1]) >= 400:
+                errors += 1
+        writer.close()
+
+    await asyncio.gather(*(connection(n) for n in range(concurrency)))
+    return timings, errors
+
+
+def throughput(database, concurrency=100, duration=10, cache=False):
+    """Compare the read pages served by Flask threads with the same pages served by asgi.py's coroutines.
+
+    Both run under uvicorn through asgi.py, the first with ASGI_ASYNC_READS off,
+    so the only difference is how the read pages wait on the database.
+    """
+    from app import create_app
+    app = create_app('production', SQLALCHEMY_DATABASE_URI=database, SECRET_KEY='benchmark')
+    with app.app_context():
+        paths = [s.path for s in scenarios() if s.name in ASYNC_ROUTES]
+        db.session.remove()
+
+    results = {}
+    for mode, async_reads in (('sync', False), ('async', True)):
+        process, port = start_uvicorn({'SQLALCHEMY_DATABASE_URI': database, 'SECRET_KEY': 'benchmark',
+                                       'PAGE_CACHE_ENABLED': cache, 'ASGI_ASYNC_READS': async_reads})
+        try:
+            timings, errors = asyncio.run(hammer(port, paths, concurrency, duration))
+        finally:
+            process.terminate()
+            process.wait()
+        timings.sort()
+        results[mode] = {
+            'concurrency': concurrency,
+            'requests': len(timings),
+            'errors': errors,
+            'requests_per_second': round(len(timings) / duration, 1),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, results, out=sys.stdout):
+    """Print each route's figures next to the baseline's, with the relative change."""
+    fields = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'template_ms', 'peak_memory_kb')
+    for name, figures in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            print(f'{name}: not in baseline', file=out)
+            continue
+        changes = []
+        for field in fields:
+            old, new = before.get(field), figures.get(field)
+            if old and new is not None:
+                changes.append(f'{field} {old} -> {new} ({(new - old) / old:+.0%})')
+        print(f'{name}: ' + ', '.join(changes), file=out)
+
+    for mode, figures in results.get('throughput', {}).items():
+        old = baseline.get('throughput', {}).get(mode, {}).get('requests_per_second')
+        if old:
+            new = figures['requests_per_second']
+            print(f'{mode} throughput: {old} -> {new} requests/s ({(new - old) / old:+.0%})', file=out)
+
+
+def report(results, out=sys.stdout):
+    print(f'{"route":<24}{"p50":>9}{"p95":>9}{"p99":>9}{"queries":>9}{"tpl ms":>9}{"peak kB":>10}', file=out)
+    for name, f in results['routes'].items():
+        queries = '-' if f['queries_per_request'] is None else f['queries_per_request']
+        template = '-' if f['template_ms'] is None else f['template_ms']
+        print(f'{name:<24}{f["p50_ms"]:>9}{f["p95_ms"]:>9}{f["p99_ms"]:>9}{queries:>9}{template:>9}'
+              f'{f["peak_memory_kb"]:>10}', file=out)
+    for mode, f in results.get('throughput', {}).items():
+        print(f'{mode} reads at concurrency {f["concurrency"]}: {f["requests_per_second"]} requests/s, '
+              f'p50 {f["p50_ms"]} ms, p99 {f["p99_ms"]} ms, {f["errors"]} errors', file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database', default=os.environ.get('BENCH_DATABASE_URL', 'postgresql:///blogly_bench'))
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--users', type=int, help='default: posts / 10')
+    parser.add_argument('--tags', type=int, help='default: posts / 100, at least 20')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep-data', action='store_true', help="benchmark the database's current data")
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--server', action='store_true', help='go through a real WSGI server')
+    parser.add_argument('--cache', action='store_true', help='leave the page cache on')
+    parser.add_argument('--route', action='append', help='only benchmark this route (repeatable)')
+    parser.add_argument('--asgi', action='store_true',
+                        help='also compare sync and async read throughput under uvicorn (needs uvicorn and asyncpg)')
+    parser.add_argument('--concurrency', type=int, default=100, help='connections for --asgi')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mode for --asgi')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous JSON result to compare against')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app('production', SQLALCHEMY_DATABASE_URI=args.database, SECRET_KEY='benchmark',
+                     PAGE_CACHE_ENABLED=args.cache)
+
+    scale = {'users': args.users or max(1, args.posts // 10), 'posts': args.posts,
+             'tags': args.tags or max(20, args.posts // 100), 'seed': args.seed}
+    with app.app_context():
+        if not args.keep_data:
+            load(scale['users'], scale['posts'], scale['tags'], scale['seed'],
+                 progress=lambda table, count: print(f'{table}: {count} rows', file=sys.stderr))
+        scale = {'users': User.query.count(), 'posts': Post.query.count(), 'tags': Tag.query.count(),
+                 'seed': None if args.keep_data else args.seed}
+        db.session.remove()
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'driver': 'server' if args.server else 'client',
+        'page_cache': args.cache,
+        'scale': scale,
+        'routes': run(app, args.requests, args.warmup, args.server, args.route),
+    }
+    if args.asgi:
+        results['throughput'] = throughput(args.database, args.concurrency, args.duration, args.cache)
+
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""Rendered page cache for Blogly's read-heavy views.
+
+Each cached page records labels for the rows it shows ('posts', 'user:3',
+'tag:7', ...). Model events collect the labels touched by a write, and once
+the transaction commits only the pages carrying one of those labels are
+evicted. A page rendered while one of its labels was evicted may show what
+was there before, so it isn't stored. Pages are stored as (body, mimetype,
+gzipped body), the last None if they're too small or of a type that isn't
+compressed.
+
+Misses read from a replica like any other GET, except within
+REPLICA_STICKY_SECONDS of a commit that evicted the page or changed one of
+its rows, while a lagging replica may still hold the old rows: a page
+evicted that recently is rendered from the primary, and a page rendered
+from a replica that shows rows changed that recently isn't stored.
+"""
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+from functools import wraps
+from threading import RLock
+from time import monotonic
+
+from flask import current_app, g, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from compression import gzip_body, send_gzipped
+from models import db, User, Post, Tag, PostTag, associations_changed
+from pending import PendingChanges
+
+
+class LRUBackend:
+    """In-process store holding at most `max_entries` pages, least recently used dropped first."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.on_evict = None
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < monotonic():
+                self.delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                if self.on_evict:
+                    self.on_evict(old_key)
+
+    def delete(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None and self.on_evict:
+                self.on_evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PageCache:
+    """Caches whole view responses keyed on the request path and query string."""
+
+    def __init__(self, backend=None, ttl=60):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._labels = {}
+        self._keys = {}
+        # Evictions are numbered, and each label remembers its latest while
+        # any render that started before it is still running.
+        self._version = 0
+        self._generations = {}
+        self._rendering = Counter()
+        # When keys were last evicted and labels last changed by a commit,
+        # kept for as long as replicas may lag behind it.
+        self.replica_lag = 0
+        self._evicted_at = {}
+        self._changed_at = {}
+        self._lock = RLock()
+        self.use_backend(backend or LRUBackend())
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_TTL', self.ttl)
+        app.config.setdefault('PAGE_CACHE_SIZE', self.backend.max_entries)
+        self.ttl = app.config['PAGE_CACHE_TTL']
+        self.backend.max_entries = app.config['PAGE_CACHE_SIZE']
+        self.replica_lag = app.config['REPLICA_STICKY_SECONDS'] if app.config.get('SQLALCHEMY_REPLICA_URIS') else 0
+
+    def use_backend(self, backend):
+        self.backend = backend
+        backend.on_evict = self._forget
+        self._labels = {}
+        self._keys = {}
+
+    @property
+    def enabled(self):
+        return current_app.config.get('PAGE_CACHE_ENABLED', not current_app.testing)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.backend)}
+
+    def depends_on(self, *labels):
+        """Mark the page being rendered as showing the rows named by `labels`."""
+        if 'page_cache_labels' in g:
+            g.page_cache_labels.update(labels)
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            key = request.full_path
+            page = self.get(key)
+            if page is not None:
+                body, mimetype, gzipped = page
+                return send_gzipped(current_app.response_class(body, mimetype=mimetype), gzipped)
+
+            g.page_cache_labels = set()
+            started = self.begin()
+            try:
+                # A replica may not have the change that evicted the page yet.
+                on_primary = self.evicted_recently(key)
+                with db.on_primary() if on_primary else nullcontext():
+                    response = current_app.make_response(view(*args, **kwargs))
+                stale = not on_primary and self.changed_recently(g.page_cache_labels)
+                if response.status_code == 200 and not response.is_streamed and not stale:
+                    body = response.get_data()
+                    gzipped = gzip_body(body, response.mimetype, current_app.config)
+                    self.store(key, (body, response.mimetype, gzipped), g.page_cache_labels, started)
+                    send_gzipped(response, gzipped)
+            finally:
+                self.finish(started)
+            return response
+
+        # Lets the ASGI app share the cache for the pages it serves itself.
+        wrapper.page_cached = True
+        return wrapper
+
+    def invalidate(self, labels):
+        with self._lock:
+            if self._rendering:
+                self._version += 1
+                self._generations.update(dict.fromkeys(labels, self._version))
+            keys = set()
+            for label in labels:
+                keys.update(self._labels.pop(label, ()))
+            if self.replica_lag:
+                now = monotonic()
+                self._forget_older_than(now - self.replica_lag)
+                self._changed_at.update(dict.fromkeys(labels, now))
+                self._evicted_at.update(dict.fromkeys(keys, now))
+        for key in keys:
+            self.backend.delete(key)
+
+    def _forget_older_than(self, cutoff):
+        for times in (self._changed_at, self._evicted_at):
+            for name in [name for name, at in times.items() if at < cutoff]:
+                del times[name]
+
+    def evicted_recently(self, key):
+        """Whether a commit evicted `key` recently enough that a replica may not have caught up."""
+        with self._lock:
+            return self._evicted_at.get(key, float('-inf')) >= monotonic() - self.replica_lag
+
+    def changed_recently(self, labels):
+        """Whether a commit changed any of `labels` recently enough that a replica may not have caught up."""
+        with self._lock:
+            since = monotonic() - self.replica_lag
+            return any(self._changed_at.get(label, float('-inf')) >= since for label in labels)
+
+    def clear(self):
+        with self._lock:
+            self._labels = {}
+            self._keys = {}
+            self._evicted_at = {}
+            self._changed_at = {}
+        self.backend.clear()
+
+    def get(self, key):
+        """The cached (body, mimetype, gzipped) for `key`, counted as a hit, or None, counted as a miss."""
+        page = self.backend.get(key)
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def begin(self):
+        """Note that a page is being rendered; pass the result to store() and finish()."""
+        with self._lock:
+            started = self._version
+            self._rendering[started] += 1
+        return started
+
+    def finish(self, started):
+        with self._lock:
+            self._rendering[started] -= 1
+            if not self._rendering[started]:
+                del self._rendering[started]
+            if not self._rendering:
+                self._generations.clear()
+
+    def _evicted_since(self, started, labels):
+        with self._lock:
+            return any(self._generations.get(label, 0) > started for label in labels)
+
+    def store(self, key, page, labels, started):
+        """Cache `page` under `key`, unless one of `labels` was evicted since begin() returned `started`."""
+        with self._lock:
+            if self._evicted_since(started, labels):
+                return
+            self._keys[key] = labels
+            for label in labels:
+                self._labels.setdefault(label, set()).add(key)
+        self.backend.set(key, page, self.ttl)
+        # An eviction between the check and the set would have missed the page.
+        if self._evicted_since(started, labels):
+            self.backend.delete(key)
+
+    def _forget(self, key):
+        with self._lock:
+            for label in self._keys.pop(key, ()):
+                keys = self._labels.get(label)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._labels[label]
+
+
+page_cache = PageCache()
+
+
+def post_labels(posts):
+    """Labels for a listing of posts showing their authors and tags."""
+    labels = set()
+    for post in posts:
+        labels.add(f'post:{post.id}')
+        labels.add(f'user:{post.user_id}')
+        labels.update(f'tag:{tag.id}' for tag in post.tags)
+    return labels
+
+
+evictions = PendingChanges('page_cache_labels', page_cache.invalidate, collection=set)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, user):
+    evictions.record(object_session(user), f'user:{user.id}')
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    evictions.record(object_session(user), 'posts', f'user:{user.id}')
+
+
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Post, 'after_delete')
+def _post_added_or_removed(mapper, connection, post):
+    evictions.record(object_session(post), 'posts', f'post:{post.id}', f'user:{post.user_id}')
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, post):
+    labels = {f'post:{post.id}', f'user:{post.user_id}'}
+    old_user_ids = inspect(post).attrs.user_id.history.deleted
+    labels.update(f'user:{user_id}' for user_id in old_user_ids)
+    evictions.record(object_session(post), *labels)
+
+
+@event.listens_for(Tag, 'after_update')
+@event.listens_for(Tag, 'after_delete')
+def _tag_changed(mapper, connection, tag):
+    evictions.record(object_session(tag), f'tag:{tag.id}')
+
+
+@event.listens_for(PostTag, 'after_insert')
+@event.listens_for(PostTag, 'after_update')
+@event.listens_for(PostTag, 'after_delete')
+def _post_tag_changed(mapper, connection, post_tag):
+    evictions.record(object_session(post_tag), f'post:{post_tag.post_id}', f'tag:{post_tag.tag_id}')
+
+
+# Post.tags and Tag.posts write posts_tags through the secondary table, which
+# skips the PostTag mapper events, so watch the collections themselves.
+@event.listens_for(Post.tags, 'append')
+@event.listens_for(Post.tags, 'remove')
+def _post_tags_changed(post, tag, initiator):
+    evictions.record(object_session(post) or object_session(tag),
+                     'posts', f'post:{post.id}', f'tag:{tag.id}')
+
+
+@associations_changed.connect
+def _associations_written(session, post_ids, tag_ids):
+    evictions.record(session, *(f'post:{id}' for id in post_ids), *(f'tag:{id}' for id in tag_ids))
+
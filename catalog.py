@@ -0,0 +1,121 @@
+"""Per-process catalog of every post, for the tag forms' checkboxes.
+
+The tag forms list every post, and the list rarely changes in ways anyone
+editing a tag would notice. The catalog keeps each post's title by id and
+hands the forms a tuple of (id, title) named tuples, sorted by id and only
+rebuilt after a change. This process's committed inserts, deletes and
+retitles are applied to it in place, so a new post costs one entry rather
+than a reload. Other processes' changes show up when the catalog is
+reloaded, CATALOG_TTL seconds after it was last loaded; nothing is written
+to the database to announce them, so post writes don't contend for a
+shared counter row.
+
+The tag edit form sends back the ids it listed, and saving it only adds or
+removes the tag on those posts, so a post this process's catalog doesn't
+list yet keeps the tags it was given elsewhere.
+
+Deleting a user deletes their posts in the database (ON DELETE CASCADE),
+out of sight of the ORM, so the catalog is reloaded after that.
+
+A session that has changed posts but not yet committed reads the catalog
+straight from the database without caching it, so it sees its own changes
+and nobody else is shown them before they're committed. Tags are listed
+from the tag index (tagindex.py).
+"""
+from collections import namedtuple
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from models import db, User, Post
+from pending import PendingChanges
+
+PostEntry = namedtuple('PostEntry', 'id title')
+
+
+class PostCatalog:
+    """Every post's id and title, kept current by this process's commits and reloaded after a TTL."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._titles = None
+        self._entries = None
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('CATALOG_TTL', self.ttl)
+        self.ttl = app.config['CATALOG_TTL']
+
+    def _load(self):
+        return dict(db.session.query(Post.id, Post.title))
+
+    def entries(self):
+        session = db.session()
+        if post_changes.pending(session):
+            return self._sorted(self._load())
+
+        with self._lock:
+            if self._titles is not None and self._loaded_at + self.ttl >= monotonic():
+                if self._entries is None:
+                    self._entries = self._sorted(self._titles)
+                return self._entries
+
+        # The primary's rows: a lagging replica's would stay cached for the whole TTL.
+        with session.on_primary():
+            titles = self._load()
+        entries = self._sorted(titles)
+        with self._lock:
+            self._titles, self._entries, self._loaded_at = titles, entries, monotonic()
+        return entries
+
+    def _sorted(self, titles):
+        return tuple(PostEntry(id, title) for id, title in sorted(titles.items()))
+
+    def apply(self, changes):
+        with self._lock:
+            if self._titles is None:
+                return
+            for change, *args in changes:
+                if change == 'set':
+                    id, title = args
+                    self._titles[id] = title
+                elif change == 'delete':
+                    self._titles.pop(args[0], None)
+                else:
+                    self._titles = None
+                    return
+            self._entries = None
+
+    def clear(self):
+        with self._lock:
+            self._titles = None
+            self._entries = None
+
+
+post_catalog = PostCatalog()
+
+
+post_changes = PendingChanges('post_catalog_changes', post_catalog.apply)
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_added(mapper, connection, post):
+    post_changes.record(object_session(post), ('set', post.id, post.title))
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, post):
+    if inspect(post).attrs.title.history.has_changes():
+        post_changes.record(object_session(post), ('set', post.id, post.title))
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    post_changes.record(object_session(post), ('delete', post.id))
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    post_changes.record(object_session(user), ('reload',))
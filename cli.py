@@ -0,0 +1,152 @@
+"""`flask blogly ...` maintenance commands."""
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from assets import assets, build_assets, AssetError
+import datagen
+import partitions
+import transfer
+from models import db, recount_posts, add_delete_cascades, backfill_post_text
+from timeline import timeline
+
+blogly = AppGroup('blogly', help='Blogly maintenance commands.')
+
+
+@blogly.command('repair-counts')
+def repair_counts():
+    """Recompute the post counters on users and tags."""
+    recount_posts()
+    db.session.commit()
+    click.echo('Post counts repaired.')
+
+
+@blogly.command('add-delete-cascades')
+def add_delete_cascades_command():
+    """Make deleting a user or tag delete its posts and associations in the database."""
+    if db.session.connection().dialect.name != 'postgresql':
+        raise click.ClickException('Only Postgres databases can have their foreign keys updated in place.')
+    changed = add_delete_cascades()
+    click.echo(f'Updated {", ".join(changed)}.' if changed else 'Foreign keys already cascade.')
+
+
+@blogly.command('backfill-posts')
+@click.option('--chunk-size', default=1000, show_default=True, help='Posts updated and committed at a time.')
+def backfill_posts(chunk_size):
+    """Work out the excerpt and HTML of posts saved before those columns were added."""
+    filled = backfill_post_text(chunk_size)
+    click.echo(f'Filled in {filled} posts.')
+
+
+def forget_feeds():
+    """Drop the feeds shared through Redis after a change made without ORM events.
+
+    This process can't reach the running servers' own memory: their
+    in-process feeds, cached pages and post catalogs show the change once
+    they expire, after TIMELINE_TTL, PAGE_CACHE_TTL and CATALOG_TTL. Their
+    tag indexes reload when the import bumps the tags version, or refresh
+    usage counts after TAG_INDEX_TTL.
+    """
+    timeline.clear()
+
+
+@blogly.command('create-partitions')
+@click.option('--months', default=3, show_default=True, help='Months after this one to create partitions for.')
+def create_partitions(months):
+    """Create the monthly partitions of posts and posts_tags for this month and the coming ones."""
+    if not partitions.is_partitioned():
+        raise click.ClickException('posts is not partitioned in this database.')
+    created = partitions.create_partitions(months)
+    db.session.commit()
+    click.echo(f'Created partitions for {", ".join(f"{month:%Y-%m}" for month in created)}.' if created
+               else 'Partitions already exist.')
+
+
+@blogly.command('archive-partitions')
+@click.option('--older-than', 'older_than', type=click.IntRange(min=1), required=True,
+              help='Archive the partitions of months more than this many months before this one.')
+def archive_partitions(older_than):
+    """Detach old monthly partitions of posts and posts_tags into the archive schema."""
+    if not partitions.is_partitioned():
+        raise click.ClickException('posts is not partitioned in this database.')
+    cutoff = partitions.add_months(partitions.month_start(datetime.now()), -older_than)
+    archived = partitions.archive_partitions(cutoff)
+    db.session.commit()
+    # Archived posts drop out of feeds and tag counts without ORM events.
+    forget_feeds()
+    click.echo(f'Archived {", ".join(f"{month:%Y-%m}" for month in archived)} '
+               f'to the {partitions.ARCHIVE_SCHEMA} schema.' if archived else 'Nothing to archive.')
+
+
+@blogly.command('build-assets')
+@click.option('--source', type=click.Path(exists=True, file_okay=False),
+              help='A directory holding the vendored files, instead of downloading them.')
+def build_assets_command(source):
+    """Vendor the CSS and JavaScript base.html uses, fingerprinted and precompressed."""
+    directory = current_app.config['ASSETS_DIR']
+    try:
+        manifest = build_assets(directory, source)
+    except (AssetError, OSError) as error:
+        raise click.ClickException(str(error))
+    assets.load(directory)
+    for name, filename in manifest.items():
+        click.echo(f'{name} -> {filename}')
+
+
+@blogly.command('export')
+@click.argument('destination')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson',
+              help='ndjson writes one file (or - for stdout); csv writes a directory of files.')
+def export(destination, fmt):
+    """Export users, tags, posts and their tags."""
+    if fmt == 'csv':
+        count = transfer.export_csv(destination)
+    elif destination == '-':
+        count = transfer.export_ndjson(click.get_text_stream('stdout'))
+    else:
+        with open(destination, 'w') as out:
+            count = transfer.export_ndjson(out)
+    click.echo(f'Exported {count} rows.', err=True)
+
+
+@blogly.command('import')
+@click.argument('source')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson',
+              help='ndjson reads one file (or - for stdin); csv reads a directory of files.')
+@click.option('--chunk-size', default=transfer.CHUNK_SIZE, show_default=True,
+              help='Rows loaded and committed at a time.')
+def import_(source, fmt, chunk_size):
+    """Import an export, skipping rows already present and matching tags by name. Safe to re-run."""
+    def progress(table, count):
+        click.echo(f'{table}: {count} rows', err=True)
+
+    try:
+        if fmt == 'csv':
+            transfer.import_rows(transfer.read_csv(source), chunk_size, progress)
+        elif source == '-':
+            transfer.import_rows(transfer.read_ndjson(click.get_text_stream('stdin')), chunk_size, progress)
+        else:
+            with open(source) as lines:
+                transfer.import_rows(transfer.read_ndjson(lines), chunk_size, progress)
+    except transfer.ImportConflict as error:
+        db.session.rollback()
+        raise click.ClickException(f'{error}. Chunks before it were committed.')
+    # Bulk loading skips the ORM events that keep the feeds current.
+    forget_feeds()
+
+
+@blogly.command('generate')
+@click.option('--users', default=100, show_default=True)
+@click.option('--posts', default=1000, show_default=True)
+@click.option('--tags', default=50, show_default=True)
+@click.option('--seed', default=1, show_default=True, help='The same seed always gives the same data.')
+def generate(users, posts, tags, seed):
+    """Fill an empty database with synthetic users, posts and tags."""
+    def progress(table, count):
+        click.echo(f'{table}: {count} rows', err=True)
+
+    transfer.import_rows(datagen.generate(users, posts, tags, seed), progress=progress)
+    recount_posts()
+    db.session.commit()
+    forget_feeds()
@@ -0,0 +1,68 @@
+"""On-the-fly gzip for dynamic pages.
+
+Responses of a type in COMPRESS_MIMETYPES (default just text/html) and at
+least COMPRESS_MIN_SIZE bytes long (default 1024) are gzipped at
+COMPRESS_LEVEL (default 6) for clients that accept it; smaller ones aren't
+worth the CPU. Streamed responses, such as the Atom feeds, and files sent
+from disk are left alone, as are the built assets, which are compressed
+ahead of time (see assets.py). asgi.py applies the same rule to the pages
+it renders itself. The page cache keeps the gzipped copy of each page next
+to the plain one, so a cached page is only compressed once.
+"""
+import gzip
+
+from flask import current_app, request
+
+
+def gzip_body(body, mimetype, config):
+    """`body` gzipped, or None if responses like it aren't compressed."""
+    if mimetype not in config['COMPRESS_MIMETYPES'] or len(body) < config['COMPRESS_MIN_SIZE']:
+        return None
+    return gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'])
+
+
+def compress_body(body, mimetype, accept_encodings, config):
+    """`body` gzipped, or None if this response shouldn't be."""
+    if not accept_encodings['gzip']:
+        return None
+    return gzip_body(body, mimetype, config)
+
+
+def send_gzipped(response, gzipped):
+    """Send `gzipped`, `response`'s body compressed ahead of time, to clients that accept it."""
+    response.vary.add('Accept-Encoding')
+    if gzipped is not None and request.accept_encodings['gzip']:
+        response.set_data(gzipped)
+        response.content_encoding = 'gzip'
+    return response
+
+
+class Compressor:
+    """Gzips eligible responses as they leave the app."""
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIMETYPES', ('text/html',))
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.after_request(self._compress)
+
+    def _compress(self, response):
+        config = current_app.config
+        if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+            return response
+        if 'Content-Encoding' in response.headers or response.mimetype not in config['COMPRESS_MIMETYPES']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        body = compress_body(response.get_data(), response.mimetype, request.accept_encodings, config)
+        if body is not None:
+            response.set_data(body)
+            response.content_encoding = 'gzip'
+            # The gzipped bytes differ from the plain ones, so only a weak ETag still fits both.
+            etag, weak = response.get_etag()
+            if etag and not weak:
+                response.set_etag(etag, weak=True)
+        return response
+
+
+compressor = Compressor()
@@ -0,0 +1,56 @@
+"""Configuration profiles for Blogly.
+
+create_app() picks one by name, defaulting to the BLOGLY_CONFIG environment
+variable and then to 'development'.
+"""
+import os
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///blogly')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'blog-blog-blog')
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+    API_MAX_AGE = 30
+    # feeds.py: entries per Atom feed, and how long clients may reuse one.
+    FEED_LENGTH = 20
+    FEED_MAX_AGE = 300
+    # replicas.py: GET requests read from these, space-separated in the environment.
+    SQLALCHEMY_REPLICA_URIS = os.environ.get('DATABASE_REPLICA_URLS', '').split()
+    REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY', 'round-robin')
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    # asgi.py: asyncpg connections for the async read pages, threads for the rest of the app.
+    ASGI_ASYNC_READS = True
+    ASGI_POOL_SIZE = int(os.environ.get('ASGI_POOL_SIZE', 20))
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 10))
+
+
+class DevelopmentConfig(Config):
+    # The debug toolbar follows app.debug unless DEBUG_TB_ENABLED is set.
+    SQLALCHEMY_ECHO = True
+
+
+class TestingConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'postgresql:///blogly_test')
+    TESTING = True
+    DEBUG_TB_ENABLED = False
+
+
+class ProductionConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    DEBUG_TB_ENABLED = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+
+
+configs = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
@@ -0,0 +1,65 @@
+"""Synthetic Blogly data for load tests and benchmarks.
+
+The data is shaped like a real blog rather than a uniform grid: a few
+prolific users write most of the posts, tag popularity follows a Zipf
+curve so a handful of tags sit on a large share of posts, and post lengths
+and dates vary. Rows come out as (table, row) pairs in the same form as
+transfer.read_ndjson(), so transfer.import_rows() can load them with COPY.
+"""
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+WORDS = ('blog post garden tomato coffee morning city river train music book film recipe soup '
+         'bread winter summer travel photo code python flask database query index cache cat dog '
+         'walk run bike mountain lake friend family weekend project idea note list review').split()
+
+
+class Sampler:
+    """Draws indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** exponent."""
+
+    def __init__(self, n, exponent, rng):
+        self.cumulative = list(accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+        self.rng = rng
+
+    def __call__(self):
+        return bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def sentence(rng, length):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def generate(users=100, posts=1000, tags=50, seed=1, tag_exponent=1.1, author_exponent=0.8,
+             days=365, now=None):
+    """Yield (table, row) pairs for a whole data set, parents before children."""
+    rng = random.Random(seed)
+    now = now or datetime(2021, 1, 1)
+
+    for id in range(1, users + 1):
+        image_url = f'https://example.com/avatars/{id}.jpg' if rng.random() < 0.7 else None
+        yield 'users', {'id': id, 'first_name': f'First{id}', 'last_name': f'Last{id}', 'image_url': image_url}
+
+    for id in range(1, tags + 1):
+        yield 'tags', {'id': id, 'name': f'{rng.choice(WORDS)}-{id}'}
+
+    author = Sampler(users, author_exponent, rng)
+    # Ordered by created_at so later ids are newer, as they would be in a live table.
+    offsets = sorted(rng.random() * days for _ in range(posts))
+    for id, offset in enumerate(offsets, start=1):
+        paragraphs = max(1, int(rng.lognormvariate(0.7, 0.6)))
+        content = '\n\n'.join(sentence(rng, rng.randint(8, 40)) for _ in range(paragraphs))
+        yield 'posts', {
+            'id': id,
+            'title': sentence(rng, rng.randint(2, 6))[:50],
+            'content': content,
+            'created_at': now - timedelta(days=days - offset),
+            'user_id': author() + 1,
+        }
+
+    popularity = Sampler(tags, tag_exponent, rng)
+    for post_id in range(1, posts + 1):
+        for tag_id in sorted({popularity() + 1 for _ in range(rng.choice((0, 1, 1, 2, 2, 3, 4)))}):
+            yield 'posts_tags', {'post_id': post_id, 'tag_id': tag_id}
@@ -0,0 +1,103 @@
+"""Atom feeds of recent posts, for everyone, one user or one tag.
+
+A feed's entries are the newest FEED_LENGTH posts of the matching timeline
+(see timeline.py). Its ETag comes from one narrow query for those posts' and
+their authors' ids and updated_at stamps, so a subscriber polling with
+If-None-Match gets a bodyless 304 until a post appears, changes or goes
+away. There's no Last-Modified: a post leaving the feed doesn't make any
+remaining one newer, so a date can't tell that the feed changed. A changed
+feed is streamed: the template is rendered entry by entry from a
+server-side cursor over the posts.
+"""
+from datetime import datetime
+
+from flask import Blueprint, current_app, request, stream_with_context, url_for
+from sqlalchemy.orm import joinedload
+from werkzeug.http import is_resource_modified
+from models import db, User, Post, Tag, utc
+from api import versions_etag
+from timeline import timeline
+
+bp = Blueprint('feeds', __name__)
+
+ATOM_MIMETYPE = 'application/atom+xml'
+
+# Posts fetched from the cursor at a time while streaming a feed.
+CHUNK_SIZE = 20
+
+
+@bp.app_template_filter()
+def atom_date(value):
+    """RFC 3339 form of a stored timestamp, in UTC."""
+    return utc(value).replace(microsecond=0).isoformat() + 'Z'
+
+
+def feed_versions(key, limit):
+    """The feed's post ids, newest first, and the (id, updated_at) pairs its entries show."""
+    for _ in range(2):
+        ids = timeline.ids(key, limit)
+        rows = (db.session.query(Post.id, Post.updated_at, User.id, User.updated_at)
+                .join(User, Post.user_id == User.id)
+                .filter(Post.id.in_(ids)).all()) if ids else []
+        if len(rows) == len(ids):
+            break
+        # Posts deleted behind the ORM's back; read the feed again from the database.
+        timeline.rebuild(key)
+    versions = {(f'post:{post_id}', updated_at) for post_id, updated_at, _, _ in rows}
+    versions.update((f'user:{user_id}', updated_at) for _, _, user_id, updated_at in rows)
+    return ids, versions
+
+
+def stream_posts(ids):
+    """The posts for `ids`, newest first, read in chunks from a server-side cursor."""
+    if not ids:
+        return iter(())
+    return (Post.query.options(joinedload(Post.user))
+            .filter(Post.id.in_(ids))
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .yield_per(CHUNK_SIZE))
+
+
+def atom_feed(key, title, alternate, owner=None):
+    """Answer 304 if the client's copy of the feed is current, otherwise stream it."""
+    limit = min(current_app.config.get('FEED_LENGTH', 20), timeline.length)
+    ids, versions = feed_versions(key, limit)
+    if owner is not None:
+        versions.add((key, owner.updated_at))
+
+    etag = versions_etag(f'feed:{key}', sorted(versions))
+    newest = max((updated_at for _, updated_at in versions), default=None)
+
+    if is_resource_modified(request.environ, etag=etag):
+        template = current_app.jinja_env.get_template('feed.xml')
+        context = dict(title=title, alternate=alternate, updated=newest or datetime.now(),
+                       posts=stream_posts(ids))
+        current_app.update_template_context(context)
+        response = current_app.response_class(stream_with_context(template.generate(context)),
+                                              mimetype=ATOM_MIMETYPE)
+    else:
+        response = current_app.response_class(status=304)
+
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('FEED_MAX_AGE', 300)
+    return response
+
+
+@bp.route('/feed.atom')
+def all_posts():
+    return atom_feed('posts', 'Blogly', url_for('blogly.show_all_posts', _external=True))
+
+
+@bp.route('/users/<int:user_id>/feed.atom')
+def user_posts(user_id):
+    user = User.query.get_or_404(user_id)
+    return atom_feed(f'user:{user_id}', f'Blogly: posts by {user.full_name}',
+                     url_for('blogly.user_detail', user_id=user_id, _external=True), owner=user)
+
+
+@bp.route('/tags/<int:tag_id>/feed.atom')
+def tag_posts(tag_id):
+    tag = Tag.query.get_or_404(tag_id)
+    return atom_feed(f'tag:{tag_id}', f'Blogly: posts tagged {tag.name}',
+                     url_for('blogly.tag_detail', tag_id=tag_id, _external=True), owner=tag)
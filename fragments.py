@@ -0,0 +1,101 @@
+"""Memoized template fragments and precompiled templates.
+
+The post and tag markup shared by the listing pages lives in macros in
+templates/_macros.html. Templates call them through fragment(), which keeps
+each rendered fragment in a bounded LRU keyed by the macro, its arguments
+and the id and updated_at of every row it shows. An unchanged post is
+rendered once instead of on every request, and an edit to the post, its
+author or one of its tags just produces a new key.
+
+Templates are compiled into a FileSystemBytecodeCache (TEMPLATE_CACHE_DIR,
+or a per-user temporary directory) and, with TEMPLATE_PRECOMPILE, all loaded
+when the app starts, so a fresh worker doesn't parse them on its first
+requests.
+"""
+from inspect import isawaitable
+
+from jinja2 import FileSystemBytecodeCache
+from cache import LRUBackend
+from models import Post
+
+
+def versions(row, author=True, tags=True):
+    """Everything about `row` that a fragment showing it depends on.
+
+    A post's author and tags only count when the fragment shows them, which
+    the post macros are told with their author= and tags= options.
+    """
+    if isinstance(row, Post):
+        user = row.user if author else None
+        # Filling in a post's excerpt (backfill_post_text) leaves updated_at alone.
+        return (row.id, row.updated_at, row.excerpt is None,
+                (user.id, user.updated_at) if user else None,
+                tuple((tag.id, tag.updated_at) for tag in row.tags) if tags else None)
+    return (row.id, row.updated_at)
+
+
+class FragmentCache:
+    """Rendered macro output for a row, kept until the row changes or it falls out of the LRU."""
+
+    def __init__(self, max_entries=4096, ttl=3600):
+        self.backend = LRUBackend(max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_ENABLED', not app.debug)
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', self.backend.max_entries)
+        app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+        app.config.setdefault('TEMPLATE_PRECOMPILE', not app.debug)
+        self.backend.max_entries = app.config['FRAGMENT_CACHE_SIZE']
+
+        self.install(app.jinja_env, app.config)
+        if app.config['TEMPLATE_PRECOMPILE']:
+            precompile(app.jinja_env)
+
+    def install(self, env, config):
+        """Give a Jinja environment the bytecode cache and the fragment() global."""
+        # Async environments compile to different code, so they keep their own files.
+        pattern = '__jinja2_async_%s.cache' if env.is_async else '__jinja2_%s.cache'
+        env.bytecode_cache = FileSystemBytecodeCache(config['TEMPLATE_CACHE_DIR'], pattern)
+        env.globals['fragment'] = self.render if config['FRAGMENT_CACHE_ENABLED'] else render_uncached
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.backend)}
+
+    def render(self, macro, row, **options):
+        key = (macro.name, tuple(options.items()),
+               versions(row, options.get('author', True), options.get('tags', True)))
+        html = self.backend.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        html = macro(row, **options)
+        if isawaitable(html):
+            return self._store_when_rendered(key, html)
+        self.backend.set(key, html, self.ttl)
+        return html
+
+    async def _store_when_rendered(self, key, rendering):
+        html = await rendering
+        self.backend.set(key, html, self.ttl)
+        return html
+
+    def clear(self):
+        self.backend.clear()
+
+
+def render_uncached(macro, row, **options):
+    return macro(row, **options)
+
+
+def precompile(env):
+    """Load every HTML and XML template, compiling any that aren't in the bytecode cache yet."""
+    for name in env.list_templates(extensions=('html', 'xml')):
+        env.get_template(name)
+
+
+fragments = FragmentCache()
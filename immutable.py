@@ -0,0 +1,35 @@
+"""Files the app writes for itself and serves as never changing.
+
+Avatar thumbnails and built assets are named after their content, so the
+bytes at an address never change and responses can be cached for good. The
+files are written next to where they belong and renamed into place, so a
+request served while one is being written never sees part of it.
+"""
+import os
+from tempfile import mkstemp
+
+# A year, the longest max-age caches are expected to honour.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def write_file(path, data):
+    """Write `data` to `path` through a temporary file of its own, so concurrent writers don't share one."""
+    directory, name = os.path.split(path)
+    fd, partial = mkstemp(prefix=f'{name}.', suffix='.partial', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        # mkstemp makes the file private, but a web server in front may serve it.
+        os.chmod(partial, 0o644)
+        os.replace(partial, path)
+    except BaseException:
+        os.unlink(partial)
+        raise
+
+
+def cache_forever(response):
+    """Mark `response` as cacheable by anyone for as long as caches will keep it."""
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
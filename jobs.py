@@ -0,0 +1,155 @@
+"""Background jobs for writes too big to run inside a request.
+
+A view hands the work to jobs.enqueue() and redirects to the job's status
+page, /jobs/<id>, which refreshes itself until the job finishes and then
+redirects wherever the view said to go next.
+
+Jobs run on a backend chosen by JOBS_BACKEND: 'thread' runs them on a pool
+of JOBS_WORKERS threads in this process, and 'immediate' runs them before
+enqueue() returns, which is the default under TESTING. Anything with a
+submit(fn) method can be passed instead to run them elsewhere. Job status
+is kept in the jobs table, for the last JOBS_KEEP jobs, so any worker
+process can report on a job and it outlives restarts. It's written on its
+own connection, outside the session the job and the request use, and read
+from the primary.
+
+Deleting a user is a single DELETE, which the database cascades to the
+user's posts. Deleting a tag first removes its associations
+JOBS_CHUNK_SIZE rows at a time, committing each chunk, so the posts' stamps
+can be bumped without holding every row locked at once.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from uuid import uuid4
+
+from flask import Blueprint, current_app, abort, redirect, render_template
+from models import db, User, Post, Tag, PostTag, Job, associations_changed
+
+bp = Blueprint('jobs', __name__)
+
+
+class ImmediateBackend:
+    def submit(self, fn):
+        fn()
+
+
+class ThreadBackend:
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='blogly-job')
+
+    def submit(self, fn):
+        self.executor.submit(fn)
+
+
+class JobQueue:
+    """Runs jobs on the configured backend and records how the recent ones went."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._threads = None
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_BACKEND', None)
+        app.config.setdefault('JOBS_WORKERS', 4)
+        app.config.setdefault('JOBS_CHUNK_SIZE', 1000)
+        app.config.setdefault('JOBS_KEEP', 1000)
+
+    def backend(self, config):
+        backend = config['JOBS_BACKEND'] or ('immediate' if config['TESTING'] else 'thread')
+        if backend == 'immediate':
+            return ImmediateBackend()
+        if backend == 'thread':
+            with self._lock:
+                if self._threads is None:
+                    self._threads = ThreadBackend(config['JOBS_WORKERS'])
+            return self._threads
+        return backend
+
+    def enqueue(self, fn, *args, description, next_url):
+        """Queue fn(*args) to run in an app context, returning its Job."""
+        app = current_app._get_current_object()
+        job = Job(id=uuid4().hex, description=description, next_url=next_url, status='queued',
+                  created_at=datetime.now())
+        jobs_table = Job.__table__
+        with db.engine.begin() as connection:
+            connection.execute(jobs_table.insert().values(
+                id=job.id, description=description, next_url=next_url, status=job.status,
+                created_at=job.created_at))
+            oldest_kept = connection.execute(
+                db.select([jobs_table.c.created_at]).order_by(jobs_table.c.created_at.desc())
+                .offset(app.config['JOBS_KEEP'] - 1).limit(1)).scalar()
+            if oldest_kept is not None:
+                connection.execute(jobs_table.delete().where(jobs_table.c.created_at < oldest_kept))
+
+        self.backend(app.config).submit(lambda: self._run(app, job.id, job.description, fn, args))
+        return job
+
+    def _run(self, app, job_id, description, fn, args):
+        with app.app_context():
+            self._set_status(job_id, 'running')
+            try:
+                fn(*args)
+            except Exception as error:
+                db.session.rollback()
+                app.logger.exception('Job %s (%s) failed', job_id, description)
+                self._set_status(job_id, 'failed', str(error))
+            else:
+                self._set_status(job_id, 'done')
+
+    def _set_status(self, job_id, status, error=None):
+        with db.engine.begin() as connection:
+            connection.execute(Job.__table__.update().where(Job.id == job_id).values(status=status, error=error))
+
+    def get(self, job_id):
+        # The job may have been queued a moment ago, by another process.
+        with db.on_primary():
+            return Job.query.get(job_id)
+
+
+jobs = JobQueue()
+
+
+@bp.route('/jobs/<job_id>')
+def status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if job.status == 'done':
+        return redirect(job.next_url)
+    return render_template('job.html', job=job), 500 if job.status == 'failed' else 202
+
+
+def _chunks(query, chunk_size):
+    """Repeatedly take the next chunk of ids from `query` until it runs dry."""
+    while True:
+        ids = [id for (id,) in query.limit(chunk_size)]
+        if not ids:
+            return
+        yield ids
+
+
+def delete_user(user_id):
+    # The database takes the user's posts and their tags with it (ON DELETE
+    # CASCADE), so this is one statement however many posts there are.
+    user = User.query.get(user_id)
+    if user is not None:
+        db.session.delete(user)
+        db.session.commit()
+
+
+def delete_tag(tag_id):
+    chunk_size = current_app.config['JOBS_CHUNK_SIZE']
+    for post_ids in _chunks(db.session.query(PostTag.post_id).filter(PostTag.tag_id == tag_id), chunk_size):
+        (PostTag.query.filter(PostTag.tag_id == tag_id, PostTag.post_id.in_(post_ids))
+         .delete(synchronize_session=False))
+        # Tags are part of a post, as in PostTag.set_tags().
+        Post.query.filter(Post.id.in_(post_ids)).update({Post.updated_at: datetime.now()},
+                                                        synchronize_session=False)
+        associations_changed.send(db.session(), post_ids=set(post_ids), tag_ids={tag_id})
+        db.session.commit()
+
+    tag = Tag.query.get(tag_id)
+    if tag is not None:
+        db.session.delete(tag)
+        db.session.commit()
@@ -0,0 +1,170 @@
+"""Always-on request timing for Blogly.
+
+For every request this records the wall time, the number of SQL statements
+and the time spent in them, and the time spent rendering templates. The
+numbers go back to the client in a Server-Timing header and are added to
+in-memory histograms, which /metrics serves in Prometheus text format.
+"""
+from threading import Lock
+from time import perf_counter
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from cache import page_cache
+from fragments import fragments
+
+# Upper bounds, in seconds, of the request duration histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    __slots__ = ('start', 'sql_count', 'sql_time', 'template_time', 'template_start')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+
+
+class EndpointHistogram:
+    """Cumulative request figures for one endpoint."""
+
+    __slots__ = ('buckets', 'count', 'total', 'sql_count', 'sql_time', 'template_time')
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+    def observe(self, duration, stats):
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += duration
+        self.sql_count += stats.sql_count
+        self.sql_time += stats.sql_time
+        self.template_time += stats.template_time
+
+
+class Metrics:
+    """Collects RequestStats for an app and keeps a histogram per endpoint."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_starting, app)
+        template_rendered.connect(self._template_finished, app)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+
+    def _start(self):
+        g.request_stats = RequestStats()
+
+    def _finish(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is not None:
+            response.headers['Server-Timing'] = self.record(request.endpoint or 'unmatched', stats)
+        return response
+
+    def record(self, endpoint, stats):
+        """Add a finished request to its endpoint's histogram. Returns its Server-Timing header."""
+        duration = perf_counter() - stats.start
+        with self._lock:
+            histogram = self.endpoints.get(endpoint)
+            if histogram is None:
+                histogram = self.endpoints[endpoint] = EndpointHistogram()
+            histogram.observe(duration, stats)
+        return ', '.join([
+            f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.sql_count} queries"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+    def _template_starting(self, app, template, context):
+        stats = g.get('request_stats')
+        if stats is not None and stats.template_start is None:
+            stats.template_start = perf_counter()
+
+    def _template_finished(self, app, template, context):
+        stats = g.get('request_stats')
+        if stats is not None and stats.template_start is not None:
+            stats.template_time += perf_counter() - stats.template_start
+            stats.template_start = None
+
+    def expose(self):
+        lines = [
+            '# HELP blogly_request_duration_seconds Time spent handling requests.',
+            '# TYPE blogly_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            snapshot = sorted(self.endpoints.items())
+            for endpoint, histogram in snapshot:
+                label = f'endpoint="{endpoint}"'
+                running = 0
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    running += count
+                    lines.append(f'blogly_request_duration_seconds_bucket{{{label},le="{bound}"}} {running}')
+                lines.append(f'blogly_request_duration_seconds_bucket{{{label},le="+Inf"}} {histogram.count}')
+                lines.append(f'blogly_request_duration_seconds_sum{{{label}}} {histogram.total:.6f}')
+                lines.append(f'blogly_request_duration_seconds_count{{{label}}} {histogram.count}')
+
+            for name, kind, help, attr in (
+                    ('blogly_sql_statements_total', 'counter', 'SQL statements run.', 'sql_count'),
+                    ('blogly_sql_duration_seconds_total', 'counter', 'Time spent in SQL.', 'sql_time'),
+                    ('blogly_template_duration_seconds_total', 'counter', 'Time spent rendering templates.',
+                     'template_time')):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for endpoint, histogram in snapshot:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(histogram, attr)}')
+
+        cache_stats = page_cache.stats()
+        lines += [
+            '# HELP blogly_page_cache_hits_total Pages served from the page cache.',
+            '# TYPE blogly_page_cache_hits_total counter',
+            f'blogly_page_cache_hits_total {cache_stats["hits"]}',
+            '# HELP blogly_page_cache_misses_total Cacheable pages that had to be rendered.',
+            '# TYPE blogly_page_cache_misses_total counter',
+            f'blogly_page_cache_misses_total {cache_stats["misses"]}',
+            '# HELP blogly_fragment_cache_hits_total Post and tag fragments served from the fragment cache.',
+            '# TYPE blogly_fragment_cache_hits_total counter',
+            f'blogly_fragment_cache_hits_total {fragments.hits}',
+            '# HELP blogly_fragment_cache_misses_total Post and tag fragments that had to be rendered.',
+            '# TYPE blogly_fragment_cache_misses_total counter',
+            f'blogly_fragment_cache_misses_total {fragments.misses}',
+        ]
+        return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_starting(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        stats = g.get('request_stats')
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_time += perf_counter() - conn.info['query_start']
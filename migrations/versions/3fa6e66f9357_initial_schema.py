@@ -0,0 +1,116 @@
+"""Initial schema, as models.py declared it before migrations were added
+
+Revision ID: 3fa6e66f9357
+Revises:
+Create Date: 2026-10-18 19:24:25.601859
+
+On Postgres this also adds what models.py creates with DDL: the posts'
+search_vector column and its GIN index, and the statement-level triggers
+that keep users.post_count and tags.post_count current. The other indexes
+come in 6baf5430db73, so databases stamped with this revision get them too.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3fa6e66f9357'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR = """
+ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(content, '')), 'B')
+) STORED;
+CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector);
+"""
+
+COUNTER_TRIGGERS = """
+CREATE OR REPLACE FUNCTION count_{parent}_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE {parent} SET post_count = {parent}.post_count + delta.n
+        FROM (SELECT {fk}, count(*) AS n FROM new_rows GROUP BY {fk}) AS delta
+        WHERE {parent}.id = delta.{fk};
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE {parent} SET post_count = {parent}.post_count - delta.n
+        FROM (SELECT {fk}, count(*) AS n FROM old_rows GROUP BY {fk}) AS delta
+        WHERE {parent}.id = delta.{fk};
+    ELSE
+        UPDATE {parent} SET post_count = {parent}.post_count + delta.n
+        FROM (SELECT {fk}, sum(n) AS n FROM (
+                  SELECT {fk}, 1 AS n FROM (
+                      SELECT {key} FROM new_rows EXCEPT ALL SELECT {key} FROM old_rows) AS added
+                  UNION ALL
+                  SELECT {fk}, -1 AS n FROM (
+                      SELECT {key} FROM old_rows EXCEPT ALL SELECT {key} FROM new_rows) AS removed
+              ) AS moves GROUP BY {fk}) AS delta
+        WHERE {parent}.id = delta.{fk};
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER count_{parent}_posts_insert AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+CREATE TRIGGER count_{parent}_posts_update AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+CREATE TRIGGER count_{parent}_posts_delete AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+"""
+
+
+def upgrade():
+    op.create_table('tags',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('post_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('first_name', sa.String(length=50), nullable=False),
+    sa.Column('last_name', sa.String(length=50), nullable=False),
+    sa.Column('image_url', sa.Text(), nullable=True),
+    sa.Column('post_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('posts',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('title', sa.String(length=50), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('posts_tags',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(SEARCH_VECTOR)
+        op.execute(COUNTER_TRIGGERS.format(parent='users', table='posts', fk='user_id', key='id, user_id'))
+        op.execute(COUNTER_TRIGGERS.format(parent='tags', table='posts_tags', fk='tag_id', key='post_id, tag_id'))
+
+
+def downgrade():
+    op.drop_table('posts_tags')
+    op.drop_table('posts')
+    op.drop_table('users')
+    op.drop_table('tags')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP FUNCTION count_users_posts(), count_tags_posts()')
@@ -0,0 +1,47 @@
+"""Index posts by author and by tag, and the listings' keyset orders
+
+Revision ID: 6baf5430db73
+Revises: 3fa6e66f9357
+Create Date: 2026-10-18 19:24:45.014436
+
+User pages, user feeds and ON DELETE CASCADE from users look posts up by
+user_id; tag pages, tag feeds and the cascade from tags look posts_tags up
+by tag_id. The post, user and tag listings page through the keyset
+indexes. Databases created by db.create_all() and stamped with the initial
+revision may have some of these already, so each one is only created if it
+doesn't exist.
+
+On Postgres the indexes are built CONCURRENTLY, outside the migration's
+transaction, so the tables stay writable while they build. A build that
+fails leaves an INVALID index behind; drop it and run the upgrade again.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6baf5430db73'
+down_revision = '3fa6e66f9357'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_tags_post_count_id', 'tags', ['post_count', 'id']),
+    ('ix_users_name_id', 'users', ['last_name', 'first_name', 'id']),
+    ('ix_posts_created_at_id', 'posts', ['created_at', 'id']),
+    ('ix_posts_user_id_created_at', 'posts', ['user_id', 'created_at']),
+    ('ix_posts_tags_tag_id_post_id', 'posts_tags', ['tag_id', 'post_id']),
+]
+
+
+def upgrade():
+    concurrently = 'CONCURRENTLY ' if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.execute(f'CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
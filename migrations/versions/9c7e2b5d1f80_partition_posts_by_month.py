@@ -0,0 +1,163 @@
+"""Partition posts and posts_tags by month
+
+Revision ID: 9c7e2b5d1f80
+Revises: e5a8c1d07b46
+Create Date: 2026-10-18 22:31:54.602177
+
+posts_tags gains post_created_at, a copy of its post's created_at, and
+refers to posts by (id, created_at). On Postgres both tables are rebuilt as
+tables partitioned by month of that column, with a partition for every
+month that already has posts and a default partition for the rest, and the
+rows are copied across. The copy holds an exclusive lock on both tables
+until it commits. `flask blogly create-partitions` adds partitions for the
+coming months afterwards.
+
+Other databases keep plain tables: posts_tags gets the new column, filled
+in from posts, and its foreign key to posts is replaced by the same
+(post_id, post_created_at) one, against a unique index on posts.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c7e2b5d1f80'
+down_revision = 'e5a8c1d07b46'
+branch_labels = None
+depends_on = None
+
+POST_COLUMNS = 'id, title, content, excerpt, rendered_html, created_at, updated_at, user_id'
+
+SEARCH_VECTOR = """
+ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(content, '')), 'B')
+) STORED;
+CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector);
+"""
+
+# The count_*_posts() functions are left in place by the tables being replaced.
+COUNTER_TRIGGERS = """
+CREATE TRIGGER count_{parent}_posts_insert AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+CREATE TRIGGER count_{parent}_posts_update AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+CREATE TRIGGER count_{parent}_posts_delete AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+"""
+
+# Names SQLite's unnamed foreign keys from the initial schema, so batch mode can drop one.
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+# A partition for each month that has posts, named as partitions.py names them.
+MONTHLY_PARTITIONS = """
+DO $$
+DECLARE
+    month date;
+BEGIN
+    FOR month IN SELECT DISTINCT date_trunc('month', created_at)::date FROM old_posts LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF posts FOR VALUES FROM (%L) TO (%L)',
+                       'posts_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month');
+        EXECUTE format('CREATE TABLE %I PARTITION OF posts_tags FOR VALUES FROM (%L) TO (%L)',
+                       'posts_tags_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month');
+    END LOOP;
+END $$;
+"""
+
+
+def rebuild(partitioned):
+    """Replace posts and posts_tags with copies, partitioned by month or not."""
+    op.execute('ALTER TABLE posts_tags RENAME TO old_posts_tags')
+    op.execute('ALTER TABLE posts RENAME TO old_posts')
+    # Index names are shared across the schema; free them for the new tables.
+    op.execute('DROP INDEX ix_posts_created_at_id, ix_posts_user_id_created_at, ix_posts_search_vector, '
+               'ix_posts_tags_tag_id_post_id')
+    op.execute('ALTER TABLE old_posts RENAME CONSTRAINT posts_pkey TO old_posts_pkey')
+    op.execute('ALTER TABLE old_posts_tags RENAME CONSTRAINT posts_tags_pkey TO old_posts_tags_pkey')
+
+    if partitioned:
+        post_key, post_partitioning = 'id, created_at', ' PARTITION BY RANGE (created_at)'
+        tag_columns, tag_partitioning = 'post_id, tag_id, post_created_at', ' PARTITION BY RANGE (post_created_at)'
+        post_reference = ('FOREIGN KEY (post_id, post_created_at) REFERENCES posts (id, created_at) '
+                          'ON DELETE CASCADE ON UPDATE CASCADE')
+        copied_tags = ('SELECT old_posts_tags.post_id, old_posts_tags.tag_id, old_posts.created_at '
+                       'FROM old_posts_tags JOIN old_posts ON old_posts.id = old_posts_tags.post_id')
+    else:
+        post_key, post_partitioning = 'id', ''
+        tag_columns, tag_partitioning = 'post_id, tag_id', ''
+        post_reference = 'FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE'
+        copied_tags = 'SELECT post_id, tag_id FROM old_posts_tags'
+
+    op.execute(f"""
+        CREATE TABLE posts (
+            id integer NOT NULL DEFAULT nextval('posts_id_seq'),
+            title varchar(50) NOT NULL,
+            content text NOT NULL,
+            excerpt text,
+            rendered_html text,
+            created_at timestamp NOT NULL,
+            updated_at timestamp NOT NULL DEFAULT now(),
+            user_id integer,
+            PRIMARY KEY ({post_key}),
+            CONSTRAINT posts_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        ){post_partitioning};
+        ALTER SEQUENCE posts_id_seq OWNED BY posts.id;
+        CREATE TABLE posts_tags (
+            post_id integer NOT NULL,
+            tag_id integer NOT NULL,
+            {'post_created_at timestamp NOT NULL,' if partitioned else ''}
+            PRIMARY KEY ({tag_columns}),
+            CONSTRAINT posts_tags_post_id_fkey {post_reference},
+            CONSTRAINT posts_tags_tag_id_fkey FOREIGN KEY (tag_id) REFERENCES tags (id) ON DELETE CASCADE
+        ){tag_partitioning};
+    """)
+    op.execute(SEARCH_VECTOR)
+    if partitioned:
+        op.execute('CREATE TABLE posts_default PARTITION OF posts DEFAULT')
+        op.execute('CREATE TABLE posts_tags_default PARTITION OF posts_tags DEFAULT')
+        op.execute(MONTHLY_PARTITIONS)
+
+    op.execute(f'INSERT INTO posts ({POST_COLUMNS}) SELECT {POST_COLUMNS} FROM old_posts')
+    op.execute(f'INSERT INTO posts_tags ({tag_columns}) {copied_tags}')
+    op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'])
+    op.create_index('ix_posts_user_id_created_at', 'posts', ['user_id', 'created_at'])
+    op.create_index('ix_posts_tags_tag_id_post_id', 'posts_tags', ['tag_id', 'post_id'])
+    # Added after the copy, which leaves the counters as they were.
+    op.execute(COUNTER_TRIGGERS.format(parent='users', table='posts'))
+    op.execute(COUNTER_TRIGGERS.format(parent='tags', table='posts_tags'))
+
+    op.drop_table('old_posts_tags')
+    op.drop_table('old_posts')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        rebuild(partitioned=True)
+        return
+
+    op.add_column('posts_tags', sa.Column('post_created_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE posts_tags SET post_created_at = '
+               '(SELECT created_at FROM posts WHERE posts.id = posts_tags.post_id)')
+    op.create_index('uq_posts_id_created_at', 'posts', ['id', 'created_at'], unique=True)
+    with op.batch_alter_table('posts_tags', naming_convention=NAMING_CONVENTION) as batch:
+        batch.alter_column('post_created_at', existing_type=sa.DateTime(), nullable=False)
+        batch.drop_constraint('fk_posts_tags_post_id_posts', type_='foreignkey')
+        batch.create_foreign_key('posts_tags_post_id_fkey', 'posts', ['post_id', 'post_created_at'],
+                                 ['id', 'created_at'], ondelete='CASCADE', onupdate='CASCADE')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # Partitions already moved to the archive schema are left there.
+        rebuild(partitioned=False)
+        return
+
+    with op.batch_alter_table('posts_tags', naming_convention=NAMING_CONVENTION) as batch:
+        batch.drop_constraint('posts_tags_post_id_fkey', type_='foreignkey')
+        batch.drop_column('post_created_at')
+        batch.create_foreign_key('fk_posts_tags_post_id_posts', 'posts', ['post_id'], ['id'], ondelete='CASCADE')
+    op.drop_index('uq_posts_id_created_at', table_name='posts')
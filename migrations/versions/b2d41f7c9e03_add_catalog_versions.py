@@ -0,0 +1,33 @@
+"""Add catalog_versions
+
+Revision ID: b2d41f7c9e03
+Revises: 6baf5430db73
+Create Date: 2026-10-18 21:02:11.730518
+
+One counter row per catalog in catalog.py, bumped whenever tags or posts
+are added, renamed or deleted, so each process can tell when its cached
+copy is stale.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d41f7c9e03'
+down_revision = '6baf5430db73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_versions = op.create_table('catalog_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(catalog_versions, [{'name': 'tags', 'version': 0}, {'name': 'posts', 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('catalog_versions')
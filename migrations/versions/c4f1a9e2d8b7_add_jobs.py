@@ -0,0 +1,37 @@
+"""Add jobs
+
+Revision ID: c4f1a9e2d8b7
+Revises: 9c7e2b5d1f80
+Create Date: 2026-10-18 22:41:05.118204
+
+Background job status moves from one process's memory into the database,
+so every worker can answer /jobs/<id> and it survives restarts.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f1a9e2d8b7'
+down_revision = '9c7e2b5d1f80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('jobs',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('description', sa.Text(), nullable=False),
+    sa.Column('next_url', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_jobs_created_at'), 'jobs', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_jobs_created_at'), table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,26 @@
+"""Drop the posts catalog version
+
+Revision ID: d7e3b8a1f5c2
+Revises: c4f1a9e2d8b7
+Create Date: 2026-10-18 23:12:48.306571
+
+The post catalog no longer has a counter row: bumping it made every post
+insert, delete and retitle update the same row. Only the tags row is left.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3b8a1f5c2'
+down_revision = 'c4f1a9e2d8b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("DELETE FROM catalog_versions WHERE name = 'posts'")
+
+
+def downgrade():
+    op.execute("INSERT INTO catalog_versions (name, version) VALUES ('posts', 0)")
@@ -0,0 +1,32 @@
+"""Add posts.excerpt and posts.rendered_html
+
+Revision ID: e5a8c1d07b46
+Revises: b2d41f7c9e03
+Create Date: 2026-10-18 21:47:30.218864
+
+Both are worked out from content when a post is saved. The columns start
+out empty for existing posts, which pages render from content until
+they're filled in after upgrading with
+
+    flask blogly backfill-posts
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a8c1d07b46'
+down_revision = 'b2d41f7c9e03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('excerpt', sa.Text(), nullable=True))
+    op.add_column('posts', sa.Column('rendered_html', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('posts', 'rendered_html')
+    op.drop_column('posts', 'excerpt')
@@ -1,17 +1,77 @@
 """Models for Blogly."""
 from enum import unique
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from sqlalchemy.orm import backref
+from flask.signals import Namespace
+from datetime import datetime, timezone
+import re
+import sqlite3
+from markupsafe import escape
+from sqlalchemy import event, inspect, bindparam, DDL, PrimaryKeyConstraint
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import backref, validates
+from replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+_signals = Namespace()
+
+# Sent with the ids involved whenever posts_tags rows are written in bulk,
+# since those writes bypass the ORM's own events.
+associations_changed = _signals.signal('associations-changed')
+
+# SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to.
+@event.listens_for(Engine, 'connect')
+def _enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+# On Postgres, posts and their posts_tags rows are split into one partition
+# per month of the post's created_at (see partitions.py). A partitioned
+# table's primary key has to include the column it's partitioned by, so the
+# key is widened with it there; the ORM still identifies rows by the
+# declared key alone, and other databases keep plain tables.
+PARTITION_KEYS = {'posts': 'created_at', 'posts_tags': 'post_created_at'}
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _partitioned_primary_key(constraint, compiler, **kw):
+    partition_key = PARTITION_KEYS.get(constraint.table.name)
+    if partition_key is None or not constraint.table.dialect_options['postgresql']['partition_by']:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return 'PRIMARY KEY (%s)' % ', '.join(compiler.preparer.quote(name) for name in columns)
 
 def connect_db(app):
-    db.app = app
+    # The first app connected stays the default for code running outside an app context.
+    if db.app is None:
+        db.app = app
     db.init_app(app)
 
+def utc(moment):
+    """A stored timestamp, local time as datetime.now() gives it, as naive UTC for HTTP and Atom dates."""
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+# Longest excerpt, in characters, shown for a post in listings.
+EXCERPT_LENGTH = 200
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """`content` on one line, cut at a word and ended with an ellipsis if it's longer than `length`."""
+    text = ' '.join(content.split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '...'
+
+def render_content(content):
+    """`content` as escaped HTML: a paragraph per blank-line-separated block, with line breaks kept."""
+    blocks = [block.strip() for block in re.split(r'\n\s*\n', content.replace('\r\n', '\n'))]
+    return '\n'.join(f'<p>{escape(block)}</p>'.replace('\n', '<br>\n') for block in blocks if block)
+
+def post_text(content):
+    """The columns derived from a post's content."""
+    return {'excerpt': make_excerpt(content), 'rendered_html': render_content(content)}
+
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (db.Index('ix_users_name_id', 'last_name', 'first_name', 'id'),)
 
     id = db.Column(db.Integer,
                    primary_key=True,
@@ -23,12 +83,20 @@ class User(db.Model):
 
     image_url = db.Column(db.Text, nullable=True)
 
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.func.now())
+
     @property
     def full_name(self):
         return f'{self.first_name} {self.last_name}'
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (db.Index('ix_posts_created_at_id', 'created_at', 'id'),
+                      db.Index('ix_posts_user_id_created_at', 'user_id', 'created_at'),
+                      {'postgresql_partition_by': 'RANGE (created_at)'})
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -36,28 +104,320 @@ class Post(db.Model):
 
     content = db.Column(db.Text, nullable=False)
 
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    # Derived from content whenever it's set, so pages don't redo it on every
+    # view. Listings load excerpt and leave content and rendered_html deferred.
+    excerpt = db.Column(db.Text)
+
+    rendered_html = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.func.now())
 
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
 
-    user = db.relationship('User', backref=backref('posts', cascade='all, delete-orphan'))
+    # The database deletes a user's posts and a post's posts_tags rows itself
+    # (ON DELETE CASCADE), so deleting a user or post doesn't load them first.
+    user = db.relationship('User', backref=backref('posts', cascade='all, delete-orphan', passive_deletes=True))
 
-    tags = db.relationship('Tag', secondary='posts_tags', backref='posts')
+    tags = db.relationship('Tag', secondary='posts_tags', backref=backref('posts', passive_deletes=True),
+                           passive_deletes=True)
+
+    @validates('content')
+    def _derive_text(self, key, content):
+        if content is not None:
+            for column, value in post_text(content).items():
+                setattr(self, column, value)
+        return content
+
+    # Posts saved before excerpt and rendered_html existed have neither until
+    # `flask blogly backfill-posts` fills them in, so pages work them out
+    # from content meanwhile.
+    @property
+    def summary(self):
+        return self.excerpt if self.excerpt is not None else make_excerpt(self.content)
+
+    @property
+    def body_html(self):
+        return self.rendered_html if self.rendered_html is not None else render_content(self.content)
 
     @property
     def pretty_datetime(self):
         return self.created_at.strftime("%b %d, %Y %I:%M %p")
 
+# Postgres keeps a weighted full-text vector of each post's title and content
+# for search.py. Other databases go without it and search.py falls back to LIKE.
+event.listen(Post.__table__, 'after_create', DDL("""
+    ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED;
+    CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector);
+""").execute_if(dialect='postgresql'))
+
+# posts_tags refers to posts by (id, created_at), the only key a partitioned
+# posts can have. Postgres has that key already; elsewhere it's indexed here.
+event.listen(Post.__table__, 'after_create', DDL(
+    'CREATE UNIQUE INDEX uq_posts_id_created_at ON posts (id, created_at)'
+).execute_if(callable_=lambda ddl, target, bind, **kw: bind.dialect.name != 'postgresql'))
+
+# A post's tags are part of the post, so changing them counts as updating it.
+@event.listens_for(Post.tags, 'append')
+@event.listens_for(Post.tags, 'remove')
+def _touch_post(post, tag, initiator):
+    post.updated_at = datetime.now()
+
 class Tag(db.Model):
     __tablename__ = 'tags'
+    __table_args__ = (db.Index('ix_tags_post_count_id', 'post_count', 'id'),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
     name = db.Column(db.String(50), nullable=False, unique=True)
 
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.func.now())
+
 class PostTag(db.Model):
     __tablename__ = 'posts_tags'
+    # The primary key covers lookups by post; this covers them by tag.
+    __table_args__ = (db.Index('ix_posts_tags_tag_id_post_id', 'tag_id', 'post_id'),
+                      db.ForeignKeyConstraint(['post_id', 'post_created_at'], ['posts.id', 'posts.created_at'],
+                                              name='posts_tags_post_id_fkey', ondelete='CASCADE', onupdate='CASCADE'),
+                      {'postgresql_partition_by': 'RANGE (post_created_at)'})
+
+    post_id = db.Column(db.Integer, primary_key=True)
+
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
+
+    # A copy of the post's created_at, so each row lives in the same month's
+    # partition as its post and follows it there.
+    post_created_at = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def set_tags(cls, post_id, tag_ids):
+        cls._replace(cls.post_id, post_id, cls.tag_id, tag_ids)
+
+    @classmethod
+    def set_posts(cls, tag_id, post_ids, among=None):
+        cls._replace(cls.tag_id, tag_id, cls.post_id, post_ids, among)
+
+    @classmethod
+    def _replace(cls, owner_col, owner_id, target_col, target_ids, among=None):
+        """Point owner_id at exactly target_ids, deleting and inserting only the rows that change.
+
+        With `among`, only rows for those targets (and target_ids) are considered,
+        so a form leaves alone what it didn't show.
+        """
+        wanted = set(target_ids)
+        current_query = db.session.query(target_col).filter(owner_col == owner_id)
+        if among is not None:
+            current_query = current_query.filter(target_col.in_(set(among) | wanted))
+        current = {target_id for (target_id,) in current_query}
+
+        removed = current - wanted
+        added = wanted - current
+        if removed:
+            (db.session.query(cls)
+             .filter(owner_col == owner_id, target_col.in_(removed))
+             .delete(synchronize_session=False))
+
+        if added:
+            rows = [{owner_col.key: owner_id, target_col.key: target_id} for target_id in added]
+            post_ids = {row['post_id'] for row in rows}
+            created = dict(db.session.query(Post.id, Post.created_at).filter(Post.id.in_(post_ids)))
+            for row in rows:
+                row['post_created_at'] = created[row['post_id']]
+            db.session.execute(cls.__table__.insert().values(rows))
+
+        if removed or added:
+            changed = {owner_col.key: {owner_id}, target_col.key: removed | added}
+            (db.session.query(Post)
+             .filter(Post.id.in_(changed['post_id']))
+             .update({Post.updated_at: datetime.now()}, synchronize_session=False))
+            associations_changed.send(db.session(), post_ids=changed['post_id'], tag_ids=changed['tag_id'])
+
+class CatalogVersion(db.Model):
+    """A counter per cached table, bumped in the transaction that changes it; only 'tags' (tagindex.py) for now."""
+    __tablename__ = 'catalog_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def bump(cls, connection, name):
+        connection.execute(cls.__table__.update()
+                           .where(cls.name == name)
+                           .values(version=cls.version + 1))
+
+event.listen(CatalogVersion.__table__, 'after_create', DDL(
+    "INSERT INTO catalog_versions (name, version) VALUES ('tags', 0)"))
+
+class Job(db.Model):
+    """A background job (jobs.py) and how it went, shared by every worker process."""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+
+    description = db.Column(db.Text, nullable=False)
+
+    next_url = db.Column(db.Text, nullable=False)
+
+    status = db.Column(db.String(10), nullable=False, default='queued')
+
+    error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+# Rows from months that have no partition of their own land in a default
+# one; partitions.create_partitions() moves them out when their month gets one.
+for _table in (Post.__table__, PostTag.__table__):
+    event.listen(_table, 'after_create', DDL(
+        'CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT'
+    ).execute_if(dialect='postgresql'))
+
+# users.post_count and tags.post_count are kept up to date by statement-level
+# triggers on Postgres, so bulk deletes and imports adjust each counter once
+# per statement rather than once per row. recount_posts() repairs them, and
+# is the only way they are maintained on other databases.
+_COUNTER_TRIGGERS = """
+CREATE OR REPLACE FUNCTION count_{parent}_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE {parent} SET post_count = {parent}.post_count + delta.n
+        FROM (SELECT {fk}, count(*) AS n FROM new_rows GROUP BY {fk}) AS delta
+        WHERE {parent}.id = delta.{fk};
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE {parent} SET post_count = {parent}.post_count - delta.n
+        FROM (SELECT {fk}, count(*) AS n FROM old_rows GROUP BY {fk}) AS delta
+        WHERE {parent}.id = delta.{fk};
+    ELSE
+        -- Only rows whose key changed move a post from one counter to another.
+        UPDATE {parent} SET post_count = {parent}.post_count + delta.n
+        FROM (SELECT {fk}, sum(n) AS n FROM (
+                  SELECT {fk}, 1 AS n FROM (
+                      SELECT {key} FROM new_rows EXCEPT ALL SELECT {key} FROM old_rows) AS added
+                  UNION ALL
+                  SELECT {fk}, -1 AS n FROM (
+                      SELECT {key} FROM old_rows EXCEPT ALL SELECT {key} FROM new_rows) AS removed
+              ) AS moves GROUP BY {fk}) AS delta
+        WHERE {parent}.id = delta.{fk};
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER count_{parent}_posts_insert AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+CREATE TRIGGER count_{parent}_posts_update AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+CREATE TRIGGER count_{parent}_posts_delete AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_{parent}_posts();
+"""
+
+event.listen(Post.__table__, 'after_create', DDL(
+    _COUNTER_TRIGGERS.format(parent='users', table='posts', fk='user_id', key='id, user_id')
+).execute_if(dialect='postgresql'))
+
+event.listen(PostTag.__table__, 'after_create', DDL(
+    _COUNTER_TRIGGERS.format(parent='tags', table='posts_tags', fk='tag_id', key='post_id, tag_id')
+).execute_if(dialect='postgresql'))
+
+def recount_posts():
+    """Recompute every users.post_count and tags.post_count from the posts themselves."""
+    for parent, table, fk in ((User, Post, Post.user_id), (Tag, PostTag, PostTag.tag_id)):
+        counts = (db.session.query(fk.label('parent_id'), db.func.count().label('n'))
+                  .group_by(fk)
+                  .subquery())
+        if db.session.bind.dialect.name == 'postgresql':
+            # Reset stale counters, then fill in the grouped counts in one pass.
+            db.session.query(parent).filter(parent.post_count != 0).update(
+                {parent.post_count: 0}, synchronize_session=False)
+            db.session.execute(parent.__table__.update()
+                               .where(parent.id == counts.c.parent_id)
+                               .values(post_count=counts.c.n))
+        else:
+            counted = (db.session.query(db.func.count())
+                       .select_from(table).filter(fk == parent.id)
+                       .correlate(parent).as_scalar())
+            db.session.query(parent).update({parent.post_count: counted}, synchronize_session=False)
+
+def backfill_post_text(chunk_size=1000):
+    """Fill in excerpt and rendered_html for posts saved before they existed. Returns how many were filled."""
+    fill = (Post.__table__.update()
+            .where(Post.id == bindparam('post_id'))
+            .values(excerpt=bindparam('new_excerpt'), rendered_html=bindparam('new_rendered_html'),
+                    updated_at=Post.updated_at))
+    filled = 0
+    while True:
+        rows = (db.session.query(Post.id, Post.content)
+                .filter(Post.excerpt.is_(None))
+                .order_by(Post.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            return filled
+        params = []
+        for id, content in rows:
+            text = post_text(content)
+            params.append({'post_id': id, 'new_excerpt': text['excerpt'],
+                           'new_rendered_html': text['rendered_html']})
+        db.session.execute(fill, params)
+        db.session.commit()
+        filled += len(rows)
+
+def add_delete_cascades():
+    """Give an existing Postgres database the ON DELETE CASCADE foreign keys the models declare.
+
+    Tables created before the models declared them keep foreign keys that
+    refuse to delete referenced rows. Checking a new key against every row
+    would block writes to both tables for as long as it takes, so each key
+    is replaced NOT VALID, which only holds the lock briefly, and then
+    validated, which reads the rows without blocking writes, committing
+    after each step. Postgres can't add a NOT VALID key to a partitioned
+    table, so there each partition gets its own key, validated, first, and
+    the table's key then adopts those instead of checking the rows again.
+    Returns the names of the constraints that changed.
+    """
+    changed = []
+    for table in (Post.__table__, PostTag.__table__):
+        # Postgres also lists the copies it keeps of a key for each partition it refers to.
+        existing = {(tuple(fk['constrained_columns']), fk['referred_table']): fk
+                    for fk in inspect(db.session.connection()).get_foreign_keys(table.name)}
+        for constraint in table.foreign_key_constraints:
+            fk = existing.get((tuple(constraint.column_keys), constraint.referred_table.name))
+            if fk is None or (fk['options'].get('ondelete') or '').upper() == constraint.ondelete:
+                continue
+            columns = ', '.join(constraint.column_keys)
+            referred = ', '.join(element.column.name for element in constraint.elements)
+            onupdate = f' ON UPDATE {constraint.onupdate}' if constraint.onupdate else ''
+            definition = (f'FOREIGN KEY ({columns}) REFERENCES {constraint.referred_table.name} ({referred}) '
+                          f'ON DELETE {constraint.ondelete}{onupdate}')
+
+            partitions = [name for name, in db.session.execute(
+                'SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table) '
+                'ORDER BY 1', {'table': table.name})]
+            if partitions:
+                for partition in partitions:
+                    _add_validated(partition, f'{partition}_{fk["name"]}', definition)
+                db.session.execute(f'ALTER TABLE {table.name} DROP CONSTRAINT {fk["name"]}, '
+                                   f'ADD CONSTRAINT {fk["name"]} {definition}')
+                db.session.commit()
+            else:
+                _add_validated(table.name, fk['name'], definition, replacing=True)
+            changed.append(fk['name'])
+    return changed
 
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
 
-    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
\ No newline at end of file
+def _add_validated(table, name, definition, replacing=False):
+    drop = f'DROP CONSTRAINT {name}, ' if replacing else ''
+    db.session.execute(f'ALTER TABLE {table} {drop}ADD CONSTRAINT {name} {definition} NOT VALID')
+    db.session.commit()
+    db.session.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}')
+    db.session.commit()
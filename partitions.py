@@ -0,0 +1,152 @@
+"""Monthly partitions of posts and posts_tags, and archiving old ones.
+
+On Postgres posts is partitioned by the month of created_at, and posts_tags
+by the month of post_created_at, the created_at of the post each row tags,
+so a post and its tags always sit in the partitions for the same month:
+posts_y2024m03 and posts_tags_y2024m03. Rows for months without partitions
+of their own go to posts_default and posts_tags_default.
+
+`flask blogly create-partitions` creates the partitions for this month and
+the next few, moving any rows the default partitions hold for those months
+into them; run it monthly. `flask blogly archive-partitions` detaches the
+partitions of months before a cutoff and moves them into the archive
+schema, where they can still be queried, dumped or dropped but the app no
+longer sees them.
+
+Listings that bound created_at, such as keyset pages and the timeline, let
+Postgres skip the partitions outside the bound. Other databases keep plain
+tables, and these functions leave them alone.
+"""
+import re
+from datetime import datetime
+
+from models import db, Post
+
+ARCHIVE_SCHEMA = 'archive'
+
+PARTITION_NAME = re.compile(r'^(posts|posts_tags)_(default|y(\d{4})m(\d{2}))$')
+
+# search_vector is generated from these, so it isn't copied.
+POST_COLUMNS = ', '.join(column.name for column in Post.__table__.columns)
+POST_TAG_COLUMNS = 'post_id, tag_id, post_created_at'
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_y{month:%Y}m{month:%m}'
+
+
+def is_partition(name):
+    """Whether `name` is one of the tables holding part of posts or posts_tags."""
+    return PARTITION_NAME.match(name) is not None
+
+
+def is_partitioned():
+    if db.session.connection().dialect.name != 'postgresql':
+        return False
+    return db.session.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('posts')").scalar() is True
+
+
+def partition_months():
+    """The months posts has a partition attached for, oldest first."""
+    rows = db.session.execute("""
+        SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'posts'::regclass
+    """)
+    matches = [PARTITION_NAME.match(name) for name, in rows]
+    return sorted(datetime(int(match.group(3)), int(match.group(4)), 1)
+                  for match in matches if match and match.group(3))
+
+
+def create_partitions(months_ahead=3, now=None):
+    """Create the partitions for this month and the next `months_ahead` that are missing. Returns their months."""
+    if not is_partitioned():
+        return []
+    first = month_start(now or datetime.now())
+    existing = set(partition_months())
+    created = []
+    for month in (add_months(first, n) for n in range(months_ahead + 1)):
+        if month not in existing:
+            _create_month(month)
+            created.append(month)
+    return created
+
+
+def _create_month(month):
+    bounds = {'start': month, 'end': add_months(month, 1)}
+    values = f"FROM ('{month:%Y-%m-%d}') TO ('{bounds['end']:%Y-%m-%d}')"
+    posts, posts_tags = partition_name('posts', month), partition_name('posts_tags', month)
+
+    # Postgres won't attach a partition while the default one holds rows that
+    # belong in it, so those rows are set aside and put back afterwards. The
+    # statements name the partitions rather than the tables, which keeps the
+    # post counters' triggers out of it: the rows only change places.
+    held = db.session.execute('SELECT count(*) FROM posts_default '
+                              'WHERE created_at >= :start AND created_at < :end', bounds).scalar()
+    if held:
+        db.session.execute(f'CREATE TEMPORARY TABLE moving_posts_tags AS SELECT {POST_TAG_COLUMNS} '
+                           'FROM posts_tags_default WHERE post_created_at >= :start AND post_created_at < :end',
+                           bounds)
+        db.session.execute(f'CREATE TEMPORARY TABLE moving_posts AS SELECT {POST_COLUMNS} '
+                           'FROM posts_default WHERE created_at >= :start AND created_at < :end', bounds)
+        db.session.execute('DELETE FROM posts_tags_default '
+                           'WHERE post_created_at >= :start AND post_created_at < :end', bounds)
+        db.session.execute('DELETE FROM posts_default WHERE created_at >= :start AND created_at < :end', bounds)
+
+    db.session.execute(f'CREATE TABLE {posts} PARTITION OF posts FOR VALUES {values}')
+    db.session.execute(f'CREATE TABLE {posts_tags} PARTITION OF posts_tags FOR VALUES {values}')
+
+    if held:
+        db.session.execute(f'INSERT INTO {posts} ({POST_COLUMNS}) SELECT {POST_COLUMNS} FROM moving_posts')
+        db.session.execute(f'INSERT INTO {posts_tags} ({POST_TAG_COLUMNS}) '
+                           f'SELECT {POST_TAG_COLUMNS} FROM moving_posts_tags')
+        db.session.execute('DROP TABLE moving_posts, moving_posts_tags')
+
+
+def archive_partitions(before):
+    """Move the partitions of months before the one `before` falls in to the archive schema. Returns their months.
+
+    Archived posts stop counting towards their users' and tags' post counts.
+    Their rows keep their foreign keys to users and tags, so deleting a user
+    or tag still deletes its archived posts or their tags.
+    """
+    if not is_partitioned():
+        return []
+    cutoff = month_start(before)
+    months = [month for month in partition_months() if month < cutoff]
+    if not months:
+        return []
+
+    db.session.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+    for month in months:
+        posts, posts_tags = partition_name('posts', month), partition_name('posts_tags', month)
+        db.session.execute(f"""
+            UPDATE users SET post_count = users.post_count - archived.n
+            FROM (SELECT user_id, count(*) AS n FROM {posts} GROUP BY user_id) AS archived
+            WHERE users.id = archived.user_id
+        """)
+        db.session.execute(f"""
+            UPDATE tags SET post_count = tags.post_count - archived.n
+            FROM (SELECT tag_id, count(*) AS n FROM {posts_tags} GROUP BY tag_id) AS archived
+            WHERE tags.id = archived.tag_id
+        """)
+
+        # The tags go first: posts can't lose a partition posts_tags still refers to.
+        db.session.execute(f'ALTER TABLE posts_tags DETACH PARTITION {posts_tags}')
+        db.session.execute(f'ALTER TABLE {posts_tags} DROP CONSTRAINT posts_tags_post_id_fkey')
+        db.session.execute(f'ALTER TABLE posts DETACH PARTITION {posts}')
+        db.session.execute(f'ALTER TABLE {posts} SET SCHEMA {ARCHIVE_SCHEMA}')
+        db.session.execute(f'ALTER TABLE {posts_tags} SET SCHEMA {ARCHIVE_SCHEMA}')
+        db.session.execute(f'ALTER TABLE {ARCHIVE_SCHEMA}.{posts_tags} ADD CONSTRAINT posts_tags_post_id_fkey '
+                           f'FOREIGN KEY (post_id, post_created_at) '
+                           f'REFERENCES {ARCHIVE_SCHEMA}.{posts} (id, created_at) ON DELETE CASCADE')
+
+    return months
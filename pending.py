@@ -0,0 +1,41 @@
+"""Changes collected while a session writes, acted on only once it commits.
+
+The caches keep themselves current from model events, but an event fires
+when the session flushes, before anyone knows whether the transaction will
+commit. Each cache makes a PendingChanges with a name and a function to
+apply them; its event handlers record changes against the session, and the
+changes are handed over after the commit or thrown away after a rollback.
+"""
+from sqlalchemy import event
+from models import db
+
+
+class PendingChanges:
+    """One cache's changes waiting in session.info under `name` for the transaction to end."""
+
+    def __init__(self, name, apply=None, collection=list):
+        self.name = name
+        self.apply = apply
+        self.collection = collection
+        event.listen(db.session, 'after_commit', self._committed)
+        event.listen(db.session, 'after_rollback', self._rolled_back)
+
+    def record(self, session, *changes):
+        if session is None:
+            return
+        pending = session.info.setdefault(self.name, self.collection())
+        if isinstance(pending, set):
+            pending.update(changes)
+        else:
+            pending.extend(changes)
+
+    def pending(self, session):
+        return session.info.get(self.name, self.collection())
+
+    def _committed(self, session):
+        changes = session.info.pop(self.name, None)
+        if changes and self.apply is not None:
+            self.apply(changes)
+
+    def _rolled_back(self, session):
+        session.info.pop(self.name, None)
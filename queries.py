@@ -0,0 +1,127 @@
+"""Query builders for Blogly listing pages."""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import tuple_
+from sqlalchemy.orm import defer, joinedload, selectinload
+from models import User, Post, Tag, PostTag
+
+PER_PAGE = 20
+
+POST_ORDER = (Post.created_at, Post.id)
+USER_ORDER = (User.last_name, User.first_name, User.id)
+TAG_ORDER = (Tag.name,)
+TOP_TAG_ORDER = (Tag.post_count, Tag.id)
+
+# Listings show a post's excerpt, so its full text isn't read for them.
+LISTING_DEFERRED = (Post.content, Post.rendered_html)
+
+
+class Page:
+    """One page of a keyset-paginated listing."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor back into column values, or abort with a 400 if it's garbage."""
+    try:
+        values = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [cursor_value(col, v) for col, v in zip(columns, values)]
+    except (ValueError, TypeError, Base64Error):
+        abort(400)
+
+
+def cursor_value(column, value):
+    """`value` as `column` holds it, or a ValueError if a cursor can't have put it there."""
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    # JSON has no other way to tell true from 1.
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        raise ValueError(value)
+    return value
+
+
+def keyset_page(query, columns, descending=False, after=None, before=None, per_page=PER_PAGE):
+    """Fetch the page of `query` that follows `after` or precedes `before`.
+
+    `columns` must identify a row uniquely, and every column is sorted in the
+    same direction so the cursor can be compared as a row value, which lets
+    Postgres seek straight to it through a matching composite index. The
+    first column is bounded on its own as well, which Postgres can prune
+    partitions by and can't with a row value.
+    """
+    backwards = before is not None
+    reverse_sort = descending != backwards
+    cursor = before if backwards else after
+    if cursor is not None:
+        values = decode_cursor(cursor, columns)
+        key, bound = tuple_(*columns), tuple_(*values)
+        if reverse_sort:
+            query = query.filter(columns[0] <= values[0], key < bound)
+        else:
+            query = query.filter(columns[0] >= values[0], key > bound)
+
+    query = query.order_by(*[col.desc() if reverse_sort else col.asc() for col in columns])
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if backwards:
+        items.reverse()
+
+    def cursor_for(item):
+        return encode_cursor([getattr(item, col.key) for col in columns])
+
+    has_next = backwards or has_more
+    has_prev = has_more if backwards else after is not None
+    return Page(items,
+                next_cursor=cursor_for(items[-1]) if items and has_next else None,
+                prev_cursor=cursor_for(items[0]) if items and has_prev else None)
+
+
+def post_listing():
+    """Posts without their full text, with their author joined in and their tags loaded in one extra query."""
+    return Post.query.options(*[defer(column) for column in LISTING_DEFERRED],
+                              joinedload(Post.user), selectinload(Post.tags))
+
+
+def post_page(after=None, before=None):
+    return keyset_page(post_listing(), POST_ORDER, descending=True, after=after, before=before)
+
+
+def user_page(after=None, before=None):
+    return keyset_page(User.query, USER_ORDER, after=after, before=before)
+
+
+def tag_page(after=None, before=None, sort='name'):
+    """Tags by name, or with sort='top' the most used first."""
+    if sort == 'top':
+        return keyset_page(Tag.query, TOP_TAG_ORDER, descending=True, after=after, before=before)
+    return keyset_page(Tag.query, TAG_ORDER, after=after, before=before)
+
+
+def posts_for_user(user_id):
+    return post_listing().filter(Post.user_id == user_id).order_by(Post.created_at.desc()).all()
+
+
+def posts_for_tag(tag_id):
+    # Joined on both columns of the foreign key, so each post only meets its own month's posts_tags rows.
+    return (post_listing()
+            .join(PostTag)
+            .filter(PostTag.tag_id == tag_id)
+            .order_by(Post.created_at.desc())
+            .all())
@@ -0,0 +1,135 @@
+"""Read replica routing for the SQLAlchemy session.
+
+With SQLALCHEMY_REPLICA_URIS set, the SELECTs run while handling a GET or
+HEAD request go to one of the replicas, picked once per request either in
+turn ('round-robin') or by fewest connections in use ('least-connections').
+Everything else goes to the primary:
+
+- writes, and every statement after the session's first write, so a request
+  always reads what it has just written;
+- requests from a client that wrote something in the last
+  REPLICA_STICKY_SECONDS, marked by a short-lived cookie, so a lagging
+  replica can't hide a client's own changes from it;
+- anything run outside a request, such as CLI commands;
+- reads inside `with db.on_primary():`, which the caches use to rebuild
+  entries a commit has just evicted. A lagging replica would otherwise put
+  the old rows back for the whole TTL.
+
+The replicas are registered as Flask-SQLAlchemy binds named replica0,
+replica1, ..., so their engines are built with the same options as the
+primary's.
+"""
+from contextlib import contextmanager
+from itertools import count
+from threading import Lock
+
+from flask import current_app, has_request_context, g, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import Select, CompoundSelect
+
+READ_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'blogly_primary'
+
+
+class ReplicaSet:
+    """The replica binds of one app and the connections each has in use."""
+
+    def __init__(self, binds, strategy):
+        if strategy not in ('round-robin', 'least-connections'):
+            raise ValueError(f'Unknown REPLICA_STRATEGY {strategy!r}')
+        self.binds = binds
+        self.strategy = strategy
+        self.in_use = dict.fromkeys(binds, 0)
+        self._turn = count()
+        self._lock = Lock()
+        self._engines = {}
+
+    def choose(self, db, app):
+        if self.strategy == 'least-connections':
+            with self._lock:
+                bind = min(self.binds, key=self.in_use.get)
+        else:
+            bind = self.binds[next(self._turn) % len(self.binds)]
+        return self.engine(db, app, bind)
+
+    def engine(self, db, app, bind):
+        engine = db.get_engine(app, bind)
+        if self._engines.get(bind) is not engine:
+            self._engines[bind] = engine
+            event.listen(engine, 'checkout', lambda *args: self._count(bind, 1))
+            event.listen(engine, 'checkin', lambda *args: self._count(bind, -1))
+        return engine
+
+    def _count(self, bind, change):
+        with self._lock:
+            self.in_use[bind] += change
+
+
+def is_read(clause):
+    return isinstance(clause, (Select, CompoundSelect)) and getattr(clause, '_for_update_arg', None) is None
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends a GET request's reads to a replica until it writes."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or not is_read(clause):
+            self.info['wrote'] = True
+        elif not self.info.get('wrote') and not self.info.get('on_primary'):
+            replica = self.replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause)
+
+    @contextmanager
+    def on_primary(self):
+        """Send the reads made inside the block to the primary."""
+        self.info['on_primary'] = self.info.get('on_primary', 0) + 1
+        try:
+            yield
+        finally:
+            self.info['on_primary'] -= 1
+
+    def replica(self):
+        replicas = self.app.extensions.get('replicas')
+        if not replicas or not replicas.binds or not has_request_context():
+            return None
+        if 'replica' not in g:
+            sticky = STICKY_COOKIE in request.cookies
+            g.replica = None if sticky or request.method not in READ_METHODS else replicas.choose(self.app.extensions['sqlalchemy'].db, self.app)
+        return g.replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def on_primary(self):
+        return self.session().on_primary()
+
+
+class ReplicaRouter:
+    """Registers an app's replicas and keeps writers on the primary for a while."""
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STRATEGY', 'round-robin')
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+
+        uris = app.config['SQLALCHEMY_REPLICA_URIS']
+        binds = {f'replica{i}': uri for i, uri in enumerate(uris)}
+        app.config['SQLALCHEMY_BINDS'] = {**(app.config.get('SQLALCHEMY_BINDS') or {}), **binds}
+        app.extensions['replicas'] = ReplicaSet(list(binds), app.config['REPLICA_STRATEGY'])
+        if binds:
+            app.after_request(self._stick_to_primary)
+
+    def _stick_to_primary(self, response):
+        db = current_app.extensions['sqlalchemy'].db
+        if db.session().info.get('wrote'):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=current_app.config['REPLICA_STICKY_SECONDS'],
+                                httponly=True)
+        return response
+
+
+replicas = ReplicaRouter()
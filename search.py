@@ -0,0 +1,91 @@
+"""Full-text search over posts.
+
+On Postgres, posts are matched against the generated search_vector column
+(see models.py) through its GIN index and ranked by relevance. Other
+databases, such as SQLite in tests, fall back to case-insensitive LIKE.
+"""
+from flask import Blueprint, request, render_template, jsonify, abort
+from sqlalchemy import func, literal_column, or_
+from models import db, Post, Tag, PostTag
+from queries import post_listing
+
+bp = Blueprint('search', __name__)
+
+PER_PAGE = 20
+
+
+class SearchResults:
+    """One page of search results."""
+
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_posts(q, tag=None, user_id=None, page=1, per_page=PER_PAGE):
+    """Posts matching `q`, optionally limited to one tag name and one author, best first."""
+    query = post_listing()
+
+    if db.engine.dialect.name == 'postgresql':
+        terms = func.websearch_to_tsquery('english', q)
+        vector = literal_column('posts.search_vector')
+        query = (query.filter(vector.op('@@')(terms))
+                 .order_by(func.ts_rank_cd(vector, terms).desc(), Post.id.desc()))
+    else:
+        pattern = f'%{escape_like(q)}%'
+        in_title = Post.title.ilike(pattern, escape='\\')
+        query = (query.filter(or_(in_title, Post.content.ilike(pattern, escape='\\')))
+                 .order_by(in_title.desc(), Post.created_at.desc(), Post.id.desc()))
+
+    if tag:
+        query = (query.join(PostTag)
+                 .join(Tag, Tag.id == PostTag.tag_id)
+                 .filter(Tag.name == tag))
+    if user_id is not None:
+        query = query.filter(Post.user_id == user_id)
+
+    items = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    return SearchResults(items[:per_page], page, has_next=len(items) > per_page)
+
+
+def post_json(post):
+    return {
+        'id': post.id,
+        'title': post.title,
+        'created_at': post.created_at.isoformat(),
+        'user': {'id': post.user_id, 'full_name': post.user.full_name},
+        'tags': [{'id': tag.id, 'name': tag.name} for tag in post.tags],
+    }
+
+
+def results_from_args():
+    """Run the search described by the query string, or return None if there's nothing to search for."""
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    user_id = request.args.get('user', type=int)
+    if page < 1:
+        abort(400)
+    if not q:
+        return None
+    return search_posts(q, tag=request.args.get('tag') or None, user_id=user_id, page=page)
+
+
+@bp.route('/search')
+def search():
+    results = results_from_args()
+    return render_template('search.html', results=results, args=request.args.to_dict())
+
+
+@bp.route('/search.json')
+def search_json():
+    results = results_from_args()
+    if results is None:
+        abort(400)
+    return jsonify(results=[post_json(post) for post in results.items],
+                   page=results.page,
+                   next_page=results.page + 1 if results.has_next else None)
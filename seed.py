@@ -1,9 +1,11 @@
+from flask_migrate import upgrade
 from models import User, Post, Tag, db
-from app import app
+from wsgi import app
 
-# Create all tables
-db.drop_all()
-db.create_all()
+# Bring the schema up to date, then start from empty tables
+with app.app_context():
+    upgrade()
+db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
 
 user1 = User(first_name='Allison', last_name='Applebee', image_url='https://cdn.pixabay.com/photo/2014/09/07/21/58/woman-438399_960_720.jpg')
 user2 = User(first_name='Barry', last_name='Bumble', image_url='https://cdn.pixabay.com/photo/2015/03/03/20/42/man-657869_960_720.jpg')
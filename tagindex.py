@@ -0,0 +1,124 @@
+"""Per-process index of every tag, for tag autocomplete and the post forms.
+
+Tag names are kept case-folded in a sorted list, so the tags starting with
+a prefix are one contiguous run found with two bisects, and the most used
+of them are picked from that run. The same index gives the post forms their
+tag checkboxes, so the tags table is read into memory once per process.
+
+Tag inserts, renames and deletes bump the 'tags' counter row in
+catalog_versions within their own transaction. Each read looks that one row
+up and the index is reloaded once any process has committed a change to
+the tags. Usage counts are the post_count each tag had when the index was
+loaded; autocomplete, which ranks by them, also reloads the index
+TAG_INDEX_TTL seconds after that.
+
+A session that has changed tags but not yet committed gets its checkboxes
+straight from the database, so it sees its own changes and nobody else is
+shown them before they're committed.
+"""
+from bisect import bisect_left
+from collections import namedtuple
+from heapq import nsmallest
+from threading import RLock
+from time import monotonic
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from models import db, Tag, CatalogVersion
+from pending import PendingChanges
+
+TagEntry = namedtuple('TagEntry', 'id name')
+
+# Sorts after every character a tag name can start a suffix with.
+_AFTER_PREFIX = '\U0010ffff'
+
+# The tags each session has changed but not committed.
+changed_tags = PendingChanges('tags_changed', collection=set)
+
+
+class TagIndex:
+    """Every tag's name and usage, searchable by name prefix."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._names = []
+        self._tags = {}
+        self._version = None
+        self._built_at = None
+        self._lock = RLock()
+
+    def init_app(self, app):
+        app.config.setdefault('TAG_INDEX_TTL', self.ttl)
+        app.config.setdefault('TAG_COMPLETE_LIMIT', 10)
+        app.config.setdefault('TAG_CHECKBOX_LIMIT', 100)
+        self.ttl = app.config['TAG_INDEX_TTL']
+
+    def _ensure_built(self, fresh_counts=False):
+        session = db.session()
+        # The primary's version, and the rows for it: a lagging replica's
+        # would stay loaded until the next change.
+        with session.on_primary():
+            version = session.query(CatalogVersion.version).filter_by(name='tags').scalar()
+            with self._lock:
+                built = self._built_at is not None and self._version == version
+                if built and not (fresh_counts and self._built_at + self.ttl < monotonic()):
+                    return
+            rows = session.query(Tag.id, Tag.name, Tag.post_count).all()
+        with self._lock:
+            self._tags = {id: (name, post_count) for id, name, post_count in rows}
+            self._names = sorted((name.casefold(), id) for id, name, _ in rows)
+            self._version = version
+            self._built_at = monotonic()
+
+    def complete(self, prefix, limit):
+        """Up to `limit` (id, name, post_count) for tags starting with `prefix`, most used first."""
+        self._ensure_built(fresh_counts=True)
+        folded = prefix.casefold()
+        with self._lock:
+            start = bisect_left(self._names, (folded,))
+            end = bisect_left(self._names, (folded + _AFTER_PREFIX,), start)
+            best = nsmallest(limit, self._names[start:end],
+                             key=lambda entry: (-self._tags[entry[1]][1], entry))
+            return [(id, *self._tags[id]) for _, id in best]
+
+    def choices(self, limit):
+        """Every tag as a TagEntry in id order, or None if there are more than `limit`."""
+        session = db.session()
+        if changed_tags.pending(session):
+            rows = session.query(Tag.id, Tag.name).order_by(Tag.id).limit(limit + 1).all()
+        else:
+            self._ensure_built()
+            with self._lock:
+                if len(self._tags) > limit:
+                    return None
+                rows = sorted((id, name) for id, (name, _) in self._tags.items())
+        if len(rows) > limit:
+            return None
+        return [TagEntry(*row) for row in rows]
+
+    def clear(self):
+        with self._lock:
+            self._names = []
+            self._tags = {}
+            self._version = None
+            self._built_at = None
+
+
+tag_index = TagIndex()
+
+
+def _changed(connection, tag):
+    changed_tags.record(object_session(tag), tag.id)
+    CatalogVersion.bump(connection, 'tags')
+
+
+@event.listens_for(Tag, 'after_insert')
+@event.listens_for(Tag, 'after_delete')
+def _tag_added_or_deleted(mapper, connection, tag):
+    _changed(connection, tag)
+
+
+@event.listens_for(Tag, 'after_update')
+def _tag_updated(mapper, connection, tag):
+    if inspect(tag).attrs.name.history.has_changes():
+        _changed(connection, tag)
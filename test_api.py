@@ -0,0 +1,109 @@
+from unittest import TestCase
+
+from wsgi import app
+from models import db, User, Post, Tag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Tests for the JSON API."""
+
+    def setUp(self):
+        """Add a user with two posts and a tag."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        db.session.add(user)
+        db.session.commit()
+
+        post1 = Post(title='Test1', content='Test content 1.', user_id=user.id)
+        post2 = Post(title='Test2', content='Test content 2.', user_id=user.id)
+        tag = Tag(name='silly tag')
+        post1.tags.append(tag)
+        db.session.add_all([post1, post2, tag])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_post(self):
+        with app.test_client() as client:
+            resp = client.get('/api/v1/posts/1')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['title'], 'Test1')
+            self.assertEqual(resp.json['tag_ids'], [1])
+            self.assertIsNotNone(resp.headers['ETag'])
+            self.assertIsNotNone(resp.headers['Last-Modified'])
+            self.assertIn('max-age=30', resp.headers['Cache-Control'])
+
+    def test_missing_user(self):
+        with app.test_client() as client:
+            self.assertEqual(client.get('/api/v1/users/99').status_code, 404)
+
+    def test_if_none_match(self):
+        with app.test_client() as client:
+            etag = client.get('/api/v1/tags/1').headers['ETag']
+            resp = client.get('/api/v1/tags/1', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b'')
+            self.assertEqual(resp.headers['ETag'], etag)
+
+    def test_if_modified_since(self):
+        with app.test_client() as client:
+            last_modified = client.get('/api/v1/users/1').headers['Last-Modified']
+            resp = client.get('/api/v1/users/1', headers={'If-Modified-Since': last_modified})
+
+            self.assertEqual(resp.status_code, 304)
+
+    def test_lists_not_dated(self):
+        with app.test_client() as client:
+            resp = client.get('/api/v1/posts')
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            db.session.delete(Post.query.get(1))
+            db.session.commit()
+            resp = client.get('/api/v1/posts', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([post['id'] for post in resp.json['items']], [2])
+
+    def test_update_changes_etag(self):
+        with app.test_client() as client:
+            etag = client.get('/api/v1/posts/2').headers['ETag']
+            client.post('/posts/2/edit', data={'title': 'Edited', 'content': 'New.', 'tag': ['1']})
+            resp = client.get('/api/v1/posts/2', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['tag_ids'], [1])
+
+    def test_list_posts(self):
+        with app.test_client() as client:
+            resp = client.get('/api/v1/posts')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([post['title'] for post in resp.json['items']], ['Test2', 'Test1'])
+            self.assertIsNone(resp.json['next'])
+
+            again = client.get('/api/v1/posts', headers={'If-None-Match': resp.headers['ETag']})
+            self.assertEqual(again.status_code, 304)
+
+    def test_list_changes_after_delete(self):
+        with app.test_client() as client:
+            etag = client.get('/api/v1/posts').headers['ETag']
+            client.post('/posts/2/delete')
+            resp = client.get('/api/v1/posts', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([post['title'] for post in resp.json['items']], ['Test1'])
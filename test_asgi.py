@@ -0,0 +1,202 @@
+import asyncio
+import gzip
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from wsgi import app
+from cache import page_cache
+from models import db, User, Post, Tag
+from queries import encode_cursor
+from timeline import timeline
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+import asgi
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def send_request(method, path, query=b'', body=b'', headers=()):
+    """Send one request through a fresh BloglyASGI and return the messages it sent back."""
+    async def go():
+        asgi_app = asgi.BloglyASGI(app)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'root_path': '',
+                 'http_version': '1.1', 'scheme': 'http', 'server': ('localhost', 80),
+                 'client': ('127.0.0.1', 5000), 'headers': list(headers)}
+        try:
+            await asgi_app(scope, receive, send)
+        finally:
+            await asgi_app.close()
+        return messages
+
+    return asyncio.run(go())
+
+
+def call(method, path, **request):
+    """Send one request through a fresh BloglyASGI and return (status, headers, body)."""
+    messages = send_request(method, path, **request)
+    return (messages[0]['status'], dict(messages[0]['headers']),
+            b''.join(message['body'] for message in messages[1:]))
+
+
+@skipUnless(asyncpg, 'asyncpg is not installed')
+class ASGITestCase(TestCase):
+    """Tests for the async read pages and the Flask fallback."""
+
+    def setUp(self):
+        """Add a user with two posts, one tagged."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        tag = Tag(name='silly tag')
+        db.session.add_all([user, tag])
+        db.session.commit()
+
+        post1 = Post(title='Test1', content='Test <em>content</em> 1.', user_id=user.id)
+        post1.tags.append(tag)
+        db.session.add_all([post1, Post(title='Test2', content='Test content 2.', user_id=user.id)])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_pages_match_flask(self):
+        with app.test_client() as client:
+            for path in ('/', '/posts', '/posts/1', '/users/1', '/tags/1'):
+                status, headers, body = call('GET', path)
+                self.assertEqual(status, 200, path)
+                self.assertEqual(headers[b'content-type'], b'text/html; charset=utf-8')
+                self.assertEqual(body, client.get(path).data, path)
+
+        self.assertIn(b'Test &lt;em&gt;content&lt;/em&gt; 1.', call('GET', '/')[2])
+
+    def test_posts_awaiting_backfill(self):
+        db.session.execute("UPDATE posts SET excerpt = NULL, rendered_html = NULL WHERE id = 1")
+        db.session.commit()
+
+        with app.test_client() as client:
+            for path in ('/', '/posts/1'):
+                body = call('GET', path)[2]
+                self.assertIn(b'Test &lt;em&gt;content&lt;/em&gt; 1.', body, path)
+                self.assertEqual(body, client.get(path).data, path)
+
+    def test_gzip(self):
+        status, headers, body = call('GET', '/posts/1', headers=[(b'accept-encoding', b'gzip')])
+
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertEqual(headers[b'vary'], b'Accept-Encoding')
+        with app.test_client() as client:
+            self.assertEqual(gzip.decompress(body), client.get('/posts/1').data)
+
+    def test_pagination(self):
+        db.session.add_all([Post(title=f'More{i}', content='More.', user_id=1) for i in range(25)])
+        db.session.commit()
+
+        status, headers, body = call('GET', '/posts')
+        with app.test_client() as client:
+            self.assertEqual(body, client.get('/posts').data)
+            cursor = body.split(b'after=')[1].split(b'"')[0]
+            self.assertEqual(call('GET', '/posts', query=b'after=' + cursor)[2],
+                             client.get(f'/posts?after={cursor.decode()}').data)
+            body = call('GET', '/posts', query=b'after=' + cursor)[2]
+            cursor = body.split(b'before=')[1].split(b'"')[0]
+            self.assertEqual(call('GET', '/posts', query=b'before=' + cursor)[2],
+                             client.get(f'/posts?before={cursor.decode()}').data)
+
+    def test_cursor_pages_bound_created_at(self):
+        statements = []
+        fetch = asgi.TimedConnection.fetch
+
+        async def record(self, sql, *args):
+            statements.append(sql)
+            return await fetch(self, sql, *args)
+
+        with patch.object(asgi.TimedConnection, 'fetch', record):
+            call('GET', '/posts', query=b'after=' + encode_cursor([Post.query.get(2).created_at, 2]).encode())
+
+        # Postgres prunes partitions by the bare bound, as for queries.keyset_page().
+        self.assertIn('WHERE created_at <= $1 AND (created_at, id) < ($1, $2)', statements[0])
+
+    def test_errors(self):
+        self.assertEqual(call('GET', '/posts/99')[0], 404)
+        self.assertEqual(call('GET', '/posts', query=b'after=garbage')[0], 400)
+
+    def test_head(self):
+        status, headers, body = call('HEAD', '/posts/1')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'')
+
+    def test_writes_go_to_flask(self):
+        status, headers, body = call('POST', '/users/new',
+                                     body=b'first_name=New&last_name=Person&image_url=',
+                                     headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+
+        self.assertEqual(status, 302)
+        self.assertEqual(headers[b'location'], b'http://localhost/users/2')
+        self.assertEqual(call('GET', '/users/2')[0], 200)
+
+    def test_other_pages_go_to_flask(self):
+        status, headers, body = call('GET', '/users')
+        self.assertEqual(status, 200)
+        self.assertIn(b'TestFirst', body)
+        self.assertIn(b'server-timing', headers)
+
+    def test_streamed_responses_passed_on(self):
+        messages = send_request('GET', '/feed.atom')
+        bodies = [message for message in messages[1:] if message['body']]
+
+        self.assertGreater(len(bodies), 1)
+        self.assertTrue(all(message['more_body'] for message in bodies))
+        self.assertFalse(messages[-1].get('more_body'))
+        with app.test_client() as client:
+            self.assertEqual(b''.join(message['body'] for message in bodies), client.get('/feed.atom').data)
+
+    def test_posts_not_rendered_again(self):
+        with patch('models.post_text') as post_text:
+            self.assertEqual(call('GET', '/posts/1')[0], 200)
+        post_text.assert_not_called()
+
+    def test_page_cache_shared(self):
+        app.config['PAGE_CACHE_ENABLED'] = True
+        page_cache.clear()
+        try:
+            first = call('GET', '/posts')[2]
+            hits = page_cache.hits
+            with app.test_client() as client:
+                self.assertEqual(client.get('/posts').data, first)
+                self.assertEqual(page_cache.hits, hits + 1)
+
+                client.post('/posts/1/edit', data={'title': 'Edited', 'content': 'Edited content.'})
+            self.assertIn(b'Edited', call('GET', '/posts')[2])
+            self.assertEqual(page_cache.hits, hits + 1)
+            self.assertEqual(call('GET', '/posts')[2], call('GET', '/posts')[2])
+            self.assertEqual(page_cache.hits, hits + 3)
+        finally:
+            del app.config['PAGE_CACHE_ENABLED']
+            page_cache.clear()
+
+    def test_server_timing(self):
+        status, headers, body = call('GET', '/posts/1')
+        self.assertIn(b'desc="3 queries"', headers[b'server-timing'])
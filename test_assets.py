@@ -0,0 +1,96 @@
+import gzip
+import os
+import shutil
+from base64 import b64encode
+from hashlib import sha384
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from wsgi import app
+from assets import assets, build_assets, AssetError, VENDOR
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+CSS = b'body { color: teal; }\n' * 50
+
+
+def integrity(data):
+    return 'sha384-' + b64encode(sha384(data).digest()).decode()
+
+
+class AssetTestCase(TestCase):
+    """Tests for building and serving the vendored assets."""
+
+    def setUp(self):
+        """Build a stylesheet from a local source directory."""
+        self.source = mkdtemp()
+        self.directory = mkdtemp()
+        with open(os.path.join(self.source, 'bootstrap.css'), 'wb') as file:
+            file.write(CSS)
+        self.vendor = {'bootstrap.css': ('https://cdn.example.com/bootstrap.css', integrity(CSS))}
+        app.config['ASSETS_DIR'] = self.directory
+
+    def tearDown(self):
+        """Go back to the CDN links."""
+        assets.load(os.path.join(self.directory, 'missing'))
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.directory)
+
+    def build(self):
+        manifest = build_assets(self.directory, self.source, vendor=self.vendor)
+        assets.load(self.directory)
+        return manifest
+
+    def test_build(self):
+        manifest = self.build()
+
+        filename = manifest['bootstrap.css']
+        self.assertRegex(filename, r'^bootstrap\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.directory, filename + '.gz'), 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), CSS)
+        self.assertEqual(self.build(), manifest)
+
+    def test_build_checks_integrity(self):
+        self.vendor['bootstrap.css'] = ('https://cdn.example.com/bootstrap.css', integrity(b'other'))
+
+        with self.assertRaises(AssetError):
+            build_assets(self.directory, self.source, vendor=self.vendor)
+
+    def test_pages_link_built_assets(self):
+        with app.test_client() as client:
+            html = client.get('/search').get_data(as_text=True)
+            self.assertIn(VENDOR['bootstrap.css'][0], html)
+
+            filename = self.build()['bootstrap.css']
+            html = client.get('/search').get_data(as_text=True)
+            self.assertIn(f'href="/assets/{filename}"', html)
+            self.assertIn(VENDOR['jquery.js'][0], html)
+            for url, sri in VENDOR.values():
+                self.assertIn(f'integrity="{sri}"', html)
+
+    def test_serves_encoding_client_accepts(self):
+        filename = self.build()['bootstrap.css']
+
+        with app.test_client() as client:
+            resp = client.get(f'/assets/{filename}', headers={'Accept-Encoding': 'gzip, deflate'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertEqual(gzip.decompress(resp.data), CSS)
+            self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            resp.close()
+
+            resp = client.get(f'/assets/{filename}')
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.data, CSS)
+            resp.close()
+
+    def test_unknown_file(self):
+        self.build()
+        with app.test_client() as client:
+            self.assertEqual(client.get('/assets/manifest.json').status_code, 404)
@@ -0,0 +1,176 @@
+import os
+import shutil
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from tempfile import mkdtemp
+from threading import Barrier, Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from wsgi import app
+from avatars import AvatarError, DEFAULT_AVATAR, url_hash, version, fetch_image, is_public_address
+from models import db, User
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def png(width, height):
+    out = BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(out, 'PNG')
+    return out.getvalue()
+
+
+class AvatarTestCase(TestCase):
+    """Tests for the avatar thumbnail proxy."""
+
+    def setUp(self):
+        """Add a user with an image, fetched from a stub instead of the network."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+
+        self.fetched = []
+        self.cache_dir = mkdtemp()
+        app.config['AVATAR_CACHE_DIR'] = self.cache_dir
+        app.config['AVATAR_FETCHER'] = self.fetch
+
+        self.user = User(first_name="TestFirst", last_name="TestLast",
+                         image_url='https://example.com/me.png')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction, and the thumbnails."""
+
+        db.session.rollback()
+        shutil.rmtree(self.cache_dir)
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        if 'broken' in url:
+            raise AvatarError('No such image')
+        return png(300, 200)
+
+    def test_user_page_uses_versioned_thumbnail(self):
+        with app.test_client() as client:
+            html = client.get('/users/1').get_data(as_text=True)
+
+            v = version('https://example.com/me.png')
+            self.assertIn(f'src="/avatars/1/192?v={v}"', html)
+
+    def test_thumbnail_served_and_cached(self):
+        with app.test_client() as client:
+            resp = client.get('/avatars/1/96')
+            v = version('https://example.com/me.png')
+            self.assertEqual(resp.status_code, 302)
+            self.assertTrue(resp.location.endswith(f'/avatars/1/96?v={v}'))
+
+            resp = client.get(f'/avatars/1/96?v={v}')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'image/jpeg')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertEqual(Image.open(BytesIO(resp.data)).size, (96, 96))
+            resp.close()
+
+            client.get(f'/avatars/1/96?v={v}').close()
+            self.assertEqual(self.fetched, ['https://example.com/me.png'])
+
+    def test_concurrent_first_requests(self):
+        both_fetching = Barrier(2, timeout=5)
+
+        def fetch(url):
+            both_fetching.wait()
+            return self.fetch(url)
+
+        app.config['AVATAR_FETCHER'] = fetch
+        statuses = []
+
+        def request():
+            with app.test_client() as client:
+                resp = client.get(f'/avatars/1/48?v={version(self.user.image_url)}')
+                statuses.append(resp.status_code)
+                resp.close()
+            db.session.remove()
+
+        threads = [Thread(target=request) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(len(self.fetched), 2)
+        self.assertFalse([name for name in os.listdir(self.cache_dir) if name.endswith('.partial')])
+
+    def test_changed_image_forgets_old_thumbnails(self):
+        with app.test_client() as client:
+            old = 'https://example.com/me.png'
+            client.get(f'/avatars/1/48?v={version(old)}').close()
+            self.assertTrue(os.path.exists(os.path.join(self.cache_dir, f'{url_hash(old)}-48.ref')))
+
+            client.post('/users/1/edit', data={'first_name': 'TestFirst', 'last_name': 'TestLast',
+                                               'image_url': 'https://example.com/new.png'})
+
+            self.assertEqual(os.listdir(self.cache_dir), [])
+            html = client.get('/users/1').get_data(as_text=True)
+            self.assertIn(f'?v={version("https://example.com/new.png")}', html)
+
+    def test_unknown_size(self):
+        with app.test_client() as client:
+            self.assertEqual(client.get('/avatars/1/50').status_code, 404)
+
+    def test_unfetchable_image_uses_default(self):
+        self.user.image_url = 'https://example.com/broken.png'
+        db.session.commit()
+
+        with app.test_client() as client:
+            resp = client.get(f'/avatars/1/48?v={version(self.user.image_url)}')
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, DEFAULT_AVATAR)
+
+
+class RedirectToInternal(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(302)
+        self.send_header('Location', 'http://10.0.0.1/secret')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchImageTestCase(TestCase):
+    """Tests for keeping image fetches away from internal addresses."""
+
+    def test_internal_addresses_refused(self):
+        for url in ('http://localhost/me.png', 'http://127.0.0.1:5000/', 'http://169.254.169.254/latest/meta-data',
+                    'http://10.0.0.1/', 'http://[::1]/', 'http://[::ffff:192.168.0.1]/', 'file:///etc/passwd'):
+            with self.assertRaises(AvatarError, msg=url):
+                fetch_image(url)
+
+        self.assertTrue(is_public_address('93.184.216.34'))
+        self.assertTrue(is_public_address('2606:2800:220:1:248:1893:25c8:1946'))
+        for address in ('0.0.0.0', '100.64.0.1', '192.0.2.1', '198.18.0.1', '240.0.0.1', '224.0.0.1',
+                        'fe80::1%eth0', 'fd00::1', '2001:db8::1', 'not an address'):
+            self.assertFalse(is_public_address(address), address)
+
+    def test_redirects_checked(self):
+        server = HTTPServer(('127.0.0.1', 0), RedirectToInternal)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            # Let this test reach its own server, but nothing else internal.
+            with patch('avatars.is_public_address', lambda address: address == '127.0.0.1'):
+                with self.assertRaisesRegex(AvatarError, '10.0.0.1'):
+                    fetch_image(f'http://127.0.0.1:{server.server_port}/me.png')
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,73 @@
+import io
+from collections import Counter
+from unittest import TestCase
+
+from wsgi import app
+from models import db, recount_posts, User, Post, Tag
+import benchmark
+import datagen
+import transfer
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class DatagenTestCase(TestCase):
+    """Tests for the synthetic data generator."""
+
+    def test_same_seed_same_data(self):
+        self.assertEqual(list(datagen.generate(10, 50, 5, seed=3)), list(datagen.generate(10, 50, 5, seed=3)))
+        self.assertNotEqual(list(datagen.generate(10, 50, 5, seed=3)), list(datagen.generate(10, 50, 5, seed=4)))
+
+    def test_tag_popularity_is_skewed(self):
+        uses = Counter(row['tag_id'] for table, row in datagen.generate(50, 2000, 20) if table == 'posts_tags')
+        self.assertEqual(uses.most_common(1)[0][0], 1)
+        self.assertGreater(uses[1], 5 * uses[20])
+
+
+class BenchmarkTestCase(TestCase):
+    """Tests for the benchmark harness."""
+
+    def setUp(self):
+        """Load a small generated data set."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        transfer.import_rows(datagen.generate(10, 100, 8))
+        recount_posts()
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_generated_counts(self):
+        self.assertEqual(User.query.count(), 10)
+        self.assertEqual(Post.query.count(), 100)
+        self.assertEqual(sum(tag.post_count for tag in Tag.query), db.session.execute(
+            'SELECT count(*) FROM posts_tags').scalar())
+
+    def test_run(self):
+        results = benchmark.run(app, requests=3, warmup=1)
+
+        self.assertIn('tag_update', results)
+        for name, figures in results.items():
+            self.assertEqual(figures['errors'], 0, name)
+            self.assertLessEqual(figures['p50_ms'], figures['p99_ms'])
+            self.assertGreater(figures['queries_per_request'], 0)
+            self.assertGreater(figures['peak_memory_kb'], 0)
+
+    def test_compare(self):
+        before = {'routes': {'get_homepage': {'p50_ms': 10.0, 'queries_per_request': 2}}}
+        after = {'routes': {'get_homepage': {'p50_ms': 15.0, 'queries_per_request': 2}, 'new': {}}}
+        out = io.StringIO()
+        benchmark.compare(before, after, out)
+
+        self.assertIn('p50_ms 10.0 -> 15.0 (+50%)', out.getvalue())
+        self.assertIn('new: not in baseline', out.getvalue())
@@ -0,0 +1,129 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from wsgi import app
+from cache import LRUBackend, page_cache
+from models import db, User, Post, Tag
+from timeline import timeline
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class LRUBackendTestCase(TestCase):
+    """Tests for the in-process cache backend."""
+
+    def test_least_recently_used_dropped(self):
+        backend = LRUBackend(max_entries=2)
+        backend.set('a', 1, ttl=60)
+        backend.set('b', 2, ttl=60)
+        backend.get('a')
+        backend.set('c', 3, ttl=60)
+
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_expired_entries_dropped(self):
+        backend = LRUBackend()
+        with patch('cache.monotonic', return_value=100):
+            backend.set('a', 1, ttl=10)
+        with patch('cache.monotonic', return_value=111):
+            self.assertIsNone(backend.get('a'))
+        self.assertEqual(len(backend), 0)
+
+
+class PageCacheTestCase(TestCase):
+    """Tests for cached views and their invalidation."""
+
+    def setUp(self):
+        """Add two users with a post each, and turn the cache on."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        user1 = User(first_name="TestFirst", last_name="TestLast")
+        user2 = User(first_name="Test2First", last_name="Test2Last")
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        db.session.add_all([Post(title='Test1', content='Test content 1.', user_id=user1.id),
+                            Post(title='Test2', content='Test content 2.', user_id=user2.id),
+                            Tag(name='silly tag')])
+        db.session.commit()
+
+        app.config['PAGE_CACHE_ENABLED'] = True
+        page_cache.clear()
+        page_cache.hits = page_cache.misses = 0
+
+    def tearDown(self):
+        """Clean up any fouled transaction and turn the cache back off."""
+
+        db.session.rollback()
+        del app.config['PAGE_CACHE_ENABLED']
+
+    def test_second_view_is_a_hit(self):
+        with app.test_client() as client:
+            first = client.get('/')
+            second = client.get('/')
+
+            self.assertEqual(first.get_data(), second.get_data())
+            self.assertEqual(page_cache.stats()['hits'], 1)
+            self.assertEqual(page_cache.stats()['misses'], 1)
+
+    def test_post_edit_evicts_affected_pages(self):
+        with app.test_client() as client:
+            client.get('/')
+            client.get('/users/1')
+            client.get('/users/2')
+
+            client.post('/posts/1/edit', data={'title': 'Edited', 'content': 'New content.'})
+
+            self.assertIn('Edited', client.get('/').get_data(as_text=True))
+            self.assertIn('Edited', client.get('/users/1').get_data(as_text=True))
+            client.get('/users/2')
+            self.assertEqual(page_cache.stats()['hits'], 1)
+
+    def test_tagging_evicts_tag_page(self):
+        with app.test_client() as client:
+            self.assertNotIn('Test2', client.get('/tags/1').get_data(as_text=True))
+
+            client.post('/tags/1/edit', data={'name': 'silly tag', 'post': ['2'], 'shown': ['1', '2']})
+
+            self.assertIn('Test2', client.get('/tags/1').get_data(as_text=True))
+
+    def test_user_rename_evicts_listings(self):
+        with app.test_client() as client:
+            client.get('/posts')
+
+            client.post('/users/2/edit', data={'first_name': 'Renamed', 'last_name': 'User', 'image_url': ''})
+
+            self.assertIn('Renamed User', client.get('/posts').get_data(as_text=True))
+
+    def test_stats_endpoint(self):
+        with app.test_client() as client:
+            client.get('/')
+            resp = client.get('/cache/stats')
+
+            self.assertEqual(resp.json, {'hits': 0, 'misses': 1, 'entries': 1})
+
+    def test_page_rendered_across_an_eviction_not_stored(self):
+        @page_cache.cached
+        def view():
+            page_cache.depends_on('user:1')
+            # Another request commits a change to user 1 while this one renders.
+            page_cache.invalidate({'user:1'})
+            return 'maybe stale'
+
+        with app.test_request_context('/stale'):
+            view()
+            view()
+
+        self.assertEqual(page_cache.stats()['misses'], 2)
+        self.assertEqual(len(page_cache.backend), 0)
@@ -0,0 +1,117 @@
+from unittest import TestCase
+
+from wsgi import app
+from catalog import post_catalog
+from models import db, User, Post, Tag
+from tagindex import tag_index
+from test_queries import count_statements
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class CatalogTestCase(TestCase):
+    """Tests for the cached post catalog."""
+
+    def setUp(self):
+        """Add a user with a tagged post, and empty the catalog and tag index."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        post_catalog.clear()
+        tag_index.clear()
+
+        self.user = User(first_name="TestFirst", last_name="TestLast")
+        self.tag = Tag(name='silly tag')
+        self.post = Post(title='Test1', content='Test content.', user=self.user, tags=[self.tag])
+        db.session.add_all([self.user, self.tag, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        post_catalog.ttl = 300
+
+    def test_reused_while_unchanged(self):
+        self.assertEqual(post_catalog.entries(), ((1, 'Test1'),))
+
+        with count_statements() as statements:
+            self.assertEqual(post_catalog.entries(), ((1, 'Test1'),))
+        self.assertEqual(statements, [])
+
+    def test_committed_changes_applied(self):
+        post_catalog.entries()
+        db.session.add(Post(title='Test2', content='Test content.', user=self.user))
+        self.post.title = 'Retitled'
+        db.session.commit()
+
+        with count_statements() as statements:
+            self.assertEqual(post_catalog.entries(), ((1, 'Retitled'), (2, 'Test2')))
+        self.assertEqual(statements, [])
+
+        db.session.delete(Post.query.get(2))
+        db.session.commit()
+        self.assertEqual(post_catalog.entries(), ((1, 'Retitled'),))
+
+        db.session.delete(self.user)
+        db.session.commit()
+        self.assertEqual(post_catalog.entries(), ())
+
+    def test_other_process_changes_reloaded_after_ttl(self):
+        post_catalog.entries()
+        db.session.execute("INSERT INTO posts (title, content, user_id, created_at, updated_at) "
+                           "VALUES ('Theirs', 'Test content.', 1, now(), now())")
+        db.session.commit()
+        self.assertEqual(post_catalog.entries(), ((1, 'Test1'),))
+
+        post_catalog.ttl = -1
+        self.assertEqual([post.title for post in post_catalog.entries()], ['Test1', 'Theirs'])
+
+    def test_uncommitted_changes_not_cached(self):
+        post_catalog.entries()
+        db.session.add(Post(title='Test2', content='Test content.', user=self.user))
+        db.session.flush()
+
+        self.assertEqual(len(post_catalog.entries()), 2)
+        db.session.rollback()
+        self.assertEqual(post_catalog.entries(), ((1, 'Test1'),))
+
+    def test_forms_read_no_tags(self):
+        with app.test_client() as client:
+            client.get('/users/1/posts/new')
+
+            with count_statements() as statements:
+                html = client.get('/posts/1/edit').get_data(as_text=True)
+            self.assertIn('value="1" id="tag-1"\n     checked', html)
+            # Only the post's own tags are loaded, not the whole table.
+            self.assertFalse([statement for statement in statements
+                              if 'FROM tags' in statement and 'WHERE' not in statement])
+            self.assertFalse([statement for statement in statements if 'UPDATE' in statement])
+
+            client.get('/tags/new')
+            with count_statements() as statements:
+                html = client.get('/tags/1/edit').get_data(as_text=True)
+            self.assertIn('Test1', html)
+            self.assertFalse([statement for statement in statements
+                              if 'FROM posts' in statement and 'WHERE' not in statement])
+
+    def test_tag_form_keeps_posts_it_did_not_show(self):
+        post_catalog.entries()
+        db.session.execute("INSERT INTO posts (title, content, user_id, created_at, updated_at) "
+                           "VALUES ('Theirs', 'Test content.', 1, now(), now())")
+        db.session.execute("INSERT INTO posts_tags (post_id, tag_id, post_created_at) "
+                           "SELECT id, 1, created_at FROM posts WHERE title = 'Theirs'")
+        db.session.commit()
+
+        with app.test_client() as client:
+            html = client.get('/tags/1/edit').get_data(as_text=True)
+            self.assertNotIn('Theirs', html)
+            client.post('/tags/1/edit', data={'name': 'silly tag', 'shown': ['1']})
+
+        self.assertEqual([post.title for post in Tag.query.get(1).posts], ['Theirs'])
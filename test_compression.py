@@ -0,0 +1,77 @@
+import gzip
+from unittest import TestCase
+from unittest.mock import patch
+
+from wsgi import app
+from cache import page_cache
+from models import db, User
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class CompressionTestCase(TestCase):
+    """Tests for gzipping dynamic pages."""
+
+    def setUp(self):
+        """Add a user."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        db.session.add(User(first_name="TestFirst", last_name="TestLast"))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_large_pages_gzipped(self):
+        with app.test_client() as client:
+            plain = client.get('/users/1').data
+            resp = client.get('/users/1', headers={'Accept-Encoding': 'gzip'})
+
+            self.assertGreater(len(plain), app.config['COMPRESS_MIN_SIZE'])
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(int(resp.headers['Content-Length']), len(resp.data))
+            self.assertEqual(gzip.decompress(resp.data), plain)
+
+    def test_left_alone(self):
+        with app.test_client() as client:
+            resp = client.get('/users/1', headers={'Accept-Encoding': 'br'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+
+            resp = client.get('/api/v1/users', headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+
+            app.config['COMPRESS_MIN_SIZE'] = 1 << 20
+            try:
+                resp = client.get('/users/1', headers={'Accept-Encoding': 'gzip'})
+                self.assertNotIn('Content-Encoding', resp.headers)
+            finally:
+                app.config['COMPRESS_MIN_SIZE'] = 1024
+
+    def test_cached_pages_gzipped_once(self):
+        page_cache.clear()
+        app.config['PAGE_CACHE_ENABLED'] = True
+        try:
+            with app.test_client() as client, patch('gzip.compress', wraps=gzip.compress) as compress:
+                first = client.get('/users/1', headers={'Accept-Encoding': 'gzip'})
+                again = client.get('/users/1', headers={'Accept-Encoding': 'gzip'})
+                plain = client.get('/users/1')
+        finally:
+            del app.config['PAGE_CACHE_ENABLED']
+            page_cache.clear()
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(again.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(again.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(gzip.decompress(again.data), plain.data)
+        self.assertNotIn('Content-Encoding', plain.headers)
@@ -0,0 +1,139 @@
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from werkzeug.http import http_date
+
+from wsgi import app
+from models import db, User, Post, Tag
+from timeline import timeline
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+@contextmanager
+def local_time_zone(name):
+    """Run with the process's local time zone set to `name`."""
+    saved = os.environ.get('TZ')
+    os.environ['TZ'] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if saved is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = saved
+        time.tzset()
+
+
+class FeedTestCase(TestCase):
+    """Tests for the Atom feeds."""
+
+    def setUp(self):
+        """Add a user with two posts, one tagged."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        tag = Tag(name='silly tag')
+        post1 = Post(title='Test1', content='Test content 1 & more.', user=user,
+                     created_at=datetime(2020, 12, 1, 12, 0))
+        post2 = Post(title='Test2', content='Test content 2.', user=user,
+                     created_at=datetime(2020, 12, 2, 12, 0))
+        post1.tags.append(tag)
+        db.session.add_all([post1, post2])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def entries(self, resp):
+        feed = ElementTree.fromstring(resp.data)
+        return [entry.find(f'{ATOM}title').text for entry in feed.iter(f'{ATOM}entry')]
+
+    def test_dates_in_utc(self):
+        for table in ('users', 'posts', 'tags'):
+            db.session.execute(f"UPDATE {table} SET updated_at = '2020-12-02 12:00'")
+        db.session.commit()
+
+        with local_time_zone('America/New_York'), app.test_client() as client:
+            resp = client.get('/feed.atom')
+            self.assertIn(b'<published>2020-12-01T17:00:00Z</published>', resp.data)
+            self.assertIn(b'<updated>2020-12-02T17:00:00Z</updated>', resp.data)
+            resp.close()
+
+            resp = client.get('/api/v1/posts/2')
+            self.assertEqual(resp.headers['Last-Modified'], http_date(datetime(2020, 12, 2, 17, 0)))
+            resp = client.get('/api/v1/posts/2', headers={'If-Modified-Since': 'Wed, 02 Dec 2020 16:00:00 GMT'})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_feeds(self):
+        with local_time_zone('UTC'), app.test_client() as client:
+            resp = client.get('/feed.atom')
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.mimetype, 'application/atom+xml')
+            self.assertEqual(self.entries(resp), ['Test2', 'Test1'])
+            self.assertIn(b'<published>2020-12-01T12:00:00Z</published>', resp.data)
+            self.assertIn(b'Test content 1 &amp; more.', resp.data)
+
+            self.assertEqual(self.entries(client.get('/users/1/feed.atom')), ['Test2', 'Test1'])
+            self.assertEqual(self.entries(client.get('/tags/1/feed.atom')), ['Test1'])
+            self.assertEqual(client.get('/tags/99/feed.atom').status_code, 404)
+
+    def test_entries_bounded(self):
+        app.config['FEED_LENGTH'] = 1
+        try:
+            with app.test_client() as client:
+                self.assertEqual(self.entries(client.get('/feed.atom')), ['Test2'])
+        finally:
+            app.config['FEED_LENGTH'] = 20
+
+    def test_conditional_get(self):
+        with app.test_client() as client:
+            resp = client.get('/feed.atom')
+            etag = resp.headers['ETag']
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            resp = client.get('/feed.atom', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+
+            Post.query.get(1).title = 'Retitled'
+            db.session.commit()
+            resp = client.get('/feed.atom', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(self.entries(resp), ['Test2', 'Retitled'])
+
+    def test_new_posts_change_feed(self):
+        with app.test_client() as client:
+            etag = client.get('/users/1/feed.atom').headers['ETag']
+
+            client.post('/users/1/posts/new', data={'title': 'Test3', 'content': 'New.'})
+            resp = client.get('/users/1/feed.atom', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(self.entries(resp), ['Test3', 'Test2', 'Test1'])
+
+    def test_out_of_band_deletes(self):
+        with app.test_client() as client:
+            client.get('/feed.atom')
+            db.session.execute("DELETE FROM posts WHERE title = 'Test2'")
+            db.session.commit()
+
+            self.assertEqual(self.entries(client.get('/feed.atom')), ['Test1'])
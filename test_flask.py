@@ -1,6 +1,7 @@
 from unittest import TestCase
 
-from app import app
+from app import create_app
+from wsgi import app
 from models import db, User, Post, Tag
 
 # Setup below copied from demo code
@@ -23,8 +24,8 @@ class UserViewsTestCase(TestCase):
 
     def setUp(self):
         """Add sample users."""
-        Post.query.delete()
-        User.query.delete()
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
 
         user = User(first_name="TestFirst", last_name="TestLast")
         user2 = User(first_name="Test2First", last_name="Test2Last")
@@ -95,8 +96,8 @@ class PostViewsTestCase(TestCase):
 
     def setUp(self):
         """Add sample posts."""
-        Post.query.delete()
-        User.query.delete()
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
 
         user = User(first_name="TestFirst", last_name="TestLast")
         db.session.add(user)
@@ -185,8 +186,8 @@ class TagViewsTestsCase(TestCase):
 
     def setUp(self):
         """Add sample posts."""
-        Post.query.delete()
-        User.query.delete()
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
 
         user = User(first_name="TestFirst", last_name="TestLast")
         db.session.add(user)
@@ -244,7 +245,7 @@ class TagViewsTestsCase(TestCase):
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn('<li><a href="/tags/2">new tag</a></li>', html)
+            self.assertIn('<li><a href="/tags/2">new tag</a> <span class="badge badge-secondary">0</span></li>', html)
             self.assertIn('<h1>Tags</h1>', html)
 
     def test_delete_tag(self):
@@ -255,4 +256,57 @@ class TagViewsTestsCase(TestCase):
 
             self.assertEqual(resp.status_code, 200)
             self.assertNotIn('silly tag', html)
-            self.assertIn('<h1>Tags</h1>', html)
\ No newline at end of file
+            self.assertIn('<h1>Tags</h1>', html)
+
+    def test_top_tags(self):
+        """Test tags sorted by use show the busiest first"""
+        db.session.add(Tag(name='unused tag'))
+        db.session.commit()
+
+        with app.test_client() as client:
+            resp = client.get('/tags?sort=top')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(html.index('silly tag'), html.index('unused tag'))
+            self.assertIn('<span class="badge badge-secondary">1</span>', html)
+
+    def test_new_tag_bad_post(self):
+        """Test new tag with a post that doesn't exist is rejected"""
+        with app.test_client() as client:
+            resp = client.post('tags/new', data={'name': 'new tag', 'post': ['1', '99']})
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertIsNone(Tag.query.filter_by(name='new tag').first())
+
+    def test_update_tag_posts(self):
+        """Test editing a tag moves it from one post to another"""
+        with app.test_client() as client:
+            resp = client.post('tags/1/edit', data={'name': 'sillier tag', 'post': ['2'], 'shown': ['1', '2']})
+
+            self.assertEqual(resp.status_code, 302)
+            tag = Tag.query.get(1)
+            self.assertEqual(tag.name, 'sillier tag')
+            self.assertEqual([post.id for post in tag.posts], [2])
+
+class AppFactoryTestCase(TestCase):
+    """Tests for the configuration profiles."""
+
+    def test_production_profile(self):
+        """Test production turns off echo and the toolbar and pools connections"""
+        prod = create_app('production', SQLALCHEMY_DATABASE_URI='postgresql:///blogly_test')
+
+        self.assertFalse(prod.config['SQLALCHEMY_ECHO'])
+        self.assertNotIn('debugtoolbar', prod.blueprints)
+        self.assertTrue(prod.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'])
+        self.assertIn('blogly', prod.blueprints)
+
+    def test_import_builds_no_app(self):
+        """Test importing app.py doesn't build an app"""
+        import app as app_module
+        self.assertFalse(hasattr(app_module, 'app'))
+
+    def test_production_needs_database(self):
+        """Test production refuses to start without a database URI"""
+        with self.assertRaises(RuntimeError):
+            create_app('production', SQLALCHEMY_DATABASE_URI=None)
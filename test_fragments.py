@@ -0,0 +1,98 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from app import create_app
+from wsgi import app
+from fragments import fragments
+from models import db, User, Post, Tag, backfill_post_text
+from timeline import timeline
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class FragmentTestCase(TestCase):
+    """Tests for the memoized post and tag fragments."""
+
+    def setUp(self):
+        """Add a user with a tagged post and empty the fragment cache."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        tag = Tag(name='silly tag')
+        post = Post(title='Test1', content='Test content 1.', user=user)
+        post.tags.append(tag)
+        db.session.add_all([user, tag, post])
+        db.session.commit()
+
+        fragments.clear()
+        fragments.hits = fragments.misses = 0
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_fragments_reused(self):
+        with app.test_client() as client:
+            first = client.get('/posts').data
+            self.assertEqual(fragments.stats(), {'hits': 0, 'misses': 1, 'entries': 1})
+
+            self.assertEqual(client.get('/posts').data, first)
+            self.assertEqual(fragments.stats(), {'hits': 1, 'misses': 1, 'entries': 1})
+
+            html = client.get('/users/1').get_data(as_text=True)
+            self.assertIn('<a href="/posts/1">Test1</a>', html)
+            self.assertNotIn('by <a href="/users/1">', html)
+            self.assertEqual(fragments.misses, 2)
+
+    def test_changes_render_fresh_fragments(self):
+        with app.test_client() as client:
+            client.get('/posts')
+
+            Tag.query.get(1).name = 'renamed tag'
+            db.session.commit()
+            self.assertIn('renamed tag', client.get('/posts').get_data(as_text=True))
+
+            User.query.get(1).first_name = 'Renamed'
+            db.session.commit()
+            self.assertIn('Renamed TestLast', client.get('/posts').get_data(as_text=True))
+
+            Post.query.get(1).title = 'Retitled'
+            db.session.commit()
+            self.assertIn('Retitled', client.get('/').get_data(as_text=True))
+
+    def test_posts_awaiting_backfill(self):
+        db.session.execute("UPDATE posts SET excerpt = NULL, rendered_html = NULL")
+        db.session.commit()
+
+        with app.test_client() as client:
+            for path in ('/', '/posts/1'):
+                html = client.get(path).get_data(as_text=True)
+                self.assertIn('Test content 1.', html, path)
+                self.assertNotIn('None', html, path)
+
+            misses = fragments.misses
+            backfill_post_text()
+            client.get('/')
+            self.assertEqual(fragments.misses, misses + 1)
+
+    def test_disabled(self):
+        uncached = create_app('testing', FRAGMENT_CACHE_ENABLED=False)
+        with uncached.test_client() as client:
+            self.assertIn('silly tag', client.get('/posts').get_data(as_text=True))
+        self.assertEqual(fragments.misses, 0)
+
+    def test_templates_precompiled(self):
+        with TemporaryDirectory() as directory:
+            create_app('testing', TEMPLATE_CACHE_DIR=directory, TEMPLATE_PRECOMPILE=True)
+            self.assertGreaterEqual(len(os.listdir(directory)), len(os.listdir(app.template_folder)))
@@ -0,0 +1,141 @@
+from unittest import TestCase
+
+from app import create_app
+from wsgi import app
+from cache import page_cache
+from models import db, User, Post, Tag, PostTag, Job
+from jobs import jobs, delete_user
+from timeline import timeline
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class ManualBackend:
+    """Holds jobs until the test runs them."""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, fn):
+        self.queued.append(fn)
+
+    def run_all(self):
+        while self.queued:
+            self.queued.pop(0)()
+
+
+class JobTestCase(TestCase):
+    """Tests for deletes run as background jobs."""
+
+    def setUp(self):
+        """Add two users, one with five posts sharing two tags."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags, jobs RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        busy = User(first_name="Busy", last_name="Writer")
+        quiet = User(first_name="Quiet", last_name="Writer")
+        tags = [Tag(name='silly tag'), Tag(name='serious tag')]
+        posts = [Post(title=f'Test{i}', content='Test content.', user=busy, tags=tags) for i in range(5)]
+        posts.append(Post(title='Quiet post', content='Test content.', user=quiet, tags=tags[:1]))
+        db.session.add_all(posts)
+        db.session.commit()
+
+        self.backend = ManualBackend()
+        app.config['JOBS_BACKEND'] = self.backend
+        app.config['JOBS_CHUNK_SIZE'] = 2
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        app.config['JOBS_BACKEND'] = None
+        app.config['JOBS_CHUNK_SIZE'] = 1000
+
+    def test_delete_user_in_background(self):
+        with app.test_client() as client:
+            resp = client.post('/users/1/delete')
+            self.assertEqual(resp.status_code, 302)
+            status_url = resp.location
+
+            resp = client.get(status_url)
+            self.assertEqual(resp.status_code, 202)
+            self.assertIn('Deleting Busy Writer', resp.get_data(as_text=True))
+
+            self.backend.run_all()
+            resp = client.get(status_url)
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, 'http://localhost/users')
+
+        self.assertIsNone(User.query.get(1))
+        self.assertEqual([post.title for post in Post.query], ['Quiet post'])
+        self.assertEqual(PostTag.query.count(), 1)
+        self.assertEqual({tag.name: tag.post_count for tag in Tag.query},
+                         {'silly tag': 1, 'serious tag': 0})
+
+    def test_delete_tag_in_background(self):
+        with app.test_client() as client:
+            client.post('/tags/1/delete')
+            self.backend.run_all()
+
+        self.assertEqual([tag.name for tag in Tag.query], ['serious tag'])
+        self.assertEqual(PostTag.query.count(), 5)
+        self.assertEqual(Post.query.count(), 6)
+
+    def test_caches_updated(self):
+        page_cache.clear()
+        app.config['PAGE_CACHE_ENABLED'] = True
+        try:
+            with app.test_client() as client:
+                self.assertIn('Test4', client.get('/').get_data(as_text=True))
+                client.post('/users/1/delete')
+                self.backend.run_all()
+                self.assertNotIn('Test4', client.get('/').get_data(as_text=True))
+        finally:
+            del app.config['PAGE_CACHE_ENABLED']
+
+    def test_failed_job(self):
+        with app.app_context():
+            job = jobs.enqueue(delete_user, 'not an id', description='Deleting nobody', next_url='/users')
+        self.backend.run_all()
+
+        with app.test_client() as client:
+            resp = client.get(f'/jobs/{job.id}')
+            self.assertEqual(resp.status_code, 500)
+            self.assertIn("This didn't work", resp.get_data(as_text=True))
+            self.assertEqual(client.get('/jobs/nonesuch').status_code, 404)
+
+    def test_runs_immediately_when_testing(self):
+        app.config['JOBS_BACKEND'] = None
+        with app.test_client() as client:
+            resp = client.post('/users/1/delete', follow_redirects=True)
+            self.assertIn('Writer, Quiet', resp.get_data(as_text=True))
+            self.assertNotIn('Writer, Busy', resp.get_data(as_text=True))
+
+    def test_status_shared_between_processes(self):
+        with app.test_client() as client:
+            status_url = client.post('/users/1/delete').location
+
+        # Another worker, with nothing of the first one's in memory.
+        other = create_app('testing', SQLALCHEMY_DATABASE_URI=app.config['SQLALCHEMY_DATABASE_URI'])
+        with other.test_client() as client:
+            self.assertEqual(client.get(status_url).status_code, 202)
+            self.backend.run_all()
+            self.assertEqual(client.get(status_url).status_code, 302)
+
+    def test_old_jobs_forgotten(self):
+        app.config['JOBS_KEEP'] = 2
+        try:
+            with app.app_context():
+                ids = [jobs.enqueue(print, description=f'Job {i}', next_url='/').id for i in range(3)]
+        finally:
+            app.config['JOBS_KEEP'] = 1000
+
+        self.assertEqual({job.id for job in Job.query}, set(ids[1:]))
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from wsgi import app
+from metrics import metrics
+from models import db, User, Post
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    """Tests for per-request timing."""
+
+    def setUp(self):
+        """Add a user with a post and reset the histograms."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Post(title='Test1', content='Test content 1.', user_id=user.id))
+        db.session.commit()
+
+        metrics.endpoints.clear()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_server_timing(self):
+        with app.test_client() as client:
+            resp = client.get('/posts')
+            timing = resp.headers['Server-Timing']
+
+            self.assertIn('db;dur=', timing)
+            self.assertIn('desc="2 queries"', timing)
+            self.assertIn('tpl;dur=', timing)
+            self.assertIn('total;dur=', timing)
+
+    def test_metrics_endpoint(self):
+        with app.test_client() as client:
+            client.get('/posts')
+            client.get('/posts')
+            resp = client.get('/metrics')
+            text = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith('text/plain'))
+            self.assertIn('blogly_request_duration_seconds_count{endpoint="blogly.show_all_posts"} 2', text)
+            self.assertIn('blogly_request_duration_seconds_bucket{endpoint="blogly.show_all_posts",le="+Inf"} 2', text)
+            self.assertIn('blogly_sql_statements_total{endpoint="blogly.show_all_posts"} 4', text)
+            self.assertIn('blogly_page_cache_hits_total', text)
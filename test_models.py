@@ -1,7 +1,10 @@
 from unittest import TestCase
 
-from app import app
-from models import db, User, Post, Tag
+from sqlalchemy import event, inspect
+
+from app import create_app
+from wsgi import app
+from models import db, User, Post, Tag, PostTag, backfill_post_text
 
 # Use test database and don't clutter tests with SQL
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
@@ -16,8 +19,8 @@ class UserModelTestCase(TestCase):
 
     def setUp(self):
         """Clean up any existing posts and users."""
-        Post.query.delete()
-        User.query.delete()
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
 
     def tearDown(self):
         """Clean up any fouled transaction."""
@@ -33,8 +36,8 @@ class PostModelTestCase(TestCase):
 
     def setUp(self):
         """Clean up any existing users/posts."""
-        Post.query.delete()
-        User.query.delete()
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
 
     def tearDown(self):
         """Clean up any fouled transaction."""
@@ -62,14 +65,38 @@ class PostModelTestCase(TestCase):
 
         self.assertEqual(post.pretty_datetime, 'Dec 12, 2020 12:12 PM')
 
+    def test_derived_text(self):
+        post = Post(title='TestTitle', content='First <b>line</b>\nsame paragraph.\n\n' + 'word ' * 50)
+
+        self.assertEqual(post.rendered_html,
+                         '<p>First &lt;b&gt;line&lt;/b&gt;<br>\nsame paragraph.</p>\n<p>' + 'word ' * 49 + 'word</p>')
+        self.assertTrue(post.excerpt.startswith('First <b>line</b> same paragraph. word word'))
+        self.assertTrue(post.excerpt.endswith('word...'))
+        self.assertLessEqual(len(post.excerpt), 203)
+
+        post.content = 'Short.'
+        self.assertEqual((post.excerpt, post.rendered_html), ('Short.', '<p>Short.</p>'))
+
+    def test_backfill(self):
+        user = User(first_name="TestFirst", last_name="TestLast")
+        db.session.add(user)
+        db.session.commit()
+        db.session.execute(Post.__table__.insert(), [
+            {'title': f'Test{n}', 'content': f'Content {n}.', 'user_id': user.id} for n in range(3)])
+        db.session.commit()
+
+        self.assertEqual(backfill_post_text(chunk_size=2), 3)
+        self.assertEqual([post.excerpt for post in Post.query.order_by(Post.id)],
+                         ['Content 0.', 'Content 1.', 'Content 2.'])
+        self.assertEqual(backfill_post_text(), 0)
+
 class TagModelTestCase(TestCase):
     """Tests for model for Tags."""
 
     def setUp(self):
         """Clean up any existing posts and users."""
-        Post.query.delete()
-        User.query.delete()
-        Tag.query.delete()
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
 
     def tearDown(self):
         """Clean up any fouled transaction."""
@@ -96,3 +123,134 @@ class TagModelTestCase(TestCase):
         self.assertEqual(len(tag1.posts), 1)
         self.assertEqual(len(tag2.posts), 2)
 
+class PostCountTestCase(TestCase):
+    """Tests for the post counters on users and tags."""
+
+    def setUp(self):
+        """Add two users, two tags and three posts."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+
+        self.user1 = User(first_name="TestFirst", last_name="TestLast")
+        self.user2 = User(first_name="Test2First", last_name="Test2Last")
+        self.tag1 = Tag(name='test_tag1')
+        self.tag2 = Tag(name='test_tag2')
+        db.session.add_all([self.user1, self.user2, self.tag1, self.tag2])
+        db.session.commit()
+
+        self.posts = [Post(title=f'TestTitle{n}', content="This is a test.", user_id=self.user1.id)
+                      for n in range(3)]
+        self.posts[0].tags.append(self.tag1)
+        self.posts[1].tags.append(self.tag1)
+        db.session.add_all(self.posts)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_counts_follow_inserts(self):
+        self.assertEqual((self.user1.post_count, self.user2.post_count), (3, 0))
+        self.assertEqual((self.tag1.post_count, self.tag2.post_count), (2, 0))
+
+    def test_counts_follow_moves(self):
+        self.posts[0].user_id = self.user2.id
+        PostTag.set_posts(self.tag2.id, [post.id for post in self.posts])
+        PostTag.set_posts(self.tag1.id, [])
+        db.session.commit()
+
+        self.assertEqual((self.user1.post_count, self.user2.post_count), (2, 1))
+        self.assertEqual((self.tag1.post_count, self.tag2.post_count), (0, 3))
+
+    def test_counts_follow_deletes(self):
+        db.session.delete(self.posts[0])
+        db.session.commit()
+        self.assertEqual((self.user1.post_count, self.tag1.post_count), (2, 1))
+
+        PostTag.query.delete()
+        Post.query.delete()
+        db.session.commit()
+        self.assertEqual((self.user1.post_count, self.tag1.post_count), (0, 0))
+
+    def test_repair_command(self):
+        db.session.execute('UPDATE users SET post_count = 42')
+        db.session.execute('UPDATE tags SET post_count = 42')
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['blogly', 'repair-counts'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual([user.post_count for user in User.query.order_by(User.id)], [3, 0])
+        self.assertEqual([tag.post_count for tag in Tag.query.order_by(Tag.id)], [2, 0])
+
+class DeleteCascadeTestCase(TestCase):
+    """Tests for deletes cascading in the database."""
+
+    def setUp(self):
+        """Add a user with three tagged posts."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+
+        tag = Tag(name='test_tag')
+        user = User(first_name="TestFirst", last_name="TestLast")
+        db.session.add_all([Post(title=f'TestTitle{n}', content="This is a test.", user=user, tags=[tag])
+                            for n in range(3)])
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_delete_user_is_one_statement(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            db.session.delete(User.query.get(1))
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual([s for s in statements if s.startswith('DELETE')], ['DELETE FROM users WHERE users.id = %(id)s'])
+        self.assertEqual((Post.query.count(), PostTag.query.count()), (0, 0))
+        self.assertEqual(Tag.query.get(1).post_count, 0)
+
+    def test_delete_tag_keeps_posts(self):
+        db.session.delete(Tag.query.get(1))
+        db.session.commit()
+
+        self.assertEqual((Post.query.count(), PostTag.query.count()), (3, 0))
+
+    def test_add_delete_cascades_command(self):
+        db.session.execute('ALTER TABLE posts DROP CONSTRAINT posts_user_id_fkey, '
+                           'ADD CONSTRAINT posts_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)')
+        db.session.commit()
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['blogly', 'add-delete-cascades'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('posts_user_id_fkey', result.output)
+        self.assertEqual(runner.invoke(args=['blogly', 'add-delete-cascades']).output.strip(),
+                         'Foreign keys already cascade.')
+
+        ondelete = {fk['name']: fk['options'].get('ondelete') for table in ('posts', 'posts_tags')
+                    for fk in inspect(db.engine).get_foreign_keys(table)
+                    if fk['referred_table'] in ('users', 'posts', 'tags')}
+        self.assertEqual(ondelete, dict.fromkeys(
+            ['posts_user_id_fkey', 'posts_tags_post_id_fkey', 'posts_tags_tag_id_fkey'], 'CASCADE'))
+        # The partition's own key, checked once, replaced the copy of the old one.
+        self.assertEqual(db.session.execute(
+            "SELECT conname, convalidated FROM pg_constraint WHERE conrelid = 'posts_default'::regclass "
+            "AND contype = 'f'").fetchall(), [('posts_default_posts_user_id_fkey', True)])
+
+    def test_add_delete_cascades_needs_postgres(self):
+        db.session.remove()
+        sqlite_app = create_app('testing', SQLALCHEMY_DATABASE_URI='sqlite://')
+        with sqlite_app.app_context():
+            result = sqlite_app.test_cli_runner().invoke(args=['blogly', 'add-delete-cascades'])
+        db.session.remove()
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Only Postgres', result.output)
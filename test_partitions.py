@@ -0,0 +1,182 @@
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import create_app
+from wsgi import app
+from models import db, User, Post, Tag, PostTag
+from partitions import (add_months, month_start, partition_months, create_partitions, archive_partitions,
+                        is_partitioned)
+from queries import post_page, encode_cursor
+from timeline import timeline
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def count(table):
+    return db.session.execute(f'SELECT count(*) FROM {table}').scalar()
+
+
+class PartitionTestCase(TestCase):
+    """Tests for the monthly partitions of posts and posts_tags on Postgres."""
+
+    def setUp(self):
+        """Add a user and a tag with a post on the 15th of each month from February to May 2024."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        self.user = User(first_name="TestFirst", last_name="TestLast")
+        self.tag = Tag(name='monthly')
+        for month in range(2, 6):
+            db.session.add(Post(title=f'Month {month}', content='Test content.', user=self.user,
+                                tags=[self.tag], created_at=datetime(2024, month, 15)))
+        db.session.commit()
+
+    def tearDown(self):
+        """Go back to tables with only their default partitions."""
+        db.session.rollback()
+        db.session.execute('DROP SCHEMA IF EXISTS archive CASCADE')
+        db.session.commit()
+        db.drop_all()
+        db.create_all()
+
+    def test_months_helpers(self):
+        self.assertEqual(month_start(datetime(2024, 12, 31, 23, 59)), datetime(2024, 12, 1))
+        self.assertEqual(add_months(datetime(2024, 11, 1), 3), datetime(2025, 2, 1))
+        self.assertEqual(add_months(datetime(2024, 1, 1), -1), datetime(2023, 12, 1))
+
+    def test_create_partitions_moves_rows_out_of_default(self):
+        self.assertTrue(is_partitioned())
+        self.assertEqual(count('posts_default'), 4)
+
+        created = create_partitions(months_ahead=2, now=datetime(2024, 3, 10))
+        db.session.commit()
+
+        self.assertEqual(created, [datetime(2024, 3, 1), datetime(2024, 4, 1), datetime(2024, 5, 1)])
+        self.assertEqual(partition_months(), created)
+        self.assertEqual((count('posts_y2024m03'), count('posts_tags_y2024m03')), (1, 1))
+        self.assertEqual((count('posts_default'), count('posts_tags_default')), (1, 1))
+        self.assertEqual((Post.query.count(), PostTag.query.count()), (4, 4))
+        # The rows only changed places, so nothing was counted twice or lost.
+        self.assertEqual((User.query.one().post_count, Tag.query.one().post_count), (4, 4))
+
+        self.assertEqual(create_partitions(months_ahead=2, now=datetime(2024, 3, 10)), [])
+
+    def test_posts_and_tags_follow_created_at(self):
+        create_partitions(months_ahead=3, now=datetime(2024, 2, 1))
+        db.session.commit()
+
+        post = Post.query.filter_by(title='Month 2').one()
+        post.created_at = datetime(2024, 4, 2)
+        db.session.commit()
+
+        self.assertEqual((count('posts_y2024m02'), count('posts_tags_y2024m02')), (0, 0))
+        self.assertEqual((count('posts_y2024m04'), count('posts_tags_y2024m04')), (2, 2))
+        self.assertEqual([tag.name for tag in Post.query.get(post.id).tags], ['monthly'])
+
+    def explain_post_page(self, **cursor):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT') and 'FROM posts' in statement:
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            post_page(**cursor)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        statement, parameters = statements[0]
+        cursor = db.session.connection().connection.cursor()
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        return '\n'.join(line for line, in cursor.fetchall())
+
+    def test_cursor_pages_prune_partitions(self):
+        create_partitions(months_ahead=3, now=datetime(2024, 2, 1))
+        db.session.commit()
+
+        march = Post.query.filter_by(title='Month 3').one()
+        plan = self.explain_post_page(after=encode_cursor([march.created_at, march.id]))
+        self.assertIn('posts_y2024m02', plan)
+        self.assertNotIn('posts_y2024m04', plan)
+        self.assertNotIn('posts_y2024m05', plan)
+
+        plan = self.explain_post_page(before=encode_cursor([march.created_at, march.id]))
+        self.assertNotIn('posts_y2024m02', plan)
+        self.assertIn('posts_y2024m05', plan)
+
+    def test_archive_partitions(self):
+        create_partitions(months_ahead=3, now=datetime(2024, 2, 1))
+        db.session.commit()
+
+        self.assertEqual(archive_partitions(datetime(2024, 4, 10)), [datetime(2024, 2, 1), datetime(2024, 3, 1)])
+        db.session.commit()
+
+        self.assertEqual(partition_months(), [datetime(2024, 4, 1), datetime(2024, 5, 1)])
+        self.assertEqual([post.title for post in Post.query.order_by(Post.created_at)], ['Month 4', 'Month 5'])
+        self.assertEqual((count('archive.posts_y2024m02'), count('archive.posts_tags_y2024m03')), (1, 1))
+        self.assertEqual((User.query.one().post_count, Tag.query.one().post_count), (2, 2))
+
+        # Archived rows still go with their user.
+        db.session.delete(User.query.one())
+        db.session.commit()
+        self.assertEqual((count('archive.posts_y2024m03'), count('archive.posts_tags_y2024m03')), (0, 0))
+
+    def test_commands(self):
+        runner = app.test_cli_runner()
+        this_month = month_start(datetime.now())
+        result = runner.invoke(args=['blogly', 'create-partitions', '--months', '1'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn(f'{this_month:%Y-%m}', result.output)
+        self.assertEqual(partition_months(), [this_month, add_months(this_month, 1)])
+
+        result = runner.invoke(args=['blogly', 'archive-partitions', '--older-than', '1'])
+        self.assertEqual(result.output.strip(), 'Nothing to archive.')
+
+        with app.test_client() as client:
+            self.assertIn('Month 5', client.get('/').get_data(as_text=True))
+            create_partitions(months_ahead=0, now=datetime(2024, 5, 1))
+            db.session.commit()
+            result = runner.invoke(args=['blogly', 'archive-partitions', '--older-than', '1'])
+            self.assertIn('2024-05', result.output)
+            self.assertNotIn('Month 5', client.get('/').get_data(as_text=True))
+
+
+class UnpartitionedTestCase(TestCase):
+    """Tests for the plain tables used on SQLite."""
+
+    def setUp(self):
+        """Build an empty SQLite app."""
+        db.session.remove()
+        self.app = create_app('testing', SQLALCHEMY_DATABASE_URI='sqlite://')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Throw away the SQLite database."""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        db.session.remove()
+
+    def test_partitioning_skipped(self):
+        user = User(first_name="TestFirst", last_name="TestLast")
+        db.session.add(Post(title='Plain', content='Test content.', user=user, tags=[Tag(name='plain')],
+                            created_at=datetime(2024, 3, 15)))
+        db.session.commit()
+
+        self.assertFalse(is_partitioned())
+        self.assertEqual(create_partitions(), [])
+        self.assertEqual(archive_partitions(datetime.now()), [])
+        self.assertEqual(db.session.query(PostTag.post_created_at).scalar(), datetime(2024, 3, 15))
@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from wsgi import app
+from models import db, User, Post, Tag
+from queries import PER_PAGE, encode_cursor, post_page, user_page
+from timeline import timeline
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+@contextmanager
+def count_statements():
+    """Count the SQL statements sent to the database inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+class ListingQueryCountTestCase(TestCase):
+    """Listing pages run a fixed number of queries whatever the row count."""
+
+    def setUp(self):
+        """Add a user and a tag to attach posts to."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        tag = Tag(name='busy tag')
+        db.session.add_all([user, tag])
+        db.session.commit()
+
+        self.user_id = user.id
+        self.tag_id = tag.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def add_posts(self, count):
+        tag = Tag.query.get(self.tag_id)
+        posts = [Post(title=f'Post {n}', content='Some content.', user_id=self.user_id)
+                 for n in range(count)]
+        for post in posts:
+            post.tags.append(tag)
+        db.session.add_all(posts)
+        db.session.commit()
+        db.session.expunge_all()
+
+    def statements_for(self, url):
+        with app.test_client() as client:
+            with count_statements() as statements:
+                resp = client.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            return len(statements)
+
+    def assert_constant_queries(self, url):
+        self.add_posts(2)
+        few = self.statements_for(url)
+        self.add_posts(20)
+        many = self.statements_for(url)
+
+        self.assertEqual(few, many)
+
+    def test_homepage_queries(self):
+        # Build the feed first; after that new posts are added to it as they're committed.
+        self.statements_for('/')
+        self.assert_constant_queries('/')
+
+    def test_all_posts_queries(self):
+        self.assert_constant_queries('/posts')
+
+    def test_user_detail_queries(self):
+        self.assert_constant_queries(f'/users/{self.user_id}')
+
+    def test_tag_detail_queries(self):
+        self.assert_constant_queries(f'/tags/{self.tag_id}')
+
+    def test_listings_skip_full_text(self):
+        self.add_posts(3)
+        with app.test_client() as client:
+            with count_statements() as statements:
+                client.get('/posts')
+                client.get(f'/users/{self.user_id}')
+
+        self.assertTrue([statement for statement in statements if 'posts.excerpt' in statement])
+        self.assertFalse([statement for statement in statements if 'posts.content' in statement])
+
+    def test_tag_update_queries(self):
+        def update_tag():
+            post_ids = [str(id) for (id,) in db.session.query(Post.id)]
+            with app.test_client() as client:
+                with count_statements() as statements:
+                    resp = client.post(f'/tags/{self.tag_id}/edit',
+                                       data={'name': 'busy tag', 'post': post_ids, 'shown': post_ids})
+
+                self.assertEqual(resp.status_code, 302)
+                return len(statements)
+
+        self.add_posts(2)
+        db.session.execute('DELETE FROM posts_tags')
+        db.session.commit()
+        few = update_tag()
+        self.add_posts(20)
+        db.session.execute('DELETE FROM posts_tags')
+        db.session.commit()
+        many = update_tag()
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(Tag.query.get(self.tag_id).posts), 22)
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Listing pages are split into cursor-linked pages."""
+
+    def setUp(self):
+        """Add a user with more posts than fit on one page."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        user = User(first_name="TestFirst", last_name="TestLast")
+        db.session.add(user)
+        db.session.commit()
+
+        db.session.add_all([Post(title=f'Post {n:02}', content='Some content.', user_id=user.id)
+                            for n in range(PER_PAGE + 5)])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_post_pages(self):
+        newest = post_page()
+        self.assertEqual(len(newest.items), PER_PAGE)
+        self.assertEqual(newest.items[0].title, f'Post {PER_PAGE + 4:02}')
+        self.assertIsNone(newest.prev_cursor)
+
+        oldest = post_page(after=newest.next_cursor)
+        self.assertEqual([p.title for p in oldest.items], [f'Post {n:02}' for n in range(4, -1, -1)])
+        self.assertIsNone(oldest.next_cursor)
+
+        back = post_page(before=oldest.prev_cursor)
+        self.assertEqual([p.id for p in back.items], [p.id for p in newest.items])
+        self.assertIsNone(back.prev_cursor)
+        self.assertIsNotNone(back.next_cursor)
+
+    def test_user_pages(self):
+        db.session.add_all([User(first_name=f'First{n:02}', last_name='Zed') for n in range(PER_PAGE)])
+        db.session.commit()
+
+        first = user_page()
+        second = user_page(after=first.next_cursor)
+        self.assertEqual(first.items[0].last_name, 'TestLast')
+        self.assertEqual([u.first_name for u in second.items], ['First19'])
+
+    def test_posts_next_link(self):
+        with app.test_client() as client:
+            resp = client.get('/posts')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Post 24', html)
+            self.assertNotIn('Post 04', html)
+            self.assertIn(f'?after={post_page().next_cursor}', html)
+
+    def test_bad_cursor(self):
+        with app.test_client() as client:
+            resp = client.get('/posts?after=not-a-cursor')
+
+            self.assertEqual(resp.status_code, 400)
+
+    def test_cursor_with_wrong_types(self):
+        with app.test_client() as client:
+            for values in (['2020-01-01T00:00:00', 'abc'], ['2020-01-01T00:00:00', True], [1, 2]):
+                resp = client.get(f'/posts?after={encode_cursor(values)}')
+
+                self.assertEqual(resp.status_code, 400)
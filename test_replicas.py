@@ -0,0 +1,108 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from app import create_app
+from cache import page_cache
+from models import db, User
+from replicas import STICKY_COOKIE
+
+
+class ReplicaTestCase(TestCase):
+    """Tests for routing reads to replicas, with SQLite files standing in for the databases."""
+
+    def setUp(self):
+        """Build an app with two replicas, each holding a different user from the primary."""
+        self.dir = TemporaryDirectory()
+        uri = lambda name: 'sqlite:///' + os.path.join(self.dir.name, f'{name}.db')
+        self.app = self.make_app(uri)
+
+        db.session.remove()
+        with self.app.app_context():
+            for bind, name in ((None, 'Primary'), ('replica0', 'Zero'), ('replica1', 'One')):
+                engine = db.get_engine(self.app, bind)
+                db.Model.metadata.create_all(engine)
+                engine.execute(User.__table__.insert(), first_name=name, last_name='User')
+        db.session.remove()
+
+    def make_app(self, uri, **config):
+        return create_app('testing', SQLALCHEMY_DATABASE_URI=uri('primary'),
+                          SQLALCHEMY_REPLICA_URIS=[uri('replica0'), uri('replica1')], **config)
+
+    def tearDown(self):
+        """Throw away the databases."""
+        db.session.remove()
+        self.dir.cleanup()
+
+    def test_reads_rotate_across_replicas(self):
+        with self.app.test_client() as client:
+            pages = [client.get('/users').data for _ in range(4)]
+
+        self.assertIn(b'User, Zero', pages[0])
+        self.assertIn(b'User, One', pages[1])
+        self.assertIn(b'User, Zero', pages[2])
+        self.assertNotIn(b'User, Primary', b''.join(pages))
+
+    def test_writes_go_to_primary_and_stick(self):
+        with self.app.test_client() as client:
+            resp = client.post('/users/new', data={'first_name': 'New', 'last_name': 'Person', 'image_url': ''})
+            self.assertIn(STICKY_COOKIE, resp.headers['Set-Cookie'])
+
+            resp = client.get('/users')
+            self.assertIn(b'User, Primary', resp.data)
+            self.assertIn(b'Person, New', resp.data)
+
+            client.delete_cookie('localhost', STICKY_COOKIE)
+            self.assertIn(b'User, Zero', client.get('/users').data)
+
+        with self.app.app_context():
+            self.assertEqual(User.query.count(), 2)
+
+    def test_reads_outside_requests_use_primary(self):
+        with self.app.app_context():
+            self.assertEqual([user.first_name for user in User.query], ['Primary'])
+
+    def test_least_connections(self):
+        app = self.make_app(lambda name: 'sqlite:///' + os.path.join(self.dir.name, f'{name}.db'),
+                            REPLICA_STRATEGY='least-connections')
+        replicas = app.extensions['replicas']
+
+        busy = replicas.engine(db, app, 'replica0').connect()
+        self.assertEqual(replicas.in_use, {'replica0': 1, 'replica1': 0})
+        with app.test_client() as client:
+            self.assertIn(b'User, One', client.get('/users').data)
+            self.assertIn(b'User, One', client.get('/users').data)
+        busy.close()
+
+        self.assertEqual(replicas.in_use, {'replica0': 0, 'replica1': 0})
+
+    def test_cache_rebuilds_read_primary(self):
+        app = self.make_app(lambda name: 'sqlite:///' + os.path.join(self.dir.name, f'{name}.db'),
+                            PAGE_CACHE_ENABLED=True)
+        page_cache.clear()
+        try:
+            with app.test_client() as client:
+                # Cold misses read a replica like any other GET.
+                page = client.get('/users/1').data
+                self.assertNotIn(b'Primary User', page)
+                self.assertEqual(client.get('/users/1').data, page)
+
+                # A page a commit evicted is rebuilt from the primary while replicas may lag.
+                with app.app_context():
+                    User.query.get(1).first_name = 'Renamed'
+                    db.session.commit()
+                self.assertIn(b'Renamed User', client.get('/users/1').data)
+                self.assertIn(b'Renamed User', client.get('/users/1').data)
+
+                # A page showing rows changed that recently isn't stored from a replica.
+                self.assertNotIn(b'Renamed User', client.get('/users/1?from=replica').data)
+                self.assertNotIn(b'Renamed User', client.get('/users/1?from=replica').data)
+                self.assertEqual(page_cache.stats()['entries'], 1)
+        finally:
+            page_cache.clear()
+            page_cache.replica_lag = 0
+
+        with app.test_request_context('/users'):
+            with db.on_primary():
+                self.assertEqual([user.first_name for user in User.query], ['Renamed'])
+            self.assertNotEqual([user.first_name for user in User.query], ['Renamed'])
@@ -0,0 +1,109 @@
+from unittest import TestCase
+
+from app import create_app
+from wsgi import app
+from models import db, User, Post, Tag
+from search import search_posts
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def add_sample_posts():
+    user1 = User(first_name="TestFirst", last_name="TestLast")
+    user2 = User(first_name="Test2First", last_name="Test2Last")
+    db.session.add_all([user1, user2])
+    db.session.commit()
+
+    tag = Tag(name='gardening')
+    post1 = Post(title='Tomatoes', content='Growing tomatoes in pots on a balcony.', user_id=user1.id)
+    post2 = Post(title='Balcony life', content='Chairs, tables and a small grill.', user_id=user1.id)
+    post3 = Post(title='Soup', content='A recipe for tomato soup.', user_id=user2.id)
+    post1.tags.append(tag)
+    db.session.add_all([post1, post2, post3])
+    db.session.commit()
+
+
+class SearchTestCase(TestCase):
+    """Tests for searching posts on Postgres."""
+
+    def setUp(self):
+        """Add sample posts."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        add_sample_posts()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_ranks_title_matches_first(self):
+        results = search_posts('balcony')
+        self.assertEqual([post.title for post in results.items], ['Balcony life', 'Tomatoes'])
+
+    def test_stems_words(self):
+        results = search_posts('tomato')
+        self.assertEqual({post.title for post in results.items}, {'Tomatoes', 'Soup'})
+
+    def test_filters(self):
+        self.assertEqual([post.title for post in search_posts('tomato', tag='gardening').items], ['Tomatoes'])
+        self.assertEqual([post.title for post in search_posts('tomato', user_id=2).items], ['Soup'])
+
+    def test_pages(self):
+        first = search_posts('tomato', per_page=1)
+        second = search_posts('tomato', page=2, per_page=1)
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertNotEqual(first.items[0].id, second.items[0].id)
+
+    def test_search_page(self):
+        with app.test_client() as client:
+            resp = client.get('/search?q=soup')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<a href="/posts/3">Soup</a>', html)
+            self.assertNotIn('Balcony life', html)
+
+    def test_search_json(self):
+        with app.test_client() as client:
+            resp = client.get('/search.json?q=tomato&tag=gardening')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['results'][0]['title'], 'Tomatoes')
+            self.assertEqual(resp.json['results'][0]['tags'], [{'id': 1, 'name': 'gardening'}])
+            self.assertIsNone(resp.json['next_page'])
+
+
+class LikeSearchTestCase(TestCase):
+    """Tests for the LIKE fallback used on SQLite."""
+
+    def setUp(self):
+        """Build a SQLite app with sample posts."""
+        db.session.remove()
+        self.app = create_app('testing', SQLALCHEMY_DATABASE_URI='sqlite://')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        add_sample_posts()
+
+    def tearDown(self):
+        """Throw away the SQLite database."""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        db.session.remove()
+
+    def test_like_search(self):
+        results = search_posts('balcony')
+        self.assertEqual([post.title for post in results.items], ['Balcony life', 'Tomatoes'])
+
+    def test_like_search_escapes_wildcards(self):
+        self.assertEqual(search_posts('100%').items, [])
@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+from wsgi import app
+from models import db, User, Post, Tag, CatalogVersion
+from tagindex import tag_index
+from test_queries import count_statements
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class TagIndexTestCase(TestCase):
+    """Tests for tag autocomplete."""
+
+    def setUp(self):
+        """Add tags used by different numbers of posts, and empty the index."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        tag_index.clear()
+
+        self.tags = {name: Tag(name=name) for name in ['Python', 'pytest', 'pylint', 'ruby', 'PyPy']}
+        user = User(first_name="TestFirst", last_name="TestLast")
+        for n, name in enumerate(['pytest', 'pytest', 'pylint', 'PyPy', 'pytest', 'pylint']):
+            db.session.add(Post(title=f'Test{n}', content='Test content.', user=user,
+                                tags=[self.tags[name]]))
+        db.session.add_all(self.tags.values())
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def names(self, prefix, limit=10):
+        return [name for _, name, _ in tag_index.complete(prefix, limit)]
+
+    def test_most_used_first(self):
+        self.assertEqual(self.names('py'), ['pytest', 'pylint', 'PyPy', 'Python'])
+        self.assertEqual(self.names('PY', limit=2), ['pytest', 'pylint'])
+        self.assertEqual(self.names('pyt'), ['pytest', 'Python'])
+        self.assertEqual(self.names('x'), [])
+
+    def test_committed_changes_applied(self):
+        self.names('py')
+        db.session.add(Tag(name='pyramid'))
+        self.tags['ruby'].name = 'pyruby'
+        db.session.delete(self.tags['pylint'])
+        db.session.commit()
+
+        self.assertEqual(self.names('py'), ['pytest', 'PyPy', 'pyramid', 'pyruby', 'Python'])
+
+    def test_rolled_back_changes_ignored(self):
+        self.names('py')
+        db.session.add(Tag(name='pyramid'))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertNotIn('pyramid', self.names('py'))
+
+    def test_choices(self):
+        self.assertEqual(tag_index.choices(10), sorted((tag.id, tag.name) for tag in self.tags.values()))
+        self.assertIsNone(tag_index.choices(4))
+
+        # One counter row while nothing has changed, whatever the TTL.
+        tag_index.ttl = -1
+        try:
+            with count_statements() as statements:
+                tag_index.choices(10)
+        finally:
+            tag_index.ttl = 300
+        self.assertEqual(len(statements), 1)
+        self.assertIn('catalog_versions', statements[0])
+
+    def test_other_process_changes_reloaded(self):
+        tag_index.choices(10)
+        db.session.execute("INSERT INTO tags (name) VALUES ('their tag')")
+        CatalogVersion.bump(db.session.connection(), 'tags')
+        db.session.commit()
+
+        self.assertEqual(tag_index.choices(10)[-1].name, 'their tag')
+        self.assertEqual(self.names('their'), ['their tag'])
+
+    def test_uncommitted_changes_only_shown_to_their_session(self):
+        tag_index.choices(10)
+        db.session.add(Tag(name='new tag'))
+        db.session.flush()
+
+        self.assertEqual(len(tag_index.choices(10)), 6)
+        db.session.rollback()
+        self.assertEqual(len(tag_index.choices(10)), 5)
+
+    def test_complete_endpoint(self):
+        with app.test_client() as client:
+            resp = client.get('/api/v1/tags/complete?q=pyl')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['items'],
+                             [{'id': self.tags['pylint'].id, 'name': 'pylint', 'post_count': 2}])
+
+    def test_forms_search_when_there_are_many_tags(self):
+        pytest_id = self.tags['pytest'].id
+        with app.test_client() as client:
+            self.assertIn('name="tag"', client.get('/users/1/posts/new').get_data(as_text=True))
+
+            app.config['TAG_CHECKBOX_LIMIT'] = 2
+            try:
+                html = client.get('/users/1/posts/new').get_data(as_text=True)
+                self.assertIn('id="tag-search"', html)
+                self.assertNotIn('ruby', html)
+
+                html = client.get('/posts/1/edit').get_data(as_text=True)
+                self.assertIn(f'value="{pytest_id}" id="tag-{pytest_id}" checked', html)
+                self.assertNotIn('ruby', html)
+            finally:
+                app.config['TAG_CHECKBOX_LIMIT'] = 100
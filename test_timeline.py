@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from wsgi import app
+from models import db, User, Post, Tag
+from timeline import timeline, Timeline, MemoryStore, RedisStore
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class FakeRedis:
+    """Just enough of the redis client's sorted set commands for RedisStore."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.data.get(key, {}).pop(member, None)
+
+    def _ranked(self, key):
+        return sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def zremrangebyrank(self, key, start, stop):
+        ranked = self._ranked(key)
+        for member, _ in ranked[start:stop + 1 if stop != -1 else None]:
+            del self.data[key][member]
+
+    def zrevrange(self, key, start, stop, withscores=False):
+        ranked = [(member.encode(), score) for member, score in reversed(self._ranked(key))][start:stop + 1]
+        return ranked if withscores else [member for member, _ in ranked]
+
+    def scan_iter(self, match):
+        return [key for key in self.data if key.startswith(match.rstrip('*'))]
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        for name, args, kwargs in self.commands:
+            getattr(self.client, name)(*args, **kwargs)
+
+
+class StoreTestCase(TestCase):
+    """Tests for the feed stores on their own."""
+
+    def check_store(self, store):
+        self.assertFalse(store.built('posts'))
+        store.rebuild('posts', [(1, 10.0), (2, 20.0), (3, 20.0)])
+        self.assertTrue(store.built('posts'))
+        self.assertEqual(store.range('posts', 10), [3, 2, 1])
+
+        store.add('posts', 4, 15.0, length=3)
+        self.assertEqual(store.range('posts', 10), [3, 2, 4])
+
+        store.remove('posts', [2])
+        self.assertEqual(store.range('posts', 2), [3, 4])
+        self.assertEqual(store.scored_range('posts', 10), [(3, 20.0), (4, 15.0)])
+
+        store.invalidate('posts')
+        self.assertFalse(store.built('posts'))
+
+        store.rebuild('tag:1', [])
+        self.assertTrue(store.built('tag:1'))
+        store.clear()
+        self.assertFalse(store.built('tag:1'))
+
+    def test_memory_store(self):
+        self.check_store(MemoryStore())
+
+    def test_redis_store(self):
+        self.check_store(RedisStore(FakeRedis()))
+
+    def test_memory_feeds_expire(self):
+        store = MemoryStore(ttl=10)
+        with patch('timeline.monotonic', return_value=100):
+            store.rebuild('posts', [(1, 10.0)])
+        with patch('timeline.monotonic', return_value=111):
+            self.assertFalse(store.built('posts'))
+
+    def test_adds_to_unbuilt_feeds_ignored(self):
+        store = MemoryStore()
+        store.add('posts', 1, 10.0, length=3)
+        self.assertEqual(store.range('posts', 10), [])
+
+
+class TimelineTestCase(TestCase):
+    """Tests for feeds kept current as posts are written."""
+
+    def setUp(self):
+        """Add a user with three posts, a day apart, and empty the feeds."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        timeline.clear()
+
+        self.user = User(first_name="TestFirst", last_name="TestLast")
+        self.tag = Tag(name='silly tag')
+        start = datetime(2020, 12, 1)
+        posts = [Post(title=f'Test{i}', content='Test content.', user=self.user,
+                      created_at=start + timedelta(days=i))
+                 for i in range(1, 4)]
+        posts[0].tags.append(self.tag)
+        db.session.add_all(posts)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def titles(self, key, limit=10):
+        return [post.title for post in timeline.recent(key, limit)]
+
+    def test_feeds_built_newest_first(self):
+        self.assertEqual(self.titles('posts'), ['Test3', 'Test2', 'Test1'])
+        self.assertEqual(self.titles('posts', 2), ['Test3', 'Test2'])
+        self.assertEqual(self.titles(f'user:{self.user.id}'), ['Test3', 'Test2', 'Test1'])
+        self.assertEqual(self.titles(f'tag:{self.tag.id}'), ['Test1'])
+
+    def test_committed_posts_added_and_removed(self):
+        self.titles('posts')
+        db.session.add(Post(title='Test4', content='New.', user=self.user, created_at=datetime(2021, 1, 1)))
+        db.session.delete(Post.query.filter_by(title='Test2').one())
+        db.session.commit()
+
+        with patch.object(timeline, 'rebuild') as rebuild:
+            self.assertEqual(self.titles('posts'), ['Test4', 'Test3', 'Test1'])
+        rebuild.assert_not_called()
+
+    def test_rolled_back_posts_not_added(self):
+        self.titles('posts')
+        db.session.add(Post(title='Test4', content='New.', user=self.user, created_at=datetime(2021, 1, 1)))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertEqual(self.titles('posts'), ['Test3', 'Test2', 'Test1'])
+
+    def test_feeds_bounded(self):
+        feeds = Timeline(length=2)
+        self.assertEqual([post.title for post in feeds.recent('posts', 10)], ['Test3', 'Test2'])
+        feeds.apply([('add', 'posts', 99, datetime(2021, 1, 1).timestamp())])
+        self.assertEqual(feeds.store.range('posts', 10), [99, 3])
+
+    def test_retagging_rebuilds_tag_feed(self):
+        self.assertEqual(self.titles(f'tag:{self.tag.id}'), ['Test1'])
+        post = Post.query.filter_by(title='Test3').one()
+        post.tags.append(self.tag)
+        db.session.commit()
+
+        self.assertEqual(self.titles(f'tag:{self.tag.id}'), ['Test3', 'Test1'])
+
+    def test_out_of_band_deletes_rebuild(self):
+        self.titles('posts')
+        db.session.execute("DELETE FROM posts WHERE title = 'Test3'")
+        db.session.commit()
+
+        self.assertEqual(self.titles('posts'), ['Test2', 'Test1'])
+
+    def test_homepage_shows_new_posts(self):
+        with app.test_client() as client:
+            client.get('/')
+            resp = client.post(f'/users/{self.user.id}/posts/new',
+                               data={'title': 'Brand new', 'content': 'Fresh.'}, follow_redirects=True)
+            self.assertEqual(resp.status_code, 200)
+
+            html = client.get('/').get_data(as_text=True)
+            self.assertIn('Brand new', html)
@@ -0,0 +1,190 @@
+import io
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from app import create_app
+from wsgi import app
+from models import db, User, Post, Tag
+import transfer
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def add_sample_data():
+    user = User(first_name="TestFirst", last_name="TestLast", image_url=None)
+    tag = Tag(name='silly tag')
+    db.session.add_all([user, tag])
+    db.session.commit()
+
+    post1 = Post(title='Test1', content='Line one\tand\nline two \\ done.', user_id=user.id)
+    post2 = Post(title='Test2', content='', user_id=user.id)
+    post1.tags.append(tag)
+    db.session.add_all([post1, post2])
+    db.session.commit()
+
+
+def snapshot():
+    return {name: list(transfer.stream_rows(name)) for name in transfer.TABLES}
+
+
+class TransferTestCase(TestCase):
+    """Tests for exporting and re-importing data on Postgres."""
+
+    def setUp(self):
+        """Add sample data."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        add_sample_data()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def wipe(self):
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+
+    def test_ndjson_round_trip(self):
+        before = snapshot()
+        out = io.StringIO()
+        self.assertEqual(transfer.export_ndjson(out), 5)
+
+        self.wipe()
+        seen = transfer.import_rows(transfer.read_ndjson(io.StringIO(out.getvalue())), chunk_size=1)
+
+        self.assertEqual(seen, {'users': 1, 'tags': 1, 'posts': 2, 'posts_tags': 1})
+        self.assertEqual(snapshot(), before)
+        self.assertEqual(User.query.get(1).post_count, 2)
+
+    def test_import_is_idempotent(self):
+        before = snapshot()
+        out = io.StringIO()
+        transfer.export_ndjson(out)
+
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(out.getvalue())))
+
+        self.assertEqual(snapshot(), before)
+
+    def test_sequences_move_past_imported_ids(self):
+        out = io.StringIO()
+        transfer.export_ndjson(out)
+        self.wipe()
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(out.getvalue())))
+
+        user = User(first_name="New", last_name="User")
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(user.id, 2)
+
+    def export(self):
+        out = io.StringIO()
+        transfer.export_ndjson(out)
+        return out.getvalue()
+
+    def test_tags_matched_by_name(self):
+        export = self.export()
+        self.wipe()
+        db.session.add_all([Tag(name='other tag'), Tag(name='silly tag')])
+        db.session.commit()
+
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(export)))
+
+        post = Post.query.filter_by(title='Test1').one()
+        self.assertEqual([(tag.id, tag.name) for tag in post.tags], [(2, 'silly tag')])
+        self.assertEqual(Tag.query.count(), 2)
+
+    def test_tag_with_taken_id_gets_a_new_one(self):
+        export = self.export()
+        self.wipe()
+        db.session.add(Tag(name='other tag'))
+        db.session.commit()
+
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(export)))
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(export)))
+
+        post = Post.query.filter_by(title='Test1').one()
+        self.assertEqual([(tag.id, tag.name) for tag in post.tags], [(2, 'silly tag')])
+        self.assertEqual(Tag.query.get(1).posts, [])
+        self.assertEqual(Tag.query.count(), 2)
+
+    def test_user_with_taken_id_stops_the_import(self):
+        export = self.export()
+        self.wipe()
+        db.session.add(User(first_name='Someone', last_name='Else'))
+        db.session.commit()
+
+        with self.assertRaises(transfer.ImportConflict):
+            transfer.import_rows(transfer.read_ndjson(io.StringIO(export)))
+        db.session.rollback()
+
+        self.assertEqual([user.first_name for user in User.query], ['Someone'])
+        self.assertEqual(Post.query.count(), 0)
+
+        result = app.test_cli_runner().invoke(args=['blogly', 'import', '-'], input=export)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('users 1 in the import differs', result.output)
+
+    def test_cli_csv_round_trip(self):
+        before = snapshot()
+        runner = app.test_cli_runner()
+        with TemporaryDirectory() as directory:
+            result = runner.invoke(args=['blogly', 'export', directory, '--format', 'csv'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'posts.csv')))
+
+            self.wipe()
+            result = runner.invoke(args=['blogly', 'import', directory, '--format', 'csv'])
+            self.assertEqual(result.exit_code, 0)
+
+        self.assertEqual(snapshot(), before)
+
+
+class SQLiteImportTestCase(TestCase):
+    """Tests for the executemany import used off Postgres."""
+
+    def setUp(self):
+        """Export sample data from Postgres and build an empty SQLite app."""
+        db.session.execute('TRUNCATE users, posts, tags, posts_tags RESTART IDENTITY CASCADE')
+        db.session.commit()
+        add_sample_data()
+        self.expected = snapshot()
+        out = io.StringIO()
+        transfer.export_ndjson(out)
+        self.export = out.getvalue()
+
+        db.session.remove()
+        self.app = create_app('testing', SQLALCHEMY_DATABASE_URI='sqlite://')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Throw away the SQLite database."""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        db.session.remove()
+
+    def test_import_twice(self):
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(self.export)), chunk_size=2)
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(self.export)), chunk_size=2)
+
+        self.assertEqual(snapshot(), self.expected)
+
+    def test_tags_matched_by_name(self):
+        db.session.add(Tag(name='other tag'))
+        db.session.commit()
+
+        transfer.import_rows(transfer.read_ndjson(io.StringIO(self.export)))
+
+        post = Post.query.filter_by(title='Test1').one()
+        self.assertEqual([(tag.id, tag.name) for tag in post.tags], [(2, 'silly tag')])
@@ -0,0 +1,287 @@
+"""Bounded lists of recent post ids for the global, per-user and per-tag feeds.
+
+Each feed ('posts', 'user:<id>', 'tag:<id>') holds the ids of its newest
+TIMELINE_LENGTH posts, newest first, so reading a feed costs one lookup in
+the store and one query for the page of posts by primary key.
+
+Feeds are built from the database the first time they're read after the
+process starts (or after they've been invalidated), then maintained
+incrementally: committed post inserts and deletes are added to and removed
+from the feeds they belong in, and feeds whose membership changes in ways
+that are awkward to patch, such as retagging, are invalidated and rebuilt
+on their next read. A read that finds ids of posts deleted behind the
+ORM's back rebuilds the feed too.
+
+The store is in-process memory by default, where feeds also expire after
+TIMELINE_TTL seconds to pick up other workers' writes. Set TIMELINE_REDIS_URL
+to share sorted sets in Redis between workers instead (needs the redis
+package).
+"""
+from bisect import insort
+from datetime import datetime, timedelta
+from threading import RLock
+from time import monotonic
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.base import NO_VALUE
+from models import db, User, Post, Tag, PostTag, associations_changed
+from pending import PendingChanges
+from queries import post_listing
+
+TIMELINE_LENGTH = 100
+
+
+def score(created_at):
+    return created_at.timestamp()
+
+
+class MemoryStore:
+    """Feeds held in this process, each a list of (-score, -id) kept in sorted order."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._feeds = {}
+        self._built_at = {}
+        self._lock = RLock()
+
+    def built(self, key):
+        with self._lock:
+            built_at = self._built_at.get(key)
+            if built_at is None or built_at + self.ttl < monotonic():
+                self.invalidate(key)
+                return False
+            return True
+
+    def rebuild(self, key, entries):
+        with self._lock:
+            self._feeds[key] = sorted((-score, -id) for id, score in entries)
+            self._built_at[key] = monotonic()
+
+    def add(self, key, id, score, length):
+        with self._lock:
+            feed = self._feeds.get(key)
+            if feed is None:
+                return
+            self._discard(feed, id)
+            insort(feed, (-score, -id))
+            del feed[length:]
+
+    def remove(self, key, ids):
+        with self._lock:
+            feed = self._feeds.get(key)
+            for id in ids if feed is not None else ():
+                self._discard(feed, id)
+
+    def _discard(self, feed, id):
+        for i, (_, negated_id) in enumerate(feed):
+            if negated_id == -id:
+                del feed[i]
+                return
+
+    def range(self, key, limit):
+        return [id for id, _ in self.scored_range(key, limit)]
+
+    def scored_range(self, key, limit):
+        with self._lock:
+            return [(-negated_id, -negated_score) for negated_score, negated_id in self._feeds.get(key, [])[:limit]]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._feeds.pop(key, None)
+            self._built_at.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._feeds.clear()
+            self._built_at.clear()
+
+
+class RedisStore:
+    """Feeds kept as Redis sorted sets scored by creation time, shared by every worker.
+
+    A '<feed>:built' marker tells an empty feed apart from one that has
+    never been built.
+    """
+
+    def __init__(self, client, prefix='blogly:timeline:'):
+        self.client = client
+        self.prefix = prefix
+
+    def built(self, key):
+        return bool(self.client.exists(f'{self.prefix}{key}:built'))
+
+    def rebuild(self, key, entries):
+        pipe = self.client.pipeline()
+        pipe.delete(self.prefix + key)
+        if entries:
+            pipe.zadd(self.prefix + key, {str(id): score for id, score in entries})
+        pipe.set(f'{self.prefix}{key}:built', 1)
+        pipe.execute()
+
+    def add(self, key, id, score, length):
+        pipe = self.client.pipeline()
+        pipe.zadd(self.prefix + key, {str(id): score})
+        pipe.zremrangebyrank(self.prefix + key, 0, -length - 1)
+        pipe.execute()
+
+    def remove(self, key, ids):
+        if ids:
+            self.client.zrem(self.prefix + key, *(str(id) for id in ids))
+
+    def range(self, key, limit):
+        return [int(id) for id in self.client.zrevrange(self.prefix + key, 0, limit - 1)]
+
+    def scored_range(self, key, limit):
+        return [(int(id), score) for id, score in
+                self.client.zrevrange(self.prefix + key, 0, limit - 1, withscores=True)]
+
+    def invalidate(self, key):
+        self.client.delete(self.prefix + key, f'{self.prefix}{key}:built')
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Timeline:
+    """Reads feeds, building them from the database when needed, and applies committed writes to them."""
+
+    def __init__(self, store=None, length=TIMELINE_LENGTH):
+        self.store = store or MemoryStore()
+        self.length = length
+
+    def init_app(self, app):
+        app.config.setdefault('TIMELINE_LENGTH', self.length)
+        app.config.setdefault('TIMELINE_TTL', 300)
+        app.config.setdefault('TIMELINE_REDIS_URL', None)
+        self.length = app.config['TIMELINE_LENGTH']
+
+        if app.config['TIMELINE_REDIS_URL']:
+            import redis
+            self.store = RedisStore(redis.Redis.from_url(app.config['TIMELINE_REDIS_URL']))
+        elif isinstance(self.store, MemoryStore):
+            self.store.ttl = app.config['TIMELINE_TTL']
+
+    def ids(self, key, limit):
+        """The ids of the newest `limit` posts in a feed, newest first."""
+        if not self.store.built(key):
+            self.rebuild(key)
+        return self.store.range(key, limit)
+
+    def recent(self, key, limit):
+        """The newest `limit` posts in a feed, with their users and tags loaded."""
+        if not self.store.built(key):
+            self.rebuild(key)
+        posts = self._load(self.store.scored_range(key, limit))
+        if posts is None:
+            with db.on_primary():
+                self.rebuild(key)
+                posts = self._load(self.store.scored_range(key, limit)) or []
+        return posts
+
+    def _load(self, entries):
+        """The posts for (id, score) `entries` in feed order, or None if any of them no longer exist."""
+        if not entries:
+            return []
+        ids = [id for id, _ in entries]
+        # Bounding created_at by the oldest score lets Postgres skip the
+        # partitions of older months. A day's slack covers clock changes
+        # and rounding in the scores.
+        since = datetime.fromtimestamp(min(score for _, score in entries)) - timedelta(days=1)
+        found = {post.id: post for post in post_listing().filter(Post.created_at >= since, Post.id.in_(ids))}
+        if len(found) < len(ids):
+            return None
+        return [found[id] for id in ids]
+
+    def rebuild(self, key):
+        # Feeds are rebuilt after a commit invalidated them, so they're read
+        # from the primary: a lagging replica would leave the change out.
+        query = db.session.query(Post.id, Post.created_at)
+        kind, _, id = key.partition(':')
+        if kind == 'user':
+            query = query.filter(Post.user_id == int(id))
+        elif kind == 'tag':
+            query = query.join(PostTag).filter(PostTag.tag_id == int(id))
+        with db.on_primary():
+            rows = query.order_by(Post.created_at.desc(), Post.id.desc()).limit(self.length).all()
+        self.store.rebuild(key, [(id, score(created_at)) for id, created_at in rows])
+
+    def apply(self, changes):
+        for change, key, *args in changes:
+            if change == 'add':
+                self.store.add(key, *args, self.length)
+            elif change == 'remove':
+                self.store.remove(key, args)
+            else:
+                self.store.invalidate(key)
+
+    def clear(self):
+        self.store.clear()
+
+
+timeline = Timeline()
+
+
+feed_changes = PendingChanges('timeline_changes', timeline.apply)
+
+
+def _loaded_tags(post):
+    tags = inspect(post).attrs.tags.loaded_value
+    return [] if tags is NO_VALUE else tags
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_added(mapper, connection, post):
+    keys = ('posts', f'user:{post.user_id}')
+    if isinstance(post.created_at, datetime):
+        feed_changes.record(object_session(post), *(('add', key, post.id, score(post.created_at)) for key in keys))
+    else:
+        # Set to something the database parses, like a string; let the feeds read it back.
+        feed_changes.record(object_session(post), *(('invalidate', key) for key in keys))
+
+
+@event.listens_for(Post, 'after_update')
+def _post_moved(mapper, connection, post):
+    state = inspect(post).attrs
+    if not (state.created_at.history.deleted or state.user_id.history.deleted):
+        return
+    keys = {'posts', f'user:{post.user_id}'}
+    keys.update(f'user:{user_id}' for user_id in state.user_id.history.deleted)
+    keys.update(f'tag:{tag.id}' for tag in _loaded_tags(post))
+    feed_changes.record(object_session(post), *(('invalidate', key) for key in keys))
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    keys = ['posts', f'user:{post.user_id}'] + [f'tag:{tag.id}' for tag in _loaded_tags(post)]
+    feed_changes.record(object_session(post), *(('remove', key, post.id) for key in keys))
+
+
+@event.listens_for(User, 'after_delete')
+@event.listens_for(Tag, 'after_delete')
+def _owner_deleted(mapper, connection, owner):
+    if isinstance(owner, User):
+        # The database deletes the user's posts along with the user.
+        feed_changes.record(object_session(owner), ('invalidate', f'user:{owner.id}'), ('invalidate', 'posts'))
+    else:
+        feed_changes.record(object_session(owner), ('invalidate', f'tag:{owner.id}'))
+
+
+@event.listens_for(PostTag, 'after_insert')
+@event.listens_for(PostTag, 'after_delete')
+def _post_tag_changed(mapper, connection, post_tag):
+    feed_changes.record(object_session(post_tag), ('invalidate', f'tag:{post_tag.tag_id}'))
+
+
+@event.listens_for(Post.tags, 'append')
+@event.listens_for(Post.tags, 'remove')
+def _post_tags_changed(post, tag, initiator):
+    feed_changes.record(object_session(post) or object_session(tag), ('invalidate', f'tag:{tag.id}'))
+
+
+@associations_changed.connect
+def _associations_written(session, post_ids, tag_ids):
+    feed_changes.record(session, *(('invalidate', f'tag:{id}') for id in tag_ids))
+
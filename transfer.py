@@ -0,0 +1,267 @@
+"""Streaming export and import of Blogly's data.
+
+Rows flow through generators from a server-side cursor to the output file,
+and from the input file to the database in fixed-size chunks, so memory use
+doesn't grow with the size of the data set.
+
+Imports are idempotent: a user or post whose id is already in the database
+is skipped if the row there is the same, and stops the import with an
+ImportConflict if it isn't, since users and posts have nothing else to
+match them by and their data would land on someone else's. Tags are matched
+by name: an imported tag whose name exists takes the existing tag's id, one
+whose id is taken by another name gets a new id, and its posts_tags rows
+follow. Each chunk is committed on its own, so an interrupted import can
+simply be run again to pick up where it stopped.
+
+On Postgres each chunk is loaded with COPY into a temporary staging table
+and merged with INSERT ... ON CONFLICT DO NOTHING. Elsewhere the chunk is
+filtered against existing keys and written with executemany.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from itertools import groupby, islice
+
+from sqlalchemy import func, select
+from models import db, User, Post, Tag, PostTag, CatalogVersion, post_text
+
+CHUNK_SIZE = 10000
+
+# Exported tables in foreign key order, with the columns that travel.
+TABLES = {
+    'users': (User.__table__, ('id', 'first_name', 'last_name', 'image_url')),
+    'tags': (Tag.__table__, ('id', 'name')),
+    'posts': (Post.__table__, ('id', 'title', 'content', 'created_at', 'user_id')),
+    'posts_tags': (PostTag.__table__, ('post_id', 'tag_id')),
+}
+
+
+class ImportConflict(Exception):
+    """An imported user or post has the id of a different row already in the database."""
+
+
+def stream_rows(name, chunk_size=CHUNK_SIZE):
+    """Yield every row of one table as a dict, in primary key order, through a server-side cursor."""
+    table, columns = TABLES[name]
+    query = (select([table.c[col] for col in columns])
+             .order_by(*table.primary_key.columns)
+             .execution_options(stream_results=True))
+    result = db.session.connection().execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_ndjson(out):
+    """Write every table to `out` as one JSON object per line, tagged with its table."""
+    count = 0
+    for name in TABLES:
+        for row in stream_rows(name):
+            out.write(json.dumps({'table': name, **{k: _plain(v) for k, v in row.items()}}))
+            out.write('\n')
+            count += 1
+    return count
+
+
+def export_csv(directory):
+    """Write each table to <directory>/<table>.csv."""
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for name, (table, columns) in TABLES.items():
+        with open(os.path.join(directory, f'{name}.csv'), 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for row in stream_rows(name):
+                writer.writerow([_plain(row[col]) for col in columns])
+                count += 1
+    return count
+
+
+def read_ndjson(lines):
+    """Yield (table, row) pairs from NDJSON lines."""
+    for line in lines:
+        if line.strip():
+            row = json.loads(line)
+            yield row.pop('table'), row
+
+
+def read_csv(directory):
+    """Yield (table, row) pairs from the files written by export_csv, in foreign key order.
+
+    CSV can't tell an empty string from a missing value, so empty fields
+    become None only in nullable columns.
+    """
+    for name, (table, columns) in TABLES.items():
+        path = os.path.join(directory, f'{name}.csv')
+        if not os.path.exists(path):
+            continue
+        nullable = {col for col in columns if table.c[col].nullable}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                yield name, {k: (None if v == '' and k in nullable else v) for k, v in row.items()}
+
+
+def import_rows(pairs, chunk_size=CHUNK_SIZE, progress=None):
+    """Load (table, row) pairs, committing one chunk at a time. Returns the rows seen per table."""
+    seen = {}
+    # Imported tag id: the id it has in this database.
+    tag_ids = {}
+    for name, group in groupby(pairs, key=lambda pair: pair[0]):
+        if name not in TABLES:
+            raise ValueError(f'Unknown table {name!r}')
+        rows = (row for _, row in group)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            _load_chunk(name, chunk, tag_ids)
+            db.session.commit()
+            seen[name] = seen.get(name, 0) + len(chunk)
+            if progress:
+                progress(name, seen[name])
+
+    _reset_sequences()
+    db.session.commit()
+    return seen
+
+
+def _load_chunk(name, chunk, tag_ids):
+    table, columns = TABLES[name]
+    rows = [_coerce(table, columns, row) for row in chunk]
+    if name in ('users', 'posts'):
+        rows = _new_rows(name, table, columns, rows)
+    elif name == 'tags':
+        rows = _new_tags(rows, tag_ids)
+    else:
+        rows = [{**row, 'tag_id': tag_ids.get(row['tag_id'], row['tag_id'])} for row in rows]
+    if not rows:
+        return
+
+    if name == 'posts':
+        # Exports leave out what's derived from content; work it out on the way in.
+        rows = [{**row, **post_text(row['content'])} for row in rows]
+        columns += ('excerpt', 'rendered_html')
+    elif name == 'posts_tags':
+        # Each row carries its post's created_at, to sit in the same partition.
+        created = dict(db.session.query(Post.id, Post.created_at)
+                       .filter(Post.id.in_({row['post_id'] for row in rows})))
+        rows = [{**row, 'post_created_at': created.get(row['post_id'])} for row in rows]
+        columns += ('post_created_at',)
+    if db.session.bind.dialect.name == 'postgresql':
+        _copy_chunk(table, columns, rows)
+    else:
+        _insert_chunk(table, columns, rows)
+    if name == 'tags':
+        # Rows written here skip the ORM events that keep tagindex.py current.
+        CatalogVersion.bump(db.session.connection(), name)
+
+
+def _new_rows(name, table, columns, rows):
+    """The rows whose ids are free. Raises ImportConflict if an id belongs to a different row."""
+    existing = {row.id: dict(zip(columns, row)) for row in db.session.execute(
+        select([table.c[col] for col in columns]).where(table.c.id.in_([row['id'] for row in rows])))}
+    for row in rows:
+        if row['id'] in existing and existing[row['id']] != row:
+            raise ImportConflict(f'{name} {row["id"]} in the import differs from {name} {row["id"]} in the database')
+    return [row for row in rows if row['id'] not in existing]
+
+
+def _new_tags(rows, tag_ids):
+    """The tags to load as they are, after mapping the others onto this database's ids."""
+    tags = Tag.__table__
+    by_name = dict(db.session.execute(
+        select([tags.c.name, tags.c.id]).where(tags.c.name.in_([row['name'] for row in rows]))).fetchall())
+    taken = {id for (id,) in db.session.execute(
+        select([tags.c.id]).where(tags.c.id.in_([row['id'] for row in rows])))}
+    # Past every id in the table and the chunk, so it can't collide with either.
+    next_id = max(db.session.execute(select([func.max(tags.c.id)])).scalar() or 0,
+                  *(row['id'] for row in rows)) + 1
+
+    fresh = []
+    for row in rows:
+        if row['name'] in by_name:
+            tag_ids[row['id']] = by_name[row['name']]
+        elif row['id'] in taken:
+            db.session.execute(tags.insert().values(id=next_id, name=row['name']))
+            tag_ids[row['id']] = by_name[row['name']] = next_id
+            next_id += 1
+        else:
+            fresh.append(row)
+            by_name[row['name']] = row['id']
+    return fresh
+
+
+def _coerce(table, columns, row):
+    values = {}
+    for col in columns:
+        value = row.get(col)
+        if isinstance(value, str) and table.c[col].type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        elif isinstance(value, str) and table.c[col].type.python_type is int:
+            value = int(value)
+        values[col] = value
+    return values
+
+
+def _copy_chunk(table, columns, rows):
+    """COPY rows into a staging table, then merge them in, skipping any that already exist."""
+    column_list = ', '.join(columns)
+    stage = f'import_{table.name}'
+    conn = db.session.connection()
+    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {stage} AS '
+                 f'SELECT {column_list} FROM {table.name} WITH NO DATA')
+    conn.execute(f'TRUNCATE {stage}')
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_text(row[col]) for col in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(f'COPY {stage} ({column_list}) FROM STDIN', buffer)
+    conn.execute(f'INSERT INTO {table.name} ({column_list}) '
+                 f'SELECT {column_list} FROM {stage} ON CONFLICT DO NOTHING')
+
+
+def _copy_text(value):
+    """Encode one value for COPY's text format."""
+    if value is None:
+        return '\\N'
+    return (str(_plain(value)).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _insert_chunk(table, columns, rows):
+    """Insert the rows whose keys aren't taken yet with one executemany."""
+    keys = [col.name for col in table.primary_key.columns]
+    lead = table.c[keys[0]]
+    taken = {tuple(row) for row in db.session.execute(
+        select([table.c[key] for key in keys]).where(lead.in_({row[keys[0]] for row in rows})))}
+
+    fresh = []
+    for row in rows:
+        key = tuple(row[k] for k in keys)
+        if key not in taken:
+            taken.add(key)
+            fresh.append(row)
+    if fresh:
+        db.session.execute(table.insert(), fresh)
+
+
+def _reset_sequences():
+    """Move id sequences past the imported ids so new rows don't collide with them."""
+    if db.session.bind.dialect.name != 'postgresql':
+        return
+    for name in ('users', 'tags', 'posts'):
+        db.session.execute(f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                           f"coalesce((SELECT max(id) FROM {name}), 0) + 1, false)")
@@ -0,0 +1,9 @@
+"""The app built from the BLOGLY_CONFIG profile, for `flask` and WSGI servers.
+
+The flask command loads this module by default. app.py only defines
+create_app(), so importing it, as `gunicorn "app:create_app('production')"`
+does, doesn't build an app of its own first.
+"""
+from app import create_app
+
+app = create_app()